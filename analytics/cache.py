@@ -0,0 +1,116 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .services import AnalyticsQueryService
+
+
+class AnalyticsCache:
+    """Versioned cache of analytics reports.
+
+    Keys embed a per-year data version and a global label version. Application
+    writes bump the version of the year they touch, renaming a source, reason,
+    direction or group bumps the label version, so cached reports are never
+    deleted, just no longer addressed. Closed years are kept without expiry.
+
+    Without a shared cache a bump only reaches the process that made it, so
+    every report then expires after `local_timeout` instead.
+    """
+
+    prefix = "analytics"
+    current_year_timeout = 60 * 5
+    local_timeout = 30
+    lock_timeout = 30
+    wait_interval = 0.05
+
+    # Striped so the set of locks stays fixed as versioned keys come and go
+    _locks = [threading.Lock() for _ in range(64)]
+
+    @classmethod
+    def version_key(cls, scope):
+        return f"{cls.prefix}:version:{scope}"
+
+    @classmethod
+    def get_version(cls, scope):
+        key = cls.version_key(scope)
+        version = cache.get(key)
+        if version is None:
+            # A fresh time-based version never collides with one that was evicted
+            cache.add(key, time.time_ns(), None)
+            version = cache.get(key)
+        return version
+
+    @classmethod
+    def bump(cls, scope):
+        key = cls.version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), None)
+
+    @classmethod
+    def bump_years(cls, *years):
+        for year in set(years):
+            cls.bump(year)
+
+    @classmethod
+    def bump_labels(cls):
+        cls.bump("labels")
+
+    @classmethod
+    def get_timeout(cls, year):
+        if not settings.SHARED_CACHE:
+            return cls.local_timeout
+        return None if year < timezone.now().year else cls.current_year_timeout
+
+    @classmethod
+    def get_report(cls, year, sections=None):
+        sections = [
+            section
+            for section in AnalyticsQueryService.sections
+            if section in (sections or AnalyticsQueryService.sections)
+        ]
+        key = "{}:report:{}:v{}:l{}:{}".format(
+            cls.prefix,
+            year,
+            cls.get_version(year),
+            cls.get_version("labels"),
+            ",".join(sections),
+        )
+        return cls.get_or_compute(
+            key,
+            lambda: AnalyticsQueryService.report(year, sections),
+            cls.get_timeout(year),
+        )
+
+    @classmethod
+    def get_local_lock(cls, key):
+        return cls._locks[hash(key) % len(cls._locks)]
+
+    @classmethod
+    def get_or_compute(cls, key, compute, timeout):
+        """Single-flight read-through: one caller computes, the others wait for it."""
+        value = cache.get(key)
+        if value is not None:
+            return value
+        # Threads of this process queue up here, processes on the cache lock below
+        with cls.get_local_lock(key):
+            lock_key = f"{key}:lock"
+            deadline = time.monotonic() + cls.lock_timeout
+            while True:
+                value = cache.get(key)
+                if value is not None:
+                    return value
+                if cache.add(lock_key, 1, cls.lock_timeout):
+                    try:
+                        value = compute()
+                        cache.set(key, value, timeout)
+                    finally:
+                        cache.delete(lock_key)
+                    return value
+                if time.monotonic() >= deadline:
+                    return compute()
+                time.sleep(cls.wait_interval)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from analytics.services import ApplicationRollupService
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily application rollups from the applications table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--year", type=int, help="Only rebuild this year")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        ApplicationRollupService.rebuild(
+            year=options["year"], batch_size=options["batch_size"]
+        )
+        count = ApplicationRollupService.model.objects.count()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} rollup rows"))
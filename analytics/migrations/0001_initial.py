@@ -0,0 +1,32 @@
+# Generated by Django 4.1.5 on 2026-10-18 08:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('applications', '0026_searchdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApplicationDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('transaction', models.BooleanField(default=False)),
+                ('amount', models.IntegerField(default=0)),
+                ('direction', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='applications.direction')),
+                ('rejection_reason', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='applications.rejectionreason')),
+                ('source', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='applications.source')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='applicationdailystat',
+            index=models.Index(fields=['day', 'transaction'], name='application_daily_stat_idx'),
+        ),
+    ]
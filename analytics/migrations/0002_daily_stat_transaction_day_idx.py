@@ -0,0 +1,21 @@
+# Generated by Django 4.1.5 on 2026-10-18 08:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='applicationdailystat',
+            name='application_daily_stat_idx',
+        ),
+        migrations.AddIndex(
+            model_name='applicationdailystat',
+            index=models.Index(fields=['transaction', 'day'], name='application_daily_stat_idx'),
+        ),
+    ]
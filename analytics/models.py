@@ -1,3 +1,31 @@
 from django.db import models
 
-# Create your models here.
+from applications.models import Direction, RejectionReason, Source
+
+
+class ApplicationDailyStat(models.Model):
+    """Number of applications created on `day` per analytics dimension.
+
+    `direction` is the direction of the application's group, which is what the
+    groups analytics report on. Rows are maintained incrementally from
+    Application signals and can be recomputed with `rebuild_analytics_rollups`.
+    """
+
+    day = models.DateField()
+    source = models.ForeignKey(Source, on_delete=models.CASCADE, null=True)
+    rejection_reason = models.ForeignKey(
+        RejectionReason, on_delete=models.SET_NULL, null=True
+    )
+    direction = models.ForeignKey(Direction, on_delete=models.CASCADE, null=True)
+    transaction = models.BooleanField(default=False)
+    amount = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["transaction", "day"], name="application_daily_stat_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.day}: {self.amount}"
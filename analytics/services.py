@@ -0,0 +1,440 @@
+import datetime
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Func, IntegerField, Q, Sum, Value, Window
+from django.db.models.functions import ExtractMonth, Lead, TruncDate
+from django.utils import timezone
+
+from applications.models import Application, ApplicationStatusTransition, Groups
+
+from .models import ApplicationDailyStat
+
+
+class ApplicationRollupService:
+    model = ApplicationDailyStat
+    # (day, source, rejection_reason, direction, transaction)
+    key_fields = (
+        "day",
+        "source_id",
+        "rejection_reason_id",
+        "direction_id",
+        "transaction",
+    )
+
+    @classmethod
+    def state(cls, application, direction_id=None):
+        """Rollup key of a single application instance."""
+        if direction_id is None and application.groups_id is not None:
+            direction_id = (
+                Groups.objects.filter(pk=application.groups_id)
+                .values_list("direction_id", flat=True)
+                .first()
+            )
+        return (
+            timezone.localtime(application.created_at).date(),
+            application.source_id,
+            application.rejection_reason_id,
+            direction_id,
+            application.transaction,
+        )
+
+    @classmethod
+    def snapshot(cls, queryset):
+        """Rollup keys of many applications in one query, by application id."""
+        rows = queryset.order_by().values_list(
+            "id",
+            "created_at",
+            "source_id",
+            "rejection_reason_id",
+            "groups__direction_id",
+            "transaction",
+        )
+        return {
+            pk: (timezone.localtime(created_at).date(), *keys)
+            for pk, created_at, *keys in rows.iterator()
+        }
+
+    @classmethod
+    def apply(cls, removed=(), added=()):
+        """Move counts from the `removed` keys to the `added` ones."""
+        deltas = Counter(added)
+        deltas.subtract(Counter(removed))
+        with transaction.atomic():
+            for key, delta in deltas.items():
+                if delta:
+                    cls.bump(key, delta)
+
+    @classmethod
+    def bump(cls, key, delta):
+        # Several rows may share a key (racing inserts, SET_NULL on a deleted
+        # rejection reason); readers sum them, so only one of them is moved.
+        lookup = dict(zip(cls.key_fields, key))
+        pk = cls.model.objects.filter(**lookup).values_list("pk", flat=True).first()
+        if pk is not None:
+            cls.model.objects.filter(pk=pk).update(amount=F("amount") + delta)
+        elif delta > 0:
+            cls.model.objects.create(amount=delta, **lookup)
+
+    @classmethod
+    def move_group(cls, group_id, direction_id):
+        """Move a group's applications from `direction_id` to the group's current one.
+
+        Returns the years whose rollups changed.
+        """
+        after = cls.snapshot(Application.objects.filter(groups_id=group_id))
+        before = [
+            (day, source_id, reason_id, direction_id, is_transaction)
+            for day, source_id, reason_id, _, is_transaction in after.values()
+        ]
+        cls.apply(removed=before, added=after.values())
+        return {state[0].year for state in after.values()}
+
+    @classmethod
+    def rebuild(cls, year=None, batch_size=1000):
+        """Recompute all rollups, or only the days of `year`."""
+        applications = Application.objects.all()
+        stats = cls.model.objects.all()
+        if year is not None:
+            start, end = AnalyticsQueryService.year_range(year)
+            applications = applications.filter(created_at__gte=start, created_at__lt=end)
+            start, end = AnalyticsQueryService.year_bounds(year)
+            stats = stats.filter(day__gte=start, day__lt=end)
+        rows = (
+            applications.order_by()
+            .values_list(
+                TruncDate("created_at"),
+                "source_id",
+                "rejection_reason_id",
+                "groups__direction_id",
+                "transaction",
+            )
+            .annotate(amount=Count("id"))
+        )
+        with transaction.atomic():
+            stats.delete()
+            cls.model.objects.bulk_create(
+                (
+                    cls.model(amount=amount, **dict(zip(cls.key_fields, key)))
+                    for *key, amount in rows.iterator()
+                ),
+                batch_size=batch_size,
+            )
+
+
+class TotalOver(Func):
+    """`SUM(<aggregate>) OVER ()`: the grand total repeated on every grouped row."""
+
+    template = "SUM(%(expressions)s) OVER ()"
+    output_field = IntegerField()
+    contains_over_clause = True
+
+
+class AnalyticsQueryService:
+    """Per-year breakdowns, read from the rollups or straight from Application.
+
+    Years are filtered with half-open ranges (`>= Jan 1 AND < Jan 1 next year`)
+    so the (transaction, created_at) / (transaction, day) indexes serve them,
+    and the total comes back with the rows through a window sum.
+    """
+
+    # name -> (transaction, output columns over the rollup, same over Application)
+    dimensions = {
+        "rejection_reason": (
+            False,
+            {"title": "rejection_reason__title", "color": "rejection_reason__color"},
+            {"title": "rejection_reason__title", "color": "rejection_reason__color"},
+        ),
+        "source": (
+            True,
+            {"source_title": "source__name", "color": "source__color"},
+            {"source_title": "source__name", "color": "source__color"},
+        ),
+        "direction": (
+            True,
+            {"direction_name": "direction__name", "color": "direction__color"},
+            {
+                "direction_name": "groups__direction__name",
+                "color": "groups__direction__color",
+            },
+        ),
+    }
+
+    @staticmethod
+    def year_bounds(year):
+        return datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+
+    @classmethod
+    def year_range(cls, year):
+        start, end = cls.year_bounds(year)
+        tz = timezone.get_current_timezone()
+        return (
+            timezone.make_aware(datetime.datetime.combine(start, datetime.time()), tz),
+            timezone.make_aware(datetime.datetime.combine(end, datetime.time()), tz),
+        )
+
+    @staticmethod
+    def label_ordering(columns):
+        # NULL labels last on every backend, as `report` sorts them
+        return [F(path).asc(nulls_last=True) for path in columns.values()]
+
+    @classmethod
+    def rollup_queryset(cls, year, dimension):
+        is_transaction, columns, _ = cls.dimensions[dimension]
+        start, end = cls.year_bounds(year)
+        return (
+            ApplicationDailyStat.objects.filter(
+                transaction=Value(is_transaction), day__gte=start, day__lt=end
+            )
+            .values(**{name: F(path) for name, path in columns.items()})
+            # The window must see the column, not the `amount` annotation below
+            .annotate(total_amount=TotalOver(Sum("amount")))
+            .annotate(amount=Sum("amount"))
+            .filter(amount__gt=0)
+            .order_by(*cls.label_ordering(columns))
+        )
+
+    @classmethod
+    def live_queryset(cls, year, dimension):
+        is_transaction, _, columns = cls.dimensions[dimension]
+        start, end = cls.year_range(year)
+        return (
+            Application.objects.filter(
+                # An explicit `= %s` instead of a bare boolean column predicate,
+                # which SQLite cannot match against the index
+                transaction=Value(is_transaction),
+                created_at__gte=start,
+                created_at__lt=end,
+            )
+            .values(**{name: F(path) for name, path in columns.items()})
+            .annotate(amount=Count("id"), total_amount=TotalOver(Count("id")))
+            .order_by(*cls.label_ordering(columns))
+        )
+
+    @classmethod
+    def breakdown(cls, year, dimension, live=False):
+        """Return `(rows, total)` for one dimension of `year` in a single query."""
+        queryset = (cls.live_queryset if live else cls.rollup_queryset)(year, dimension)
+        rows = list(queryset)
+        total = 0
+        for row in rows:
+            total = row.pop("total_amount")
+            row["year"] = year
+        return rows, total
+
+    sections = ("rejection_reason", "source", "direction", "totals", "monthly")
+
+    @classmethod
+    def facts_queryset(cls, year, live=False):
+        """Every dimension, the month and accepted/rejected counts, grouped once.
+
+        The conditional aggregates split each group by `transaction`, so a
+        single scan feeds all breakdowns, the totals and the monthly series.
+        """
+        if live:
+            start, end = cls.year_range(year)
+            queryset = Application.objects.filter(
+                created_at__gte=start, created_at__lt=end
+            )
+            month, aggregate, field, column = ExtractMonth("created_at"), Count, "id", 2
+        else:
+            start, end = cls.year_bounds(year)
+            queryset = ApplicationDailyStat.objects.filter(day__gte=start, day__lt=end)
+            month, aggregate, field, column = ExtractMonth("day"), Sum, "amount", 1
+        values = {
+            f"{dimension}__{name}": F(path)
+            for dimension, spec in cls.dimensions.items()
+            for name, path in spec[column].items()
+        }
+        return (
+            queryset.order_by()
+            .values(month=month, **values)
+            .annotate(
+                accepted=aggregate(field, filter=Q(transaction=True)),
+                rejected=aggregate(field, filter=Q(transaction=False)),
+            )
+        )
+
+    @classmethod
+    def report(cls, year, sections=None, live=False):
+        """Return the requested sections of the `year` analytics in one query."""
+        sections = [
+            section for section in cls.sections if section in (sections or cls.sections)
+        ]
+        breakdowns = [section for section in sections if section in cls.dimensions]
+        if len(sections) == 1 and breakdowns:
+            # A lone breakdown is cheaper as its own grouped query
+            rows, total = cls.breakdown(year, breakdowns[0], live=live)
+            return {breakdowns[0]: {"result": rows, "total_amount": total}}
+
+        counters = {dimension: Counter() for dimension in cls.dimensions}
+        monthly = {month: Counter() for month in range(1, 13)}
+        for row in cls.facts_queryset(year, live=live).iterator():
+            accepted, rejected = row.pop("accepted") or 0, row.pop("rejected") or 0
+            month = monthly[row.pop("month")]
+            month["transactions"] += accepted
+            month["rejections"] += rejected
+            for dimension, (is_transaction, columns, _) in cls.dimensions.items():
+                amount = accepted if is_transaction else rejected
+                if amount:
+                    key = tuple(row[f"{dimension}__{name}"] for name in columns)
+                    counters[dimension][key] += amount
+
+        report = {}
+        for dimension in breakdowns:
+            names = list(cls.dimensions[dimension][1])
+            counter = counters[dimension]
+            # NULL labels last, as `label_ordering` sorts the single breakdowns
+            keys = sorted(
+                counter, key=lambda key: [(value is None, value or "") for value in key]
+            )
+            report[dimension] = {
+                "result": [
+                    {"year": year, **dict(zip(names, key)), "amount": counter[key]}
+                    for key in keys
+                ],
+                "total_amount": sum(counter.values()),
+            }
+        if "totals" in sections:
+            transactions = sum(month["transactions"] for month in monthly.values())
+            rejections = sum(month["rejections"] for month in monthly.values())
+            report["totals"] = {
+                "applications": transactions + rejections,
+                "transactions": transactions,
+                "rejections": rejections,
+            }
+        if "monthly" in sections:
+            report["monthly"] = [
+                {
+                    "month": number,
+                    "applications": month["transactions"] + month["rejections"],
+                    "transactions": month["transactions"],
+                    "rejections": month["rejections"],
+                }
+                for number, month in monthly.items()
+            ]
+        return report
+
+
+class StageAnalyticsService:
+    """Funnel conversion and time in stage, read from the status transitions.
+
+    Each transition is the moment an application entered `to_stage`. `LEAD()`
+    over the application's transitions gives the stage it moved to next and
+    when, so every report is one query wrapped around that window. Only the
+    lower bound of the period goes into the windowed query: later transitions
+    must stay visible to `LEAD()`, the upper bound is applied on top of it.
+    """
+
+    model = ApplicationStatusTransition
+    failed_stage = 4
+    # name -> (id column, label column)
+    dimensions = {
+        "source": ("application__source_id", "application__source__name"),
+        "direction": ("application__direction_id", "application__direction__name"),
+    }
+    durations = {
+        "postgresql": "EXTRACT(EPOCH FROM (left_at - entered_at))",
+        "sqlite": "(julianday(left_at) - julianday(entered_at)) * 86400.0",
+    }
+
+    @staticmethod
+    def period_range(start, end):
+        """Aware datetimes for the dates `start` to `end`, both included."""
+        tz = timezone.get_current_timezone()
+        return (
+            timezone.make_aware(datetime.datetime.combine(start, datetime.time()), tz),
+            timezone.make_aware(
+                datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time()),
+                tz,
+            ),
+        )
+
+    @classmethod
+    def stays_sql(cls, start, dimension=None):
+        """SQL of every stay in a stage entered since `start`, with the next one."""
+        window = {
+            "partition_by": [F("application_id")],
+            "order_by": [F("created_at").asc(), F("id").asc()],
+        }
+        columns = {
+            "stage": F("to_stage"),
+            "entered_at": F("created_at"),
+            "next_stage": Window(Lead("to_stage"), **window),
+            "left_at": Window(Lead("created_at"), **window),
+        }
+        if dimension is not None:
+            key, label = cls.dimensions[dimension]
+            columns.update(dimension_id=F(key), label=F(label))
+        queryset = (
+            cls.model.objects.filter(created_at__gte=start).order_by().values(**columns)
+        )
+        return queryset.query.sql_with_params()
+
+    @classmethod
+    def execute(cls, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    @classmethod
+    def stage_name(cls, stage):
+        return dict(cls.model.STAGE_CHOICES).get(stage)
+
+    @classmethod
+    def funnel(cls, start, end, dimension=None):
+        """Per stage: how many entered it, moved further down the funnel, or failed."""
+        start, end = cls.period_range(start, end)
+        stays, params = cls.stays_sql(start, dimension)
+        group = "dimension_id, label, " if dimension else ""
+        sql = (
+            f"SELECT {group}stage, COUNT(*) AS entered, "
+            f"COUNT(CASE WHEN next_stage <> %s AND next_stage > stage THEN 1 END) AS advanced, "
+            f"COUNT(CASE WHEN next_stage = %s THEN 1 END) AS failed "
+            f"FROM ({stays}) stays "
+            f"WHERE entered_at < %s AND stage IS NOT NULL "
+            f"GROUP BY {group}stage ORDER BY {group}stage"
+        )
+        rows = cls.execute(
+            sql,
+            [
+                cls.failed_stage,
+                cls.failed_stage,
+                *params,
+                connection.ops.adapt_datetimefield_value(end),
+            ],
+        )
+        for row in rows:
+            row["stage_name"] = cls.stage_name(row["stage"])
+            row["conversion"] = round(row["advanced"] / row["entered"], 4)
+        return rows
+
+    @classmethod
+    def time_in_stage(cls, start, end, dimension=None):
+        """Median and average seconds spent in each stage before leaving it."""
+        start, end = cls.period_range(start, end)
+        stays, params = cls.stays_sql(start, dimension)
+        group = "dimension_id, label, " if dimension else ""
+        partition = f"{group}stage"
+        sql = (
+            f"SELECT {group}stage, MAX(total) AS exited, "
+            f"AVG(CASE WHEN stay_rank IN ((total + 1) / 2, (total + 2) / 2) "
+            f"THEN duration END) AS median_seconds, "
+            f"AVG(duration) AS average_seconds "
+            f"FROM ("
+            f"SELECT {group}stage, duration, "
+            f"ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY duration) AS stay_rank, "
+            f"COUNT(*) OVER (PARTITION BY {partition}) AS total "
+            f"FROM (SELECT {group}stage, {cls.durations[connection.vendor]} AS duration "
+            f"FROM ({stays}) stays "
+            f"WHERE entered_at < %s AND left_at IS NOT NULL AND stage IS NOT NULL) durations"
+            f") ranked "
+            f"GROUP BY {group}stage ORDER BY {group}stage"
+        )
+        rows = cls.execute(sql, [*params, connection.ops.adapt_datetimefield_value(end)])
+        for row in rows:
+            row["stage_name"] = cls.stage_name(row["stage"])
+            row["median_seconds"] = float(row["median_seconds"])
+            row["average_seconds"] = float(row["average_seconds"])
+        return rows
@@ -0,0 +1,96 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from applications.models import Application, Direction, Groups, RejectionReason, Source
+from applications.signals import post_bulk_save, pre_bulk_save
+
+from .cache import AnalyticsCache
+from .services import ApplicationRollupService
+
+
+@receiver(pre_save, sender=Application)
+def remember_rollup_state(sender, instance, raw=False, **kwargs):
+    instance._rollup_state = None
+    if not raw and instance.pk is not None:
+        snapshot = ApplicationRollupService.snapshot(
+            Application.objects.filter(pk=instance.pk)
+        )
+        instance._rollup_state = snapshot.get(instance.pk)
+
+
+@receiver(post_save, sender=Application)
+def update_rollups(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    before = getattr(instance, "_rollup_state", None)
+    after = ApplicationRollupService.state(instance)
+    ApplicationRollupService.apply(
+        removed=[before] if before else [],
+        added=[after],
+    )
+    years = [state[0].year for state in (before, after) if state]
+    transaction.on_commit(lambda: AnalyticsCache.bump_years(*years))
+
+
+@receiver(pre_delete, sender=Application)
+def remember_deleted_rollup_state(sender, instance, **kwargs):
+    snapshot = ApplicationRollupService.snapshot(
+        Application.objects.filter(pk=instance.pk)
+    )
+    instance._rollup_state = snapshot.get(instance.pk)
+
+
+@receiver(post_delete, sender=Application)
+def remove_from_rollups(sender, instance, **kwargs):
+    before = getattr(instance, "_rollup_state", None)
+    if before:
+        ApplicationRollupService.apply(removed=[before])
+        transaction.on_commit(lambda: AnalyticsCache.bump_years(before[0].year))
+
+
+@receiver(pre_bulk_save, sender=Application)
+def remember_bulk_rollup_state(sender, ids, context, **kwargs):
+    context["rollup_state"] = ApplicationRollupService.snapshot(
+        Application.objects.filter(pk__in=ids)
+    )
+
+
+@receiver(post_bulk_save, sender=Application)
+def update_bulk_rollups(sender, ids, context, **kwargs):
+    before = context.get("rollup_state", {})
+    after = ApplicationRollupService.snapshot(Application.objects.filter(pk__in=ids))
+    ApplicationRollupService.apply(removed=before.values(), added=after.values())
+    years = {state[0].year for state in [*before.values(), *after.values()]}
+    transaction.on_commit(lambda: AnalyticsCache.bump_years(*years))
+
+
+@receiver(pre_save, sender=Groups)
+def remember_group_direction(sender, instance, raw=False, **kwargs):
+    instance._rollup_group = None
+    if not raw and instance.pk is not None:
+        instance._rollup_group = (
+            Groups.objects.filter(pk=instance.pk).values("direction_id").first()
+        )
+
+
+@receiver(post_save, sender=Groups)
+def update_group_rollups(sender, instance, raw=False, **kwargs):
+    # Rollups key applications on their group's direction at write time
+    before = getattr(instance, "_rollup_group", None)
+    if raw or before is None or before["direction_id"] == instance.direction_id:
+        return
+    years = ApplicationRollupService.move_group(instance.pk, before["direction_id"])
+    transaction.on_commit(lambda: AnalyticsCache.bump_years(*years))
+
+
+@receiver(post_save, sender=Source)
+@receiver(post_save, sender=RejectionReason)
+@receiver(post_save, sender=Direction)
+@receiver(post_save, sender=Groups)
+@receiver(post_delete, sender=Source)
+@receiver(post_delete, sender=RejectionReason)
+@receiver(post_delete, sender=Direction)
+@receiver(post_delete, sender=Groups)
+def invalidate_analytics_labels(sender, **kwargs):
+    transaction.on_commit(AnalyticsCache.bump_labels)
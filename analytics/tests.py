@@ -1,3 +1,343 @@
+import datetime
+import threading
+import time
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from applications.models import (
+    Application,
+    ApplicationStatusTransition,
+    Direction,
+    Groups,
+    RejectionReason,
+    Source,
+)
+from users.models import Student
+
+from .cache import AnalyticsCache
+from .services import (
+    AnalyticsQueryService,
+    ApplicationRollupService,
+    StageAnalyticsService,
+)
+
+
+class AnalyticsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.direction = Direction.objects.create(name="Python", duration=3)
+        cls.groups = Groups.objects.create(
+            name="Python-1", direction=cls.direction, start_date=datetime.date.today()
+        )
+        cls.sources = [Source.objects.create(name=name) for name in ("Instagram", "Site")]
+        cls.reason = RejectionReason.objects.create(title="Expensive")
+        student = Student.objects.create(email="student@example.com", phone="+996555000001")
+        cls.year = timezone.now().year
+        for i in range(12):
+            application = Application.objects.create(
+                student=student,
+                direction=cls.direction,
+                source=cls.sources[i % 2],
+                groups=cls.groups if i % 3 else None,
+                rejection_reason=cls.reason if i % 4 else None,
+                transaction=bool(i % 2),
+            )
+            if i < 4:
+                # Last second of the previous year must not leak into this one
+                Application.objects.filter(pk=application.pk).update(
+                    created_at=datetime.datetime(
+                        cls.year - 1, 12, 31, 23, 59, 59, tzinfo=datetime.timezone.utc
+                    )
+                )
+        ApplicationRollupService.rebuild()
+
+
+class AnalyticsQueryTests(AnalyticsTestCase):
+    def test_rollup_and_live_breakdowns_agree(self):
+        for year in (self.year - 1, self.year):
+            for dimension in AnalyticsQueryService.dimensions:
+                with self.assertNumQueries(1):
+                    rollup = AnalyticsQueryService.breakdown(year, dimension)
+                live = AnalyticsQueryService.breakdown(year, dimension, live=True)
+                self.assertEqual(rollup, live)
+
+    def test_total_matches_rows(self):
+        rows, total = AnalyticsQueryService.breakdown(self.year, "source")
+        self.assertEqual(total, 4)
+        self.assertEqual(total, sum(row["amount"] for row in rows))
+        self.assertEqual({row["year"] for row in rows}, {self.year})
+
+    def test_empty_year(self):
+        self.assertEqual(AnalyticsQueryService.breakdown(1999, "direction"), ([], 0))
+
+
+class ApplicationRollupTests(AnalyticsTestCase):
+    def assertRollupsMatchLive(self):
+        for year in (self.year - 1, self.year):
+            for dimension in AnalyticsQueryService.dimensions:
+                with self.subTest(year=year, dimension=dimension):
+                    self.assertEqual(
+                        AnalyticsQueryService.breakdown(year, dimension),
+                        AnalyticsQueryService.breakdown(year, dimension, live=True),
+                    )
+
+    def test_application_writes_move_rollups(self):
+        application = Application.objects.create(
+            student=Student.objects.first(),
+            direction=self.direction,
+            source=self.sources[0],
+            groups=self.groups,
+            transaction=True,
+        )
+        self.assertRollupsMatchLive()
+
+        application.source = self.sources[1]
+        application.rejection_reason = self.reason
+        application.save()
+        self.assertRollupsMatchLive()
+
+        application.delete()
+        self.assertRollupsMatchLive()
+
+    def test_group_direction_change_moves_its_applications(self):
+        other = Direction.objects.create(name="Java", duration=6)
+        self.groups.direction = other
+        self.groups.save()
+        self.assertRollupsMatchLive()
+        rows, _ = AnalyticsQueryService.breakdown(self.year, "direction")
+        self.assertIn("Java", {row["direction_name"] for row in rows})
+
+        self.groups.direction = self.direction
+        self.groups.save()
+        self.assertRollupsMatchLive()
+
+    def test_group_save_without_direction_change_keeps_rollups(self):
+        self.groups.name = "Python-2"
+        with mock.patch.object(ApplicationRollupService, "move_group") as move_group:
+            self.groups.save()
+        move_group.assert_not_called()
+        self.assertRollupsMatchLive()
+
+    def test_group_delete_drops_its_applications(self):
+        self.groups.delete()
+        self.assertRollupsMatchLive()
+
+
+class AnalyticsIndexUsageTests(TestCase):
+    index = "application_trans_created_idx"
+
+    def explain(self, queryset):
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                # Tiny test tables would otherwise always be scanned sequentially
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        return queryset.explain()
+
+    @skipUnless(connection.vendor == "postgresql", "Postgres EXPLAIN format")
+    def test_live_breakdown_uses_index_on_postgres(self):
+        for dimension in AnalyticsQueryService.dimensions:
+            plan = self.explain(AnalyticsQueryService.live_queryset(2024, dimension))
+            self.assertIn(self.index, plan)
+            self.assertNotIn("date_part", plan)
+            self.assertNotIn("EXTRACT", plan.upper())
+
+    @skipUnless(connection.vendor == "postgresql", "Postgres EXPLAIN format")
+    def test_rollup_breakdown_uses_index_on_postgres(self):
+        plan = self.explain(AnalyticsQueryService.rollup_queryset(2024, "source"))
+        self.assertIn("application_daily_stat_idx", plan)
+
+    @skipUnless(connection.vendor == "sqlite", "SQLite EXPLAIN QUERY PLAN format")
+    def test_live_breakdown_uses_index_on_sqlite(self):
+        for dimension in AnalyticsQueryService.dimensions:
+            plan = self.explain(AnalyticsQueryService.live_queryset(2024, dimension))
+            self.assertIn(f"USING INDEX {self.index}", plan)
+
+
+class AnalyticsDashboardTests(AnalyticsTestCase):
+    def test_dashboard_matches_single_breakdowns(self):
+        for live in (False, True):
+            with self.assertNumQueries(1):
+                report = AnalyticsQueryService.report(self.year, live=live)
+            for dimension in AnalyticsQueryService.dimensions:
+                rows, total = AnalyticsQueryService.breakdown(self.year, dimension, live=live)
+                self.assertEqual(report[dimension]["total_amount"], total)
+                self.assertEqual(report[dimension]["result"], rows)
+
+    def test_null_labels_sort_last(self):
+        for live in (False, True):
+            for dimension, label in (("rejection_reason", "title"), ("direction", "direction_name")):
+                rows, _ = AnalyticsQueryService.breakdown(self.year, dimension, live=live)
+                labels = [row[label] for row in rows]
+                self.assertIsNone(labels[-1])
+                self.assertNotIn(None, labels[:-1])
+
+    def test_dashboard_totals_and_monthly_series(self):
+        report = AnalyticsQueryService.report(self.year, ["totals", "monthly"])
+        self.assertEqual(set(report), {"totals", "monthly"})
+        self.assertEqual(
+            report["totals"], {"applications": 8, "transactions": 4, "rejections": 4}
+        )
+        self.assertEqual(len(report["monthly"]), 12)
+        self.assertEqual(sum(month["applications"] for month in report["monthly"]), 8)
+
+    def test_dashboard_endpoint_rejects_unknown_sections(self):
+        response = self.client.get(
+            reverse("dashboard_analytics", args=[self.year]), {"sections": "source,foo"}
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            reverse("dashboard_analytics", args=[self.year]), {"sections": "source,totals"}
+        )
+        self.assertEqual(set(response.data), {"year", "source", "totals"})
+
+
+class AnalyticsCacheTests(AnalyticsTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_report_is_served_from_cache_until_data_changes(self):
+        url = reverse("source_analytics", args=[self.year])
+        first = self.client.get(url).data
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).data, first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Application.objects.create(
+                student=Student.objects.first(),
+                direction=self.direction,
+                source=self.sources[0],
+                transaction=True,
+            )
+        self.assertEqual(self.client.get(url).data["total_amount"], first["total_amount"] + 1)
+
+    def test_other_years_keep_their_cache(self):
+        past = AnalyticsCache.get_report(self.year - 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Application.objects.create(
+                student=Student.objects.first(),
+                direction=self.direction,
+                source=self.sources[0],
+            )
+        with self.assertNumQueries(0):
+            self.assertEqual(AnalyticsCache.get_report(self.year - 1), past)
+
+    def test_timeouts(self):
+        with self.settings(SHARED_CACHE=True):
+            self.assertIsNone(AnalyticsCache.get_timeout(self.year - 1))
+            self.assertEqual(
+                AnalyticsCache.get_timeout(self.year), AnalyticsCache.current_year_timeout
+            )
+        # Bumps in other processes never reach a local cache, so nothing outlives them long
+        with self.settings(SHARED_CACHE=False):
+            for year in (self.year - 1, self.year):
+                self.assertEqual(AnalyticsCache.get_timeout(year), AnalyticsCache.local_timeout)
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return {"value": 1}
+
+        threads = [
+            threading.Thread(
+                target=AnalyticsCache.get_or_compute, args=("analytics:test", compute, 60)
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+
+
+class StageAnalyticsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.direction = Direction.objects.create(name="Python", duration=3)
+        cls.source = Source.objects.create(name="Instagram")
+        cls.student = Student.objects.create(email="student@example.com", phone="+996555000001")
+        cls.start = timezone.now() - datetime.timedelta(days=10)
+        # hours spent in each stage before moving to the next one
+        cls.paths = [
+            [(1, 1), (2, 2), (3, 1), (ApplicationStatusTransition.STUDENT, 0)],
+            [(1, 3), (2, 1), (4, 0)],
+            [(1, 10), (4, 0)],
+        ]
+        for path in cls.paths:
+            application = Application.objects.create(
+                student=cls.student, direction=cls.direction, source=cls.source
+            )
+            for stage, _ in path[1:]:
+                if stage == ApplicationStatusTransition.STUDENT:
+                    application.transaction = True
+                else:
+                    application.status = stage
+                application.save()
+            application.save()  # no stage change, no transition
+            transitions = application.transitions.order_by("id")
+            entered_at = cls.start
+            for transition, (_, hours) in zip(transitions, path):
+                transition.created_at = entered_at
+                transition.save()
+                entered_at += datetime.timedelta(hours=hours)
+
+    def test_transitions_recorded_on_stage_change(self):
+        stages = [
+            list(application.transitions.order_by("id").values_list("from_stage", "to_stage"))
+            for application in Application.objects.order_by("id")
+        ]
+        self.assertEqual(
+            stages,
+            [
+                [(previous, stage) for (previous, _), (stage, _) in zip([(None, 0)] + path, path)]
+                for path in self.paths
+            ],
+        )
+
+    def test_funnel(self):
+        today = timezone.localdate()
+        with self.assertNumQueries(1):
+            rows = StageAnalyticsService.funnel(today - datetime.timedelta(days=30), today)
+        funnel = {row["stage"]: (row["entered"], row["advanced"], row["failed"]) for row in rows}
+        self.assertEqual(
+            funnel,
+            {1: (3, 2, 1), 2: (2, 1, 1), 3: (1, 1, 0), 4: (2, 0, 0), 5: (1, 0, 0)},
+        )
+        self.assertEqual(rows[0]["conversion"], round(2 / 3, 4))
+
+    def test_funnel_by_source(self):
+        today = timezone.localdate()
+        rows = StageAnalyticsService.funnel(today - datetime.timedelta(days=30), today, "source")
+        self.assertEqual({row["label"] for row in rows}, {"Instagram"})
+        self.assertEqual({row["dimension_id"] for row in rows}, {self.source.pk})
+
+    def test_time_in_stage(self):
+        today = timezone.localdate()
+        with self.assertNumQueries(1):
+            rows = StageAnalyticsService.time_in_stage(today - datetime.timedelta(days=30), today)
+        stages = {row["stage"]: row for row in rows}
+        self.assertEqual(set(stages), {1, 2, 3})
+        self.assertEqual(stages[1]["exited"], 3)
+        self.assertAlmostEqual(stages[1]["median_seconds"], 3 * 3600, places=0)
+        self.assertAlmostEqual(stages[1]["average_seconds"], 14 / 3 * 3600, places=0)
+        self.assertAlmostEqual(stages[2]["median_seconds"], 1.5 * 3600, places=0)
+
+    def test_period_excludes_older_stays(self):
+        end = timezone.localdate() - datetime.timedelta(days=20)
+        self.assertEqual(StageAnalyticsService.funnel(end - datetime.timedelta(days=30), end), [])
 
-# Create your tests here.
+    def test_endpoint_validates_params(self):
+        url = reverse("funnel_analytics")
+        self.assertEqual(self.client.get(url, {"by": "teacher"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"start": "yesterday"}).status_code, 400)
+        response = self.client.get(reverse("time_in_stage_analytics"), {"by": "direction"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["result"]), 3)
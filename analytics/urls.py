@@ -3,10 +3,16 @@ from .views import (
     RejectionReasonAnalyticsView,
     SourceAnalyticsView,
     GroupsAnalyticsView,
+    DashboardAnalyticsView,
+    FunnelAnalyticsView,
+    TimeInStageAnalyticsView,
 )
 
 urlpatterns = [
     path('rejection-reason-analytics/<int:year>', RejectionReasonAnalyticsView.as_view(), name='rejection_reason_analytics'),
     path('source-analytics/<int:year>', SourceAnalyticsView.as_view(), name='source_analytics'),
     path('groups-analytics/<int:year>', GroupsAnalyticsView.as_view(), name='groups_analytics'),
+    path('dashboard/<int:year>', DashboardAnalyticsView.as_view(), name='dashboard_analytics'),
+    path('funnel', FunnelAnalyticsView.as_view(), name='funnel_analytics'),
+    path('time-in-stage', TimeInStageAnalyticsView.as_view(), name='time_in_stage_analytics'),
 ]
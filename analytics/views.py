@@ -1,72 +1,127 @@
+import datetime
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
+from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from django.db.models.functions import ExtractYear
-from django.db.models import Count, F
-from applications.models import Application
+from .cache import AnalyticsCache
+from .services import AnalyticsQueryService, StageAnalyticsService
 
 
 class RejectionReasonAnalyticsView(APIView):
     def get(self, request, year):
-        rejection_reason_analytics = (
-            Application.objects.annotate(year=ExtractYear('created_at'))
-            .values(
-                'year',
-                title=F('rejection_reason__title'),
-                color=F('rejection_reason__color'),
-            )
-            .filter(year=year, transaction=False)
-            .annotate(amount=Count('id'))
-            .order_by('year', 'rejection_reason__title')
-        )
-        response_data = {'result': rejection_reason_analytics}
-
-        response_data['total_amount'] = Application.objects\
-            .filter(created_at__year=year, transaction=False).\
-            aggregate(total=Count('id')).get('total')
-
-        return Response(response_data)
+        return Response(AnalyticsCache.get_report(year, ['rejection_reason'])['rejection_reason'])
 
 
 class SourceAnalyticsView(APIView):
     def get(self, request, year):
-        source_analytics = (
-            Application.objects.annotate(year=ExtractYear('created_at'))
-            .values(
-                'year',
-                source_title=F('source__name'),
-                color=F('source__color'),
-            )
-            .filter(year=year, transaction=True)
-            .annotate(amount=Count('id'))
-            .order_by('year', 'source__name')
-        )
-        response_data = {'result': source_analytics}
-
-        response_data['total_amount'] = Application.objects \
-            .filter(created_at__year=year, transaction=True). \
-            aggregate(total=Count('id')).get('total')
-
-        return Response(response_data)
+        return Response(AnalyticsCache.get_report(year, ['source'])['source'])
 
 
 class GroupsAnalyticsView(APIView):
     def get(self, request, year):
-        groups_analytics = (
-            Application.objects.annotate(year=ExtractYear('created_at'))
-            .values(
-                'year',
-                direction_name=F('groups__direction__name'),
-                color=F('groups__direction__color'),
-            )
-            .filter(year=year, transaction=True)
-            .annotate(amount=Count('id'))
-            .order_by('year', 'groups__direction__name')
-        )
-
-        response_data = {'result': groups_analytics}
-
-        response_data['total_amount'] = Application.objects \
-            .filter(created_at__year=year, transaction=True). \
-            aggregate(total=Count('id')).get('total')
-
-        return Response(response_data)
+        return Response(AnalyticsCache.get_report(year, ['direction'])['direction'])
+
+
+class DashboardAnalyticsView(APIView):
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'sections',
+                openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description='Comma separated sections to include '
+                            '(rejection_reason, source, direction, totals, monthly), all by default',
+            ),
+        ]
+    )
+    def get(self, request, year):
+        sections = [
+            section.strip()
+            for section in request.query_params.get('sections', '').split(',')
+            if section.strip()
+        ]
+        unknown = set(sections) - set(AnalyticsQueryService.sections)
+        if unknown:
+            raise ValidationError(detail={'error': f'Unknown sections: {", ".join(sorted(unknown))}'})
+        return Response({'year': year, **AnalyticsCache.get_report(year, sections)})
+
+
+class StageAnalyticsView(APIView):
+    """Base of the status transition reports over a `start`..`end` date period."""
+
+    default_period = datetime.timedelta(days=90)
+    report = None
+    parameters = [
+        openapi.Parameter(
+            'start',
+            openapi.IN_QUERY,
+            type=openapi.TYPE_STRING,
+            format=openapi.FORMAT_DATE,
+            description='First day of the period, 90 days before `end` by default',
+        ),
+        openapi.Parameter(
+            'end',
+            openapi.IN_QUERY,
+            type=openapi.TYPE_STRING,
+            format=openapi.FORMAT_DATE,
+            description='Last day of the period, today by default',
+        ),
+        openapi.Parameter(
+            'by',
+            openapi.IN_QUERY,
+            type=openapi.TYPE_STRING,
+            enum=list(StageAnalyticsService.dimensions),
+            description='Split the report by source or direction',
+        ),
+    ]
+
+    def get_date(self, request, name, default):
+        value = request.query_params.get(name)
+        if not value:
+            return default
+        try:
+            date = parse_date(value)
+        except ValueError:
+            date = None
+        if date is None:
+            raise ValidationError(detail={'error': f'Invalid {name} date, expected YYYY-MM-DD'})
+        return date
+
+    def get_params(self, request):
+        end = self.get_date(request, 'end', timezone.localdate())
+        start = self.get_date(request, 'start', end - self.default_period)
+        if start > end:
+            raise ValidationError(detail={'error': 'start must not be after end'})
+        dimension = request.query_params.get('by') or None
+        if dimension is not None and dimension not in StageAnalyticsService.dimensions:
+            raise ValidationError(detail={'error': f'Unknown dimension: {dimension}'})
+        return start, end, dimension
+
+    def get(self, request):
+        start, end, dimension = self.get_params(request)
+        return Response({
+            'start': start,
+            'end': end,
+            'by': dimension,
+            'result': self.report(start, end, dimension),
+        })
+
+
+class FunnelAnalyticsView(StageAnalyticsView):
+    report = StageAnalyticsService.funnel
+
+    @swagger_auto_schema(manual_parameters=StageAnalyticsView.parameters)
+    def get(self, request):
+        return super().get(request)
+
+
+class TimeInStageAnalyticsView(StageAnalyticsView):
+    report = StageAnalyticsService.time_in_stage
+
+    @swagger_auto_schema(manual_parameters=StageAnalyticsView.parameters)
+    def get(self, request):
+        return super().get(request)
@@ -0,0 +1,86 @@
+from django.db import transaction
+from django.utils import timezone
+from users.models import Student
+
+from .models import Application
+from .services import ApplicationChangeService
+from .signals import post_bulk_save, pre_bulk_save
+
+
+class ApplicationBatchService:
+    """Changes many applications at once with set-based queries.
+
+    Writes go through `QuerySet.update()`, history through simple_history's
+    `bulk_history_create`, and the pre/post bulk signals keep the search index
+    and analytics in step, so the number of queries does not depend on the
+    number of applications.
+    """
+
+    model = Application
+    UPDATED = 'updated'
+    UNCHANGED = 'unchanged'
+    NOT_FOUND = 'not_found'
+    CONVERTED = 'converted'
+    ALREADY_CONVERTED = 'already_converted'
+
+    @classmethod
+    def update(cls, ids, changes, user=None):
+        """Apply one change set to the applications `ids`; return {id: result}."""
+        ids = list(dict.fromkeys(ids))
+        with transaction.atomic():
+            queryset = cls.model.objects.filter(pk__in=ids)
+            # Locked in primary key order, so overlapping batches cannot deadlock
+            found = set(
+                queryset.order_by('pk').select_for_update().values_list('pk', flat=True)
+            )
+            # Rows already holding every value get no UPDATE and no history
+            changed = set(queryset.exclude(**changes).values_list('pk', flat=True))
+            cls.write(changed, user, **changes)
+        return {
+            pk: cls.UPDATED if pk in changed else cls.UNCHANGED if pk in found else cls.NOT_FOUND
+            for pk in ids
+        }
+
+    @classmethod
+    def convert(cls, ids, user=None):
+        """Turn the leads `ids` into students; return {id: result}.
+
+        The rows are locked with `SELECT ... FOR UPDATE` before `transaction`
+        is read, so of two managers converting the same lead at once the second
+        waits for the first and then sees it as already converted. Locks are
+        taken in primary key order, so overlapping batches cannot deadlock.
+        """
+        ids = list(dict.fromkeys(ids))
+        with transaction.atomic():
+            queryset = cls.model.objects.filter(pk__in=ids).order_by('pk').select_for_update()
+            state = dict(queryset.values_list('pk', 'transaction'))
+            converted = {pk for pk, is_transaction in state.items() if not is_transaction}
+            cls.write(converted, user, transaction=True, status=None)
+            Student.objects.filter(application__pk__in=converted).update(status=1)
+        results = {}
+        for pk in ids:
+            if pk in converted:
+                results[pk] = cls.CONVERTED
+            elif pk in state:
+                results[pk] = cls.ALREADY_CONVERTED
+            else:
+                results[pk] = cls.NOT_FOUND
+        return results
+
+    @classmethod
+    def write(cls, ids, user=None, **changes):
+        """`UPDATE` the applications `ids` and record their history. Run in a transaction."""
+        if not ids:
+            return
+        context = {}
+        pre_bulk_save.send(sender=cls.model, ids=ids, context=context)
+        now = timezone.now()
+        cls.model.objects.filter(pk__in=ids).update(updated_at=now, **changes)
+        histories = cls.model.history.bulk_history_create(
+            cls.model.objects.filter(pk__in=ids).order_by('pk'),
+            update=True,
+            default_user=user,
+            default_date=now,
+        )
+        ApplicationChangeService.record_many(histories, user)
+        post_bulk_save.send(sender=cls.model, ids=ids, created=False, context=context)
@@ -0,0 +1,266 @@
+import csv
+import io
+import os
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from rest_framework.exceptions import ValidationError
+from users.models import Student
+from users.services import StudentService, UserService
+
+from .models import Application, Direction, Groups, Source
+from .services import ApplicationChangeService
+from .signals import post_bulk_save
+
+User = get_user_model()
+
+
+class LeadImportService:
+    """Streams leads from a CSV or XLSX file into students and applications.
+
+    Rows are read lazily and handled in chunks: phones are validated per chunk,
+    students are upserted by phone and applications are bulk created with their
+    history, each chunk in its own transaction. `run` yields one result per row,
+    so callers can report progress while the file is still being read.
+
+    Columns: phone, first_name, last_name, email, direction, source, groups,
+    status, laptop. Direction, source and groups take an id or a name.
+
+    Relies on bulk inserts returning ids (PostgreSQL, SQLite 3.35+).
+    """
+
+    columns = (
+        'phone',
+        'first_name',
+        'last_name',
+        'email',
+        'direction',
+        'source',
+        'groups',
+        'status',
+        'laptop',
+    )
+    required = ('phone', 'direction', 'source')
+    statuses = {str(value) for value, _ in Application.APPLICATION_CHOICES}
+    true_values = {'1', 'true', 'yes', 'да', '+'}
+    chunk_size = 1000
+
+    # Reading
+
+    @classmethod
+    def read(cls, file, name):
+        extension = os.path.splitext(name)[1].lower()
+        if extension == '.csv':
+            return cls.read_csv(file)
+        if extension == '.xlsx':
+            return cls.read_xlsx(file)
+        raise ValidationError(detail={'error': 'Only .csv and .xlsx files are supported'})
+
+    @classmethod
+    def read_csv(cls, file):
+        reader = csv.reader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+        return cls.rows(reader)
+
+    @classmethod
+    def read_xlsx(cls, file):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ValidationError(detail={'error': 'XLSX import requires openpyxl'})
+        # Read-only workbooks stream rows instead of loading the whole sheet
+        workbook = load_workbook(file, read_only=True, data_only=True)
+        return cls.rows(workbook.active.iter_rows(values_only=True))
+
+    @classmethod
+    def rows(cls, records):
+        """Check the header, then lazily yield `(row number, {column: text})`."""
+        records = iter(records)
+        header = [cls.cell(value).lower() for value in next(records, ())]
+        missing = set(cls.required) - set(header)
+        if missing:
+            raise ValidationError(
+                detail={'error': f'Missing columns: {", ".join(sorted(missing))}'}
+            )
+        return cls.records(header, records)
+
+    @classmethod
+    def records(cls, header, records):
+        for number, record in enumerate(records, start=2):
+            values = dict(zip(header, map(cls.cell, record)))
+            if any(values.values()):
+                yield number, {column: values.get(column, '') for column in cls.columns}
+
+    @staticmethod
+    def cell(value):
+        if value is None:
+            return ''
+        if isinstance(value, float) and value.is_integer():
+            # Spreadsheets keep phones typed as numbers as floats
+            value = int(value)
+        return str(value).strip()
+
+    # Importing
+
+    @classmethod
+    def run(cls, rows, user=None, chunk_size=None):
+        lookups = cls.lookups()
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, chunk_size or cls.chunk_size))
+            if not chunk:
+                return
+            yield from cls.import_chunk(chunk, lookups, user)
+
+    @classmethod
+    def lookups(cls):
+        """Directions, sources and groups keyed by id and by lower-cased name."""
+        lookups = {}
+        for column, model in (('direction', Direction), ('source', Source), ('groups', Groups)):
+            lookup = {}
+            for pk, name in model.objects.values_list('pk', 'name'):
+                lookup.setdefault((name or '').lower(), pk)
+                lookup[str(pk)] = pk
+            lookups[column] = lookup
+        return lookups
+
+    @classmethod
+    def parse(cls, chunk, lookups):
+        """Split a chunk into parsed rows and per-row errors."""
+        phone_errors = UserService.validate_phones([values['phone'] for _, values in chunk])
+        parsed, errors = [], {}
+        for index, (number, values) in enumerate(chunk):
+            row_errors = {}
+            for column in cls.required:
+                if not values[column]:
+                    row_errors[column] = 'This field is required.'
+            if 'phone' not in row_errors and index in phone_errors:
+                row_errors['phone'] = phone_errors[index]
+            fields = {}
+            for column in ('direction', 'source', 'groups'):
+                if values[column]:
+                    pk = lookups[column].get(values[column].lower())
+                    if pk is None:
+                        row_errors.setdefault(column, f'Unknown {column}: {values[column]}')
+                    fields[f'{column}_id'] = pk
+            status = values['status'] or '1'
+            if status not in cls.statuses:
+                row_errors['status'] = f'Unknown status: {status}'
+            if row_errors:
+                errors[number] = row_errors
+                continue
+            fields['status'] = int(status)
+            fields['laptop'] = values['laptop'].lower() in cls.true_values
+            parsed.append((number, values, fields))
+        return parsed, errors
+
+    @classmethod
+    def import_chunk(cls, chunk, lookups, user=None):
+        parsed, errors = cls.parse(chunk, lookups)
+        results = {}
+        if parsed:
+            try:
+                results = cls.save_chunk(parsed, errors, user)
+            except IntegrityError:
+                # A concurrent import or signup took one of the phones or
+                # emails; a second pass sees it as an existing user
+                try:
+                    results = cls.save_chunk(parsed, errors, user)
+                except IntegrityError as exc:
+                    errors.update(
+                        {number: {'non_field_errors': str(exc)} for number, _, _ in parsed}
+                    )
+        for number, _ in chunk:
+            if number in errors:
+                yield {'row': number, 'errors': errors[number]}
+            else:
+                yield {'row': number, **results[number]}
+
+    @classmethod
+    def save_chunk(cls, parsed, errors, user=None):
+        with transaction.atomic():
+            students, created, renamed = cls.upsert_students(parsed, errors)
+            parsed = [row for row in parsed if row[0] not in errors]
+            applications = [
+                Application(student_id=students[values['phone']], **fields)
+                for _, values, fields in parsed
+            ]
+            applications = Application.objects.bulk_create(applications)
+            histories = Application.history.bulk_history_create(applications, default_user=user)
+            ApplicationChangeService.record_many(histories, user)
+            ids = [application.pk for application in applications]
+            post_bulk_save.send(sender=Student, ids=created, created=True, context={})
+            post_bulk_save.send(sender=Student, ids=renamed, created=False, context={})
+            post_bulk_save.send(sender=Application, ids=ids, created=True, context={})
+        return {
+            number: {'student': students[values['phone']], 'application': application.pk}
+            for (number, values, _), application in zip(parsed, applications)
+        }
+
+    @classmethod
+    def upsert_students(cls, parsed, errors):
+        """Map every phone of the chunk to a student id, creating the missing ones.
+
+        Also returns the ids of the students created and of the ones renamed.
+        """
+        rows = {}
+        for number, values, _ in parsed:
+            rows.setdefault(values['phone'], (number, values))
+        keys = {phone: User.normalize_phone(phone) for phone in rows}
+        existing = {
+            key: rest
+            for key, *rest in User.objects.filter(phone_key__in=keys.values())
+            .annotate(is_student=Exists(Student.objects.filter(pk=OuterRef('pk'))))
+            .values_list('phone_key', 'pk', 'is_student', 'first_name', 'last_name')
+        }
+        students, updated, new, created = {}, [], [], {}
+        for phone, (number, values) in rows.items():
+            if keys[phone] in existing:
+                pk, is_student, first_name, last_name = existing[keys[phone]]
+                if not is_student:
+                    cls.reject(parsed, errors, phone, 'Phone belongs to a user who is not a student')
+                    continue
+                students[phone] = pk
+                names = (values['first_name'] or first_name, values['last_name'] or last_name)
+                if names != (first_name, last_name):
+                    updated.append(User(pk=pk, first_name=names[0], last_name=names[1]))
+            else:
+                new.append(values)
+
+        emails = {}
+        for values in new:
+            if values['email'] and emails.setdefault(values['email'], values['phone']) != values['phone']:
+                cls.reject(parsed, errors, values['phone'], f'Email {values["email"]} is repeated')
+        taken = User.objects.filter(email__in=list(emails)).values_list('email', flat=True)
+        for email in taken:
+            cls.reject(parsed, errors, emails[email], f'Email {email} is already taken')
+        new = [values for values in new if values['phone'] not in cls.rejected(parsed, errors)]
+
+        if updated:
+            User.objects.bulk_update(updated, ['first_name', 'last_name'])
+        if new:
+            users = User.objects.bulk_create(
+                User(
+                    phone=values['phone'],
+                    phone_key=keys[values['phone']],
+                    first_name=values['first_name'] or None,
+                    last_name=values['last_name'] or None,
+                    email=values['email'] or None,
+                )
+                for values in new
+            )
+            created = {user.phone: user.pk for user in users}
+            StudentService.add_student_rows(created.values())
+            students.update(created)
+        return students, list(created.values()), [user.pk for user in updated]
+
+    @staticmethod
+    def reject(parsed, errors, phone, message):
+        for number, values, _ in parsed:
+            if values['phone'] == phone:
+                errors[number] = {'phone': message}
+
+    @staticmethod
+    def rejected(parsed, errors):
+        return {values['phone'] for number, values, _ in parsed if number in errors}
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from applications.services import ApplicationChangeService
+
+
+class Command(BaseCommand):
+    help = "Build the application change log from existing history records"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        created = ApplicationChangeService.backfill(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Created {created} change log rows"))
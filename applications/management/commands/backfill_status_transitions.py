@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from applications.services import ApplicationTransitionService
+
+
+class Command(BaseCommand):
+    help = "Build application status transitions from existing history records"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        created = ApplicationTransitionService.backfill(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Created {created} status transitions"))
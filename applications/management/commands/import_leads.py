@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import NotFound, ValidationError
+
+from applications.imports import LeadImportService
+from users.services import UserService
+
+
+class Command(BaseCommand):
+    help = "Import leads from a CSV or XLSX file as students and applications"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--chunk-size", type=int, default=LeadImportService.chunk_size)
+        parser.add_argument("--user", help="Email of the user the history is recorded for")
+
+    def handle(self, *args, **options):
+        user = None
+        if options["user"]:
+            try:
+                user = UserService.get(email=options["user"])
+            except NotFound:
+                raise CommandError(f"User {options['user']} not found")
+        chunk_size = options["chunk_size"]
+        created = failed = 0
+        with open(options["path"], "rb") as file:
+            try:
+                rows = LeadImportService.read(file, options["path"])
+            except ValidationError as exc:
+                raise CommandError(exc.detail["error"])
+            for result in LeadImportService.run(rows, user=user, chunk_size=chunk_size):
+                if "errors" in result:
+                    failed += 1
+                    self.stderr.write(f"Row {result['row']}: {result['errors']}")
+                else:
+                    created += 1
+                if (created + failed) % chunk_size == 0:
+                    self.stdout.write(f"Processed {created + failed} rows")
+        self.stdout.write(
+            self.style.SUCCESS(f"Imported {created} applications, {failed} rows failed")
+        )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from applications.search import SearchIndex
+
+
+class Command(BaseCommand):
+    help = "Rebuild the global search index from scratch"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        SearchIndex.rebuild(batch_size=options["batch_size"])
+        count = SearchIndex.model.objects.count()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} documents"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from applications.services import GroupOccupancyService
+
+
+class Command(BaseCommand):
+    help = "Recount enrolled and pending students of every group from its applications"
+
+    def handle(self, *args, **options):
+        fixed = GroupOccupancyService.reconcile()
+        self.stdout.write(self.style.SUCCESS(f"Fixed the counters of {fixed} groups"))
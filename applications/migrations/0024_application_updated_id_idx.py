@@ -0,0 +1,17 @@
+# Generated by Django 4.1.5 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('applications', '0023_alter_application_status_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['updated_at', 'id'], name='application_updated_id_idx'),
+        ),
+    ]
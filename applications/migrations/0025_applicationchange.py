@@ -0,0 +1,33 @@
+# Generated by Django 4.1.5 on 2026-10-18 08:04
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('applications', '0024_application_updated_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApplicationChange',
+            fields=[
+                ('history', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='change', serialize=False, to='applications.historicalapplication')),
+                ('action', models.CharField(max_length=1)),
+                ('timestamp', models.DateTimeField()),
+                ('user_email', models.CharField(blank=True, max_length=255, null=True)),
+                ('changes', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('application', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='change_log', to='applications.application')),
+            ],
+            options={
+                'ordering': ['-timestamp', '-history_id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='applicationchange',
+            index=models.Index(fields=['application', '-timestamp'], name='application_change_log_idx'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 4.1.5 on 2026-10-18 08:04
+
+from django.db import migrations, models
+
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX applications_searchdocument_tsv_idx ON applications_searchdocument "
+    "USING gin (to_tsvector('simple', body))",
+    "CREATE INDEX applications_searchdocument_trgm_idx ON applications_searchdocument "
+    "USING gin (body gin_trgm_ops)",
+]
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS applications_searchdocument_trgm_idx",
+    "DROP INDEX IF EXISTS applications_searchdocument_tsv_idx",
+]
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE applications_searchdocument_fts USING fts5("
+    "body, content='applications_searchdocument', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER applications_searchdocument_ai AFTER INSERT ON applications_searchdocument BEGIN "
+    "INSERT INTO applications_searchdocument_fts(rowid, body) VALUES (new.id, new.body); END",
+    "CREATE TRIGGER applications_searchdocument_ad AFTER DELETE ON applications_searchdocument BEGIN "
+    "INSERT INTO applications_searchdocument_fts(applications_searchdocument_fts, rowid, body) "
+    "VALUES ('delete', old.id, old.body); END",
+    "CREATE TRIGGER applications_searchdocument_au AFTER UPDATE ON applications_searchdocument BEGIN "
+    "INSERT INTO applications_searchdocument_fts(applications_searchdocument_fts, rowid, body) "
+    "VALUES ('delete', old.id, old.body); "
+    "INSERT INTO applications_searchdocument_fts(rowid, body) VALUES (new.id, new.body); END",
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS applications_searchdocument_au",
+    "DROP TRIGGER IF EXISTS applications_searchdocument_ad",
+    "DROP TRIGGER IF EXISTS applications_searchdocument_ai",
+    "DROP TABLE IF EXISTS applications_searchdocument_fts",
+]
+
+
+def run_vendor_sql(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+
+    return run
+
+
+create_search_index = run_vendor_sql(
+    {"postgresql": POSTGRES_FORWARD, "sqlite": SQLITE_FORWARD}
+)
+drop_search_index = run_vendor_sql(
+    {"postgresql": POSTGRES_BACKWARD, "sqlite": SQLITE_BACKWARD}
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('applications', '0025_applicationchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('group', 'group'), ('application', 'application'), ('teacher', 'teacher'), ('student', 'student')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('body', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='searchdocument',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='search_document_kind_object_uniq'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
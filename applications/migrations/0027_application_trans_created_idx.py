@@ -0,0 +1,17 @@
+# Generated by Django 4.1.5 on 2026-10-18 08:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('applications', '0026_searchdocument'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['transaction', 'created_at'], name='application_trans_created_idx'),
+        ),
+    ]
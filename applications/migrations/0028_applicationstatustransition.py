@@ -0,0 +1,35 @@
+# Generated by Django 4.1.5 on 2026-10-18 08:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('applications', '0027_application_trans_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApplicationStatusTransition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_stage', models.PositiveSmallIntegerField(blank=True, choices=[(1, 'Ждет звонка'), (2, 'Записался на пробный урок'), (3, 'Посетил пробный урок'), (4, 'Неуспешная сделка'), (5, 'Стал студентом')], null=True)),
+                ('to_stage', models.PositiveSmallIntegerField(blank=True, choices=[(1, 'Ждет звонка'), (2, 'Записался на пробный урок'), (3, 'Посетил пробный урок'), (4, 'Неуспешная сделка'), (5, 'Стал студентом')], null=True)),
+                ('created_at', models.DateTimeField()),
+                ('application', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transitions', to='applications.application')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='applicationstatustransition',
+            index=models.Index(fields=['application', 'created_at'], name='transition_application_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='applicationstatustransition',
+            index=models.Index(fields=['created_at'], name='transition_created_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.5 on 2026-10-18 08:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('applications', '0028_applicationstatustransition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='application',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.1.5 on 2026-10-18 08:33
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_students(apps, schema_editor):
+    Groups = apps.get_model("applications", "Groups")
+    Application = apps.get_model("applications", "Application")
+    counts = (
+        Application.objects.exclude(groups=None)
+        .values("groups")
+        .annotate(
+            enrolled=Count("pk", filter=Q(transaction=True)),
+            pending=Count("pk", filter=Q(transaction=False) & ~Q(status=4)),
+        )
+    )
+    Groups.objects.update(number_of_students=0)
+    for row in counts.iterator():
+        Groups.objects.filter(pk=row["groups"]).update(
+            number_of_students=row["enrolled"], pending_students=row["pending"]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('applications', '0029_application_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='groups',
+            name='pending_students',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_students, migrations.RunPython.noop),
+    ]
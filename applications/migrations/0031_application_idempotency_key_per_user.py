@@ -0,0 +1,18 @@
+# Generated by Django 4.1.5 on 2026-10-18 09:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('applications', '0030_groups_pending_students'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='application',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=300, null=True, unique=True),
+        ),
+    ]
@@ -1,5 +1,6 @@
 import datetime
 
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from rest_framework.exceptions import ValidationError
 from simple_history.models import HistoricalRecords
@@ -39,7 +40,9 @@ class Groups(models.Model):
     )
     direction = models.ForeignKey(Direction, on_delete=models.CASCADE, null=True)
     audience = models.PositiveSmallIntegerField(choices=AUDIENCE_CHOICES, default=1)
+    # Maintained from the applications by GroupOccupancyService
     number_of_students = models.IntegerField(default=0)
+    pending_students = models.IntegerField(default=0)
     start_date = models.DateField(blank=True, null=True)
     end_date = models.DateField(blank=True, null=True)
     times = models.ForeignKey(Times, on_delete=models.SET_NULL, null=True, blank=True)
@@ -96,7 +99,120 @@ class Application(models.Model):
     reason_description = models.CharField(max_length=255, null=True, blank=True)
     created_at = models.DateTimeField(editable=True, auto_now_add=True)
     updated_at = models.DateTimeField(editable=True, auto_now=True)
-    history = HistoricalRecords()
+    # "<user id>:<Idempotency-Key header>" of the request that created the application
+    idempotency_key = models.CharField(
+        max_length=300, unique=True, null=True, blank=True, editable=False
+    )
+    history = HistoricalRecords(excluded_fields=["idempotency_key"])
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["updated_at", "id"], name="application_updated_id_idx"
+            ),
+            models.Index(
+                fields=["transaction", "created_at"],
+                name="application_trans_created_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.pk} of Student {self.student}"
+
+
+class ApplicationChange(models.Model):
+    """Field-level diff of one HistoricalApplication row against the previous one."""
+
+    history = models.OneToOneField(
+        "applications.HistoricalApplication",
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="change",
+    )
+    application = models.ForeignKey(
+        Application,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="change_log",
+    )
+    action = models.CharField(max_length=1)
+    timestamp = models.DateTimeField()
+    user_email = models.CharField(max_length=255, null=True, blank=True)
+    changes = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+
+    class Meta:
+        ordering = ["-timestamp", "-history_id"]
+        indexes = [
+            models.Index(
+                fields=["application", "-timestamp"], name="application_change_log_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.action} of Application {self.application_id} at {self.timestamp}"
+
+
+class SearchDocument(models.Model):
+    """Denormalized searchable text of one group, application, teacher or student.
+
+    The full-text index over `body` is backend specific (tsvector/trigram GIN on
+    Postgres, an FTS5 shadow table on SQLite) and is created by migration 0026.
+    """
+
+    KIND_CHOICES = (
+        ("group", "group"),
+        ("application", "application"),
+        ("teacher", "teacher"),
+        ("student", "student"),
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    body = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind", "object_id"], name="search_document_kind_object_uniq"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
+
+
+class ApplicationStatusTransition(models.Model):
+    """One move of an application between funnel stages.
+
+    The stage is the application's status, or STUDENT once `transaction` is set.
+    """
+
+    STUDENT = 5
+    STAGE_CHOICES = Application.APPLICATION_CHOICES + ((STUDENT, "Стал студентом"),)
+    application = models.ForeignKey(
+        Application, on_delete=models.CASCADE, related_name="transitions"
+    )
+    from_stage = models.PositiveSmallIntegerField(
+        choices=STAGE_CHOICES, null=True, blank=True
+    )
+    to_stage = models.PositiveSmallIntegerField(
+        choices=STAGE_CHOICES, null=True, blank=True
+    )
+    created_at = models.DateTimeField()
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["application", "created_at"],
+                name="transition_application_idx",
+            ),
+            models.Index(fields=["created_at"], name="transition_created_idx"),
+        ]
+
+    @classmethod
+    def stage_of(cls, application):
+        return cls.STUDENT if application.transaction else application.status
+
+    def __str__(self):
+        return f"{self.application_id}: {self.from_stage} -> {self.to_stage}"
@@ -1,5 +1,12 @@
+from base64 import b64decode, b64encode
+from urllib import parse
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class CustomPagination(pagination.PageNumberPagination):
@@ -17,3 +24,132 @@ class CustomPagination(pagination.PageNumberPagination):
                 "results": data,  # Сами данные
             }
         )
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Cursor pagination keyed on a (timestamp, id) pair, newest first.
+
+    Every page is fetched with a `WHERE (ts, id) < (cursor)` seek and a
+    `LIMIT`, so deep pages cost the same as the first one. The total count is
+    only computed when the client passes `count=true`.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    count_query_param = "count"
+    page_size = 10
+    max_page_size = 100
+    ordering = ("updated_at", "id")
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ("true", "1"):
+            self.count = queryset.count()
+
+        reverse, position = self.decode_cursor(request)
+        field, tiebreaker = self.ordering
+        if reverse:
+            queryset = queryset.order_by(field, tiebreaker)
+            lookup = "gt"
+        else:
+            queryset = queryset.order_by(f"-{field}", f"-{tiebreaker}")
+            lookup = "lt"
+        if position is not None:
+            value, pk = position
+            queryset = queryset.filter(
+                Q(**{f"{field}__{lookup}": value})
+                | Q(**{field: value, f"{tiebreaker}__{lookup}": pk})
+            )
+
+        results = list(queryset[: self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[: self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return False, None
+        try:
+            querystring = b64decode(encoded.encode("ascii")).decode("ascii")
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+            reverse = bool(int(tokens.get("r", ["0"])[0]))
+            value = parse_datetime(tokens["p"][0])
+            pk = int(tokens["i"][0])
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None:
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, (value, pk)
+
+    def encode_cursor(self, instance, reverse):
+        field, tiebreaker = self.ordering
+        tokens = {
+            "r": int(reverse),
+            "p": getattr(instance, field).isoformat(),
+            "i": getattr(instance, tiebreaker),
+        }
+        encoded = b64encode(parse.urlencode(tokens).encode("ascii")).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        response = {
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        }
+        if self.count is not None:
+            response["count"] = self.count
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "count": {"type": "integer"},
+                "results": schema,
+            },
+        }
+
+
+class ApplicationCursorPagination(KeysetPagination):
+    ordering = ("updated_at", "id")
+
+
+class NotificationCursorPagination(KeysetPagination):
+    ordering = ("created_at", "id")
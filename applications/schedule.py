@@ -0,0 +1,236 @@
+import bisect
+import datetime
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Groups
+
+# A group's lessons on one weekday: minutes since midnight and the dates it runs
+Slot = namedtuple('Slot', 'group_id name start end first_day last_day')
+
+
+class DaySchedule:
+    """Slots of one resource on one weekday, sorted by start.
+
+    `max_ends[i]` is the latest end among the first i + 1 slots, so a lookup
+    bisects to the slots starting before the interval ends and walks back only
+    while an earlier slot can still reach into it.
+    """
+
+    def __init__(self, slots):
+        self.slots = sorted(slots, key=lambda slot: (slot.start, slot.end, slot.group_id))
+        self.starts = [slot.start for slot in self.slots]
+        self.max_ends = []
+        latest = -1
+        for slot in self.slots:
+            latest = max(latest, slot.end)
+            self.max_ends.append(latest)
+
+    def overlapping(self, start, end, first_day=None, last_day=None, exclude=None):
+        found = []
+        for index in range(bisect.bisect_left(self.starts, end) - 1, -1, -1):
+            if self.max_ends[index] <= start:
+                break
+            slot = self.slots[index]
+            if (
+                slot.end > start
+                and slot.group_id != exclude
+                and ScheduleIndex.dates_overlap(slot, first_day, last_day)
+            ):
+                found.append(slot)
+        found.reverse()
+        return found
+
+    def pairs(self):
+        """Every two slots of this day whose times and dates overlap."""
+        for index, slot in enumerate(self.slots):
+            for other in self.slots[index + 1 :]:
+                if other.start >= slot.end:
+                    break
+                if ScheduleIndex.dates_overlap(other, slot.first_day, slot.last_day):
+                    yield slot, other
+
+
+class ScheduleIndex:
+    """Active groups indexed by (resource, resource id, weekday)."""
+
+    # Groups.timetable -> weekdays (Monday is 0)
+    weekdays = {1: (0, 2, 4), 2: (1, 3, 5)}
+    resources = ('teacher', 'audience')
+
+    def __init__(self, rows):
+        slots = {}
+        for row in rows:
+            slot = Slot(
+                row['id'], row['name'], row['start'], row['end'], row['start_date'], row['end_date']
+            )
+            for key in self.keys(row):
+                slots.setdefault(key, []).append(slot)
+        self.days = {key: DaySchedule(day_slots) for key, day_slots in slots.items()}
+
+    @classmethod
+    def keys(cls, row):
+        for resource in cls.resources:
+            if row[resource] is None:
+                continue
+            for weekday in cls.weekdays.get(row['timetable'], ()):
+                yield resource, row[resource], weekday
+
+    @staticmethod
+    def dates_overlap(slot, first_day, last_day):
+        return (last_day is None or slot.first_day is None or slot.first_day <= last_day) and (
+            first_day is None or slot.last_day is None or first_day <= slot.last_day
+        )
+
+    def conflicts(self, row, exclude=None):
+        """Slots that `row` would share a teacher or an audience with."""
+        found = []
+        for key in self.keys(row):
+            day = self.days.get(key)
+            if day is None:
+                continue
+            for slot in day.overlapping(
+                row['start'], row['end'], row['start_date'], row['end_date'], exclude
+            ):
+                found.append((key, slot))
+        return found
+
+
+class ScheduleService:
+    """Conflict checks against an in-memory index of the active groups.
+
+    The index is built once per process and rebuilt when a group or a time
+    slot changes, which bumps a version in the cache, or when the day turns
+    and the set of active groups moves. A check is then a version read plus
+    a few bisections, without touching the database.
+
+    An index is never older than `max_age` either. Without a shared cache a
+    bump reaches only the process that made it, so the others then rely on
+    the much shorter `local_max_age`.
+    """
+
+    version_key = 'schedule:version'
+    max_age = 60 * 5
+    local_max_age = 10
+    _lock = threading.Lock()
+    _index = None
+    _index_key = None
+    _index_expires = 0
+
+    @staticmethod
+    def minutes(value):
+        value = timezone.localtime(value) if timezone.is_aware(value) else value
+        return value.hour * 60 + value.minute
+
+    @classmethod
+    def active_groups(cls, today):
+        groups = (
+            Groups.objects.filter(Q(end_date__gte=today) | Q(end_date=None))
+            .exclude(times=None)
+            .values(
+                'id',
+                'name',
+                'teacher',
+                'audience',
+                'timetable',
+                'start_date',
+                'end_date',
+                'times__start_date',
+                'times__end_date',
+            )
+        )
+        for group in groups.iterator():
+            yield cls.row(group, group.pop('times__start_date'), group.pop('times__end_date'))
+
+    @classmethod
+    def row(cls, group, starts_at, ends_at):
+        return {**group, 'start': cls.minutes(starts_at), 'end': cls.minutes(ends_at)}
+
+    @classmethod
+    def get_version(cls):
+        version = cache.get(cls.version_key)
+        if version is None:
+            cache.add(cls.version_key, time.time_ns(), None)
+            version = cache.get(cls.version_key)
+        return version
+
+    @classmethod
+    def bump(cls):
+        try:
+            cache.incr(cls.version_key)
+        except ValueError:
+            cache.add(cls.version_key, time.time_ns(), None)
+
+    @classmethod
+    def is_stale(cls, key):
+        return (
+            cls._index is None
+            or cls._index_key != key
+            or time.monotonic() >= cls._index_expires
+        )
+
+    @classmethod
+    def get_index(cls):
+        key = (cls.get_version(), timezone.localdate())
+        index = cls._index
+        if cls.is_stale(key):
+            with cls._lock:
+                if cls.is_stale(key):
+                    cls._index = ScheduleIndex(cls.active_groups(key[1]))
+                    cls._index_key = key
+                    max_age = cls.max_age if settings.SHARED_CACHE else cls.local_max_age
+                    cls._index_expires = time.monotonic() + max_age
+                index = cls._index
+        return index
+
+    @staticmethod
+    def describe(key, slot):
+        resource, resource_id, weekday = key
+        return {
+            'resource': resource,
+            'resource_id': resource_id,
+            'weekday': weekday + 1,
+            'group': {'id': slot.group_id, 'name': slot.name},
+            'start': f'{slot.start // 60:02d}:{slot.start % 60:02d}',
+            'end': f'{slot.end // 60:02d}:{slot.end % 60:02d}',
+        }
+
+    @classmethod
+    def check(cls, teacher, audience, timetable, times, start_date=None, end_date=None, group=None):
+        """Conflicts a new group, or `group` after an edit, would have."""
+        row = cls.row(
+            {
+                'teacher': teacher,
+                'audience': audience,
+                'timetable': timetable,
+                'start_date': start_date,
+                'end_date': end_date,
+            },
+            times.start_date,
+            times.end_date,
+        )
+        return [cls.describe(key, slot) for key, slot in cls.get_index().conflicts(row, group)]
+
+    @classmethod
+    def week_conflicts(cls, day):
+        """Every double booking on the dates of the week around `day`."""
+        monday = day - datetime.timedelta(days=day.weekday())
+        report = []
+        for key, schedule in sorted(cls.get_index().days.items()):
+            date = monday + datetime.timedelta(days=key[2])
+            for first, second in schedule.pairs():
+                if all(ScheduleIndex.dates_overlap(slot, date, date) for slot in (first, second)):
+                    report.append(
+                        {
+                            **cls.describe(key, first),
+                            'date': date,
+                            'conflicting_group': cls.describe(key, second)['group'],
+                        }
+                    )
+        return report
@@ -0,0 +1,186 @@
+import re
+
+from django.db import connection
+from users.models import Student, Teacher
+
+from .models import Application, Groups, SearchDocument
+
+
+class BaseSearchBackend:
+    """Ranks SearchDocument rows for a query; returns (kind, object_id, rank)."""
+
+    table = SearchDocument._meta.db_table
+
+    @classmethod
+    def kinds_clause(cls, kinds, params, column="kind"):
+        if not kinds:
+            return ""
+        params.extend(kinds)
+        return f" AND {column} IN ({', '.join(['%s'] * len(kinds))})"
+
+    @classmethod
+    def execute(cls, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [(kind, object_id, float(rank)) for kind, object_id, rank in cursor]
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """Prefix tsquery match plus trigram ILIKE, both served by GIN indexes."""
+
+    @classmethod
+    def search(cls, terms, query, kinds, limit, offset):
+        tsquery = " & ".join(f"{term}:*" for term in terms)
+        pattern = "%{}%".format(re.sub(r"([\\%_])", r"\\\1", query))
+        params = [tsquery, query, tsquery, pattern]
+        sql = (
+            f"SELECT kind, object_id, "
+            f"ts_rank(to_tsvector('simple', body), to_tsquery('simple', %s)) "
+            f"+ word_similarity(%s, body) AS rank "
+            f"FROM {cls.table} "
+            f"WHERE (to_tsvector('simple', body) @@ to_tsquery('simple', %s) "
+            f"OR body ILIKE %s)"
+        )
+        sql += cls.kinds_clause(kinds, params)
+        sql += " ORDER BY rank DESC, id LIMIT %s OFFSET %s"
+        return cls.execute(sql, params + [limit, offset])
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """FTS5 prefix match ranked by bm25, plus LIKE for matches inside a word.
+
+    Like the trigram ILIKE of Postgres, the LIKE branch finds fragments such as
+    a piece of a phone number; it scans the documents and ranks below every
+    word match.
+    """
+
+    @classmethod
+    def search(cls, terms, query, kinds, limit, offset):
+        match = " ".join(f'"{term}"*' for term in terms)
+        pattern = "%{}%".format(re.sub(r"([\\%_])", r"\\\1", query.lower()))
+        params = [match]
+        sql = (
+            f"SELECT kind, object_id, MAX(rank) AS rank FROM ("
+            f"SELECT d.id, d.kind, d.object_id, -bm25({cls.table}_fts) AS rank "
+            f"FROM {cls.table}_fts JOIN {cls.table} d ON d.id = {cls.table}_fts.rowid "
+            f"WHERE {cls.table}_fts MATCH %s"
+        )
+        sql += cls.kinds_clause(kinds, params, column="d.kind")
+        params.append(pattern)
+        sql += (
+            f" UNION ALL SELECT id, kind, object_id, 0 FROM {cls.table} "
+            f"WHERE body LIKE %s ESCAPE '\\'"
+        )
+        sql += cls.kinds_clause(kinds, params)
+        sql += ") GROUP BY id ORDER BY rank DESC, id LIMIT %s OFFSET %s"
+        return cls.execute(sql, params + [limit, offset])
+
+
+class SearchIndex:
+    model = SearchDocument
+    backends = {
+        "postgresql": PostgresSearchBackend,
+        "sqlite": SQLiteSearchBackend,
+    }
+    # kind -> (model, columns concatenated into the document body)
+    sources = {
+        "group": (
+            Groups,
+            ("name", "teacher__first_name", "teacher__last_name", "direction__name"),
+        ),
+        "application": (
+            Application,
+            (
+                "student__first_name",
+                "student__last_name",
+                "student__phone",
+                "student__email",
+                "groups__name",
+                "direction__name",
+            ),
+        ),
+        "teacher": (
+            Teacher,
+            ("first_name", "last_name", "phone", "email", "patent_number"),
+        ),
+        "student": (Student, ("first_name", "last_name", "phone", "email")),
+    }
+
+    @classmethod
+    def tokenize(cls, query):
+        return re.findall(r"\w+", query.lower())
+
+    @classmethod
+    def documents(cls, kind, queryset=None):
+        model, columns = cls.sources[kind]
+        if queryset is None:
+            queryset = model.objects.all()
+        rows = queryset.order_by().values_list("pk", *columns)
+        for pk, *values in rows.iterator(chunk_size=2000):
+            body = " ".join(str(value) for value in values if value)
+            yield cls.model(kind=kind, object_id=pk, body=body.lower())
+
+    @classmethod
+    def save_documents(cls, documents):
+        return cls.model.objects.bulk_create(
+            documents,
+            update_conflicts=True,
+            unique_fields=["kind", "object_id"],
+            update_fields=["body", "updated_at"],
+        )
+
+    @classmethod
+    def index(cls, kind, ids):
+        """Re-index the given objects, dropping documents of ones that are gone."""
+        ids = set(ids)
+        if not ids:
+            return
+        model, _ = cls.sources[kind]
+        documents = list(cls.documents(kind, model.objects.filter(pk__in=ids)))
+        missing = ids - {document.object_id for document in documents}
+        if documents:
+            cls.save_documents(documents)
+        if missing:
+            cls.remove(kind, missing)
+
+    @classmethod
+    def index_queryset(cls, kind, queryset, batch_size=1000):
+        batch = []
+        for document in cls.documents(kind, queryset):
+            batch.append(document)
+            if len(batch) >= batch_size:
+                cls.save_documents(batch)
+                batch = []
+        if batch:
+            cls.save_documents(batch)
+
+    @classmethod
+    def remove(cls, kind, ids):
+        cls.model.objects.filter(kind=kind, object_id__in=list(ids)).delete()
+
+    @classmethod
+    def rebuild(cls, batch_size=1000):
+        cls.model.objects.all().delete()
+        for kind in cls.sources:
+            cls.index_queryset(kind, None, batch_size=batch_size)
+
+    @classmethod
+    def search(cls, query, kinds=None, limit=20, offset=0):
+        terms = cls.tokenize(query)
+        # Unlike the old `icontains` lookups, an empty query matches nothing
+        if not terms:
+            return []
+        backend = cls.backends.get(connection.vendor)
+        if backend is None:
+            return cls.fallback_search(terms, kinds, limit, offset)
+        return backend.search(terms, query.strip(), kinds, limit, offset)
+
+    @classmethod
+    def fallback_search(cls, terms, kinds, limit, offset):
+        documents = cls.model.objects.all()
+        for term in terms:
+            documents = documents.filter(body__contains=term)
+        if kinds:
+            documents = documents.filter(kind__in=kinds)
+        rows = documents.order_by("id").values_list("kind", "object_id")
+        return [(kind, object_id, 1.0) for kind, object_id in rows[offset : offset + limit]]
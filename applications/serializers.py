@@ -1,3 +1,5 @@
+import datetime
+
 from .models import (
     Groups,
     Direction,
@@ -9,9 +11,9 @@ from .models import (
 )
 from rest_framework import serializers
 from users.serializers import (
-    RegisterStudentSerializer, StudentInApplicationSerializer,
+    LeadStudentSerializer, StudentInApplicationSerializer,
 )
-from users.models import Student
+from users.services import StudentService
 
 
 class RejectionReasonSerializer(serializers.ModelSerializer):
@@ -64,12 +66,15 @@ class GroupsSerializer(serializers.ModelSerializer):
             'direction',
             'audience',
             'number_of_students',
+            'pending_students',
             'start_date',
             'end_date',
             'times',
             'timetable',
             'status',
         ]
+        # Maintained from the applications, see GroupOccupancyService
+        read_only_fields = ['number_of_students', 'pending_students']
 
 
 class SourceSerializer(serializers.ModelSerializer):
@@ -221,32 +226,22 @@ class ApplicationSerializer(serializers.ModelSerializer):
         ]
 
     def get_history(self, obj):
-        history_data = []
-        current_version = None
-        for history_instance in obj.history.all().order_by('history_date'):
-            history_changes = {}
-            previous_version = current_version
-            current_version = history_instance
-            if previous_version is not None:
-                delta = current_version.diff_against(previous_version)
-
-                for change in delta.changes:
-                    history_changes[change.field] = {
-                        'old': change.old,
-                        'new': change.new,
-                    }
-            history_data.append({
-                'id': history_instance.id,
-                'action': history_instance.history_type,
-                'timestamp': history_instance.history_date,
-                'user': history_instance.history_user.email if history_instance.history_user else None,
-                'changes': history_changes,
-            })
-        return history_data[::-1]
+        # Diffs are precomputed into ApplicationChange when history is written;
+        # prefetch `change_log` to read a whole page of applications at once.
+        return [
+            {
+                'id': change.application_id,
+                'action': change.action,
+                'timestamp': change.timestamp,
+                'user': change.user_email,
+                'changes': change.changes,
+            }
+            for change in obj.change_log.all()
+        ]
 
 
 class ApplicationCreateSerializer(serializers.ModelSerializer):
-    student = RegisterStudentSerializer()
+    student = LeadStudentSerializer()
 
     class Meta:
         model = Application
@@ -254,6 +249,75 @@ class ApplicationCreateSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         student_data = validated_data.pop('student')
-        student, _ = Student.objects.get_or_create(**student_data)
+        student = StudentService.upsert(**student_data)
         application = Application.objects.create(student=student, **validated_data)
         return application
+
+
+class ApplicationBatchChangesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Application
+        fields = [
+            'status',
+            'groups',
+            'direction',
+            'source',
+            'laptop',
+            'rejection_reason',
+            'reason_description',
+        ]
+        extra_kwargs = {field: {'required': False} for field in fields}
+
+
+class ApplicationIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=1000
+    )
+
+
+class ApplicationBatchUpdateSerializer(ApplicationIdsSerializer):
+    changes = ApplicationBatchChangesSerializer()
+
+    def validate_changes(self, value):
+        if not value:
+            raise serializers.ValidationError('At least one field must be changed')
+        return value
+
+
+class GroupScheduleCheckSerializer(serializers.ModelSerializer):
+    group = serializers.PrimaryKeyRelatedField(
+        queryset=Groups.objects.all(), required=False, help_text='Group being edited'
+    )
+
+    class Meta:
+        model = Groups
+        fields = ['group', 'teacher', 'audience', 'times', 'timetable', 'direction', 'start_date']
+        extra_kwargs = {field: {'required': False} for field in fields}
+
+    def validate(self, attrs):
+        group = attrs.pop('group', None)
+        if group is not None:
+            # Fields left out keep the values of the group being edited
+            for field in self.Meta.fields[1:]:
+                attrs.setdefault(field, getattr(group, field))
+        attrs.setdefault('audience', Groups._meta.get_field('audience').default)
+        attrs.setdefault('timetable', Groups._meta.get_field('timetable').default)
+        if attrs.get('times') is None:
+            raise serializers.ValidationError({'times': 'This field is required.'})
+        start_date, direction = attrs.get('start_date'), attrs.pop('direction', None)
+        if start_date and direction:
+            # Same rule as Groups.save; without a duration the end is unknown
+            attrs['end_date'] = (
+                start_date + datetime.timedelta(days=direction.duration * 30)
+                if direction.duration is not None
+                else None
+            )
+        else:
+            attrs['end_date'] = group.end_date if group else None
+        attrs['group'] = group.pk if group else None
+        attrs['teacher'] = attrs['teacher'].pk if attrs.get('teacher') else None
+        return attrs
+
+
+class GroupScheduleConflictsSerializer(serializers.Serializer):
+    week = serializers.DateField(required=False, help_text='Any day of the week')
@@ -1,8 +1,29 @@
-from .models import Application
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, Exists, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.forms.models import model_to_dict
 from rest_framework.exceptions import NotFound
 
+from .models import Application, ApplicationChange, ApplicationStatusTransition, Groups
+
+
 class ApplicationService:
     model = Application
+    list_fields = (
+        'id',
+        'status',
+        'updated_at',
+        'student__id',
+        'student__first_name',
+        'student__last_name',
+        'student__phone',
+        'student__payment',
+        'direction__id',
+        'direction__name',
+    )
+    detail_related_fields = ('student', 'direction', 'groups', 'source')
 
     @classmethod
     def get(cls, **filters):
@@ -10,3 +31,264 @@ class ApplicationService:
             return cls.model.objects.get(**filters)
         except cls.model.DoesNotExist:
             raise NotFound(detail={'error': ('Application not found!')})
+
+    @classmethod
+    def get_detail(cls, **filters):
+        # Everything ApplicationDetailSerializer nests, joined in one query
+        try:
+            return cls.model.objects.select_related(*cls.detail_related_fields).get(**filters)
+        except cls.model.DoesNotExist:
+            raise NotFound(detail={'error': ('Application not found!')})
+
+    @classmethod
+    def list_queryset(cls):
+        # Projection of exactly the columns ApplicationListSerializer renders
+        return cls.model.objects.select_related('student', 'direction').only(*cls.list_fields)
+
+
+class ApplicationChangeService:
+    model = ApplicationChange
+
+    @classmethod
+    def diff_fields(cls, history_model):
+        # The same fields `diff_against` compares in django-simple-history 3.3:
+        # `model_to_dict` skips non-editable ones, so the auto_now timestamps are
+        # not diffed. The change row's own `timestamp` records when it happened.
+        return [f.name for f in history_model.tracked_fields if f.editable]
+
+    @classmethod
+    def diff(cls, current, previous, fields):
+        if previous is None:
+            return {}
+        old_values = model_to_dict(previous, fields=fields)
+        new_values = model_to_dict(current, fields=fields)
+        return {
+            field: {'old': old_values[field], 'new': new_values[field]}
+            for field in fields
+            if old_values[field] != new_values[field]
+        }
+
+    @classmethod
+    def build(cls, current, previous, user_email=None):
+        return cls.model(
+            history_id=current.history_id,
+            application_id=current.id,
+            action=current.history_type,
+            timestamp=current.history_date,
+            user_email=user_email,
+            changes=cls.diff(current, previous, cls.diff_fields(type(current))),
+        )
+
+    @classmethod
+    def record(cls, history_instance, history_user=None):
+        history_model = type(history_instance)
+        previous = (
+            history_model.objects.filter(
+                id=history_instance.id, history_id__lt=history_instance.history_id
+            )
+            .order_by('-history_id')
+            .first()
+        )
+        change = cls.build(history_instance, previous, getattr(history_user, 'email', None))
+        change.save(force_insert=True)
+        transition = ApplicationTransitionService.build(
+            history_instance, previous, getattr(history_user, 'pk', None)
+        )
+        if transition is not None:
+            transition.save()
+        return change
+
+    @classmethod
+    def record_many(cls, history_instances, history_user=None):
+        """`record` for history written in bulk, which sends no signal per row."""
+        history_instances = list(history_instances)
+        if not history_instances:
+            return []
+        history_model = type(history_instances[0])
+        previous = {}
+        updated = [h.history_id for h in history_instances if h.history_type != '+']
+        if updated:
+            latest = (
+                history_model.objects.filter(
+                    id=OuterRef('id'), history_id__lt=OuterRef('history_id')
+                )
+                .order_by('-history_id')
+                .values('history_id')[:1]
+            )
+            pairs = dict(
+                history_model.objects.filter(history_id__in=updated)
+                .annotate(previous_id=Subquery(latest))
+                .values_list('history_id', 'previous_id')
+            )
+            records = history_model.objects.in_bulk(
+                [pk for pk in pairs.values() if pk is not None]
+            )
+            previous = {pk: records.get(previous_id) for pk, previous_id in pairs.items()}
+
+        user_email = getattr(history_user, 'email', None)
+        user_id = getattr(history_user, 'pk', None)
+        changes, transitions = [], []
+        for history in history_instances:
+            before = previous.get(history.history_id)
+            changes.append(cls.build(history, before, user_email))
+            transition = ApplicationTransitionService.build(history, before, user_id)
+            if transition is not None:
+                transitions.append(transition)
+        cls.model.objects.bulk_create(changes)
+        ApplicationStatusTransition.objects.bulk_create(transitions)
+        return changes
+
+    @classmethod
+    def backfill(cls, batch_size=1000):
+        """Build change rows for every history record that has none yet."""
+        history_model = Application.history.model
+        histories = (
+            history_model.objects.annotate(
+                has_change=Exists(cls.model.objects.filter(history=OuterRef('pk')))
+            )
+            .select_related('history_user')
+            .order_by('id', 'history_id')
+        )
+        previous = None
+        batch = []
+        created = 0
+        for history in histories.iterator(chunk_size=batch_size):
+            if previous is not None and previous.id != history.id:
+                previous = None
+            if not history.has_change:
+                user_email = history.history_user.email if history.history_user else None
+                batch.append(cls.build(history, previous, user_email))
+            previous = history
+            if len(batch) >= batch_size:
+                created += len(cls.model.objects.bulk_create(batch, ignore_conflicts=True))
+                batch = []
+        if batch:
+            created += len(cls.model.objects.bulk_create(batch, ignore_conflicts=True))
+        return created
+
+
+class ApplicationTransitionService:
+    model = ApplicationStatusTransition
+
+    @classmethod
+    def build(cls, current, previous, user_id=None):
+        """Transition between two history snapshots, None if the stage did not move."""
+        if current.history_type == '-':
+            return None
+        from_stage = cls.model.stage_of(previous) if previous is not None else None
+        to_stage = cls.model.stage_of(current)
+        if previous is not None and from_stage == to_stage:
+            return None
+        return cls.model(
+            application_id=current.id,
+            from_stage=from_stage,
+            to_stage=to_stage,
+            created_at=current.history_date,
+            user_id=user_id,
+        )
+
+    @classmethod
+    def backfill(cls, batch_size=1000):
+        """Replay history of applications that have no transitions recorded yet."""
+        history_model = Application.history.model
+        histories = (
+            history_model.objects.filter(
+                Exists(Application.objects.filter(pk=OuterRef('id'))),
+                ~Exists(cls.model.objects.filter(application=OuterRef('id'))),
+            )
+            .order_by('id', 'history_id')
+            .only('id', 'history_id', 'history_type', 'history_date', 'history_user_id',
+                  'status', 'transaction')
+        )
+        previous = None
+        batch = []
+        created = 0
+        for history in histories.iterator(chunk_size=batch_size):
+            if previous is not None and previous.id != history.id:
+                previous = None
+            transition = cls.build(history, previous, history.history_user_id)
+            if transition is not None:
+                batch.append(transition)
+            previous = history
+            if len(batch) >= batch_size:
+                created += len(cls.model.objects.bulk_create(batch))
+                batch = []
+        if batch:
+            created += len(cls.model.objects.bulk_create(batch))
+        return created
+
+
+class GroupOccupancyService:
+    """Keeps `Groups.number_of_students` and `pending_students` in step.
+
+    An application counts as enrolled in its group once `transaction` is set,
+    as pending while it is neither converted nor a failed deal.
+    """
+
+    model = Groups
+    counters = {'enrolled': 'number_of_students', 'pending': 'pending_students'}
+    failed_status = 4
+
+    @classmethod
+    def bucket(cls, is_transaction, status):
+        if is_transaction:
+            return 'enrolled'
+        if status != cls.failed_status:
+            return 'pending'
+        return None
+
+    @classmethod
+    def state(cls, application):
+        """Counter a single application instance adds to, or None."""
+        bucket = cls.bucket(application.transaction, application.status)
+        if application.groups_id is None or bucket is None:
+            return None
+        return application.groups_id, bucket
+
+    @classmethod
+    def snapshot(cls, queryset):
+        """Counters of many applications in one query, by application id."""
+        rows = queryset.order_by().values_list('pk', 'groups_id', 'transaction', 'status')
+        states = {}
+        for pk, groups_id, is_transaction, status in rows.iterator():
+            bucket = cls.bucket(is_transaction, status)
+            if groups_id is not None and bucket is not None:
+                states[pk] = (groups_id, bucket)
+        return states
+
+    @classmethod
+    def apply(cls, removed=(), added=()):
+        """Move counts from the `removed` states to the `added` ones with F() updates."""
+        deltas = Counter(state for state in added if state)
+        deltas.subtract(Counter(state for state in removed if state))
+        by_group = {}
+        for (groups_id, bucket), delta in deltas.items():
+            if delta:
+                by_group.setdefault(groups_id, {})[cls.counters[bucket]] = delta
+        with transaction.atomic():
+            for groups_id, changes in sorted(by_group.items()):
+                cls.model.objects.filter(pk=groups_id).update(
+                    **{field: F(field) + delta for field, delta in changes.items()}
+                )
+
+    @classmethod
+    def reconcile(cls):
+        """Recount every group from its applications in one UPDATE; return the rows fixed."""
+        def count(condition):
+            counts = (
+                Application.objects.filter(condition, groups=OuterRef('pk'))
+                .order_by()
+                .values('groups')
+                .annotate(total=Count('pk'))
+                .values('total')
+            )
+            return Coalesce(Subquery(counts), Value(0), output_field=IntegerField())
+
+        enrolled = count(Q(transaction=True))
+        pending = count(Q(transaction=False) & ~Q(status=cls.failed_status))
+        drifted = cls.model.objects.annotate(enrolled=enrolled, pending=pending).filter(
+            ~Q(number_of_students=F('enrolled')) | ~Q(pending_students=F('pending'))
+        )
+        return cls.model.objects.filter(pk__in=drifted.values('pk')).update(
+            number_of_students=enrolled, pending_students=pending
+        )
@@ -0,0 +1,158 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+from simple_history.signals import post_create_historical_record
+from users.models import Student, Teacher, User
+
+from .models import Application, Direction, Groups, Times
+from .schedule import ScheduleService
+from .search import SearchIndex
+from .services import ApplicationChangeService, GroupOccupancyService
+
+# Bulk writes (`bulk_create`, `bulk_update`, `QuerySet.update`) send no model
+# signals, so the services performing them send these with the affected `ids`.
+# `context` is the same dict in both calls of one write, for receivers that need
+# state from before it.
+pre_bulk_save = Signal()  # sender, ids, context
+post_bulk_save = Signal()  # sender, ids, created, context
+
+
+@receiver(post_create_historical_record, sender=Application.history.model)
+def record_application_change(sender, history_instance, history_user=None, **kwargs):
+    ApplicationChangeService.record(history_instance, history_user)
+
+
+@receiver(pre_save, sender=Application)
+@receiver(pre_delete, sender=Application)
+def remember_occupancy_state(sender, instance, raw=False, **kwargs):
+    instance._occupancy_state = None
+    if not raw and instance.pk is not None:
+        snapshot = GroupOccupancyService.snapshot(Application.objects.filter(pk=instance.pk))
+        instance._occupancy_state = snapshot.get(instance.pk)
+
+
+@receiver(post_save, sender=Application)
+def update_occupancy(sender, instance, raw=False, **kwargs):
+    if not raw:
+        GroupOccupancyService.apply(
+            removed=[getattr(instance, "_occupancy_state", None)],
+            added=[GroupOccupancyService.state(instance)],
+        )
+
+
+@receiver(post_delete, sender=Application)
+def remove_from_occupancy(sender, instance, **kwargs):
+    GroupOccupancyService.apply(removed=[getattr(instance, "_occupancy_state", None)])
+
+
+@receiver(pre_bulk_save, sender=Application)
+def remember_bulk_occupancy_state(sender, ids, context, **kwargs):
+    context["occupancy_state"] = GroupOccupancyService.snapshot(
+        Application.objects.filter(pk__in=ids)
+    )
+
+
+@receiver(post_bulk_save, sender=Application)
+def update_bulk_occupancy(sender, ids, context, **kwargs):
+    GroupOccupancyService.apply(
+        removed=context.get("occupancy_state", {}).values(),
+        added=GroupOccupancyService.snapshot(Application.objects.filter(pk__in=ids)).values(),
+    )
+
+
+@receiver(post_save, sender=Application)
+def index_application(sender, instance, raw=False, **kwargs):
+    if not raw:
+        SearchIndex.index("application", [instance.pk])
+
+
+@receiver(post_save, sender=Groups)
+@receiver(post_save, sender=Times)
+@receiver(post_delete, sender=Groups)
+@receiver(post_delete, sender=Times)
+def invalidate_schedule(sender, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(ScheduleService.bump)
+
+
+@receiver(pre_save, sender=Groups)
+def remember_indexed_group_name(sender, instance, raw=False, **kwargs):
+    instance._indexed_name = None
+    if not raw and instance.pk is not None:
+        instance._indexed_name = (
+            Groups.objects.filter(pk=instance.pk).values_list("name", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Groups)
+def index_group(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    SearchIndex.index("group", [instance.pk])
+    # Application documents carry only the group's name
+    if not created and getattr(instance, "_indexed_name", None) != instance.name:
+        SearchIndex.index_queryset("application", instance.application_set.all())
+
+
+@receiver(pre_save, sender=Direction)
+def remember_indexed_direction_name(sender, instance, raw=False, **kwargs):
+    instance._indexed_name = None
+    if not raw and instance.pk is not None:
+        instance._indexed_name = (
+            Direction.objects.filter(pk=instance.pk).values_list("name", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Direction)
+def index_direction(sender, instance, created=False, raw=False, **kwargs):
+    # Group and application documents carry only the direction's name
+    if raw or created or getattr(instance, "_indexed_name", None) == instance.name:
+        return
+    SearchIndex.index_queryset("group", instance.groups_set.all())
+    SearchIndex.index_queryset("application", instance.application_set.all())
+
+
+@receiver(post_save, sender=Teacher)
+def index_teacher(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    SearchIndex.index("teacher", [instance.pk])
+    # `teacher` is the related_name of Groups.teacher
+    SearchIndex.index_queryset("group", instance.teacher.all())
+
+
+@receiver(post_save, sender=Student)
+def index_student(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    SearchIndex.index("student", [instance.pk])
+    SearchIndex.index_queryset("application", instance.application_set.all())
+
+
+@receiver(post_save, sender=User)
+def index_user(sender, instance, created=False, raw=False, **kwargs):
+    # Profile edits save the base User row of a teacher or student
+    if raw or created:
+        return
+    if Teacher.objects.filter(pk=instance.pk).exists():
+        index_teacher(Teacher, Teacher(pk=instance.pk))
+    if Student.objects.filter(pk=instance.pk).exists():
+        index_student(Student, Student(pk=instance.pk))
+
+
+@receiver(post_bulk_save, sender=Application)
+@receiver(post_bulk_save, sender=Student)
+def index_bulk_saved(sender, ids, created=False, **kwargs):
+    kind = {Application: "application", Student: "student"}[sender]
+    SearchIndex.index(kind, ids)
+    if sender is Student and not created:
+        SearchIndex.index_queryset("application", Application.objects.filter(student_id__in=ids))
+
+
+@receiver(post_delete, sender=Application)
+@receiver(post_delete, sender=Groups)
+@receiver(post_delete, sender=Teacher)
+@receiver(post_delete, sender=Student)
+def remove_from_index(sender, instance, **kwargs):
+    kind = {Application: "application", Groups: "group", Teacher: "teacher", Student: "student"}[sender]
+    SearchIndex.remove(kind, [instance.pk])
@@ -1,3 +1,919 @@
-from django.test import TestCase
+import base64
+import csv
+import datetime
+import io
+import json
+import threading
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from analytics.services import AnalyticsQueryService
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+from users.models import Student, Teacher, User
+
+from .batch import ApplicationBatchService
+from .imports import LeadImportService
+from .pagination import ApplicationCursorPagination
+from .schedule import ScheduleService
+from .search import SearchIndex
+from .services import GroupOccupancyService
+from .models import (
+    Application,
+    ApplicationChange,
+    ApplicationStatusTransition,
+    Direction,
+    Groups,
+    RejectionReason,
+    SearchDocument,
+    Source,
+    Times,
+)
+
+
+def create_applications(count, direction, source, groups=None, offset=0):
+    applications = []
+    for i in range(offset, offset + count):
+        student = Student.objects.create(
+            email=f"student{i}@example.com",
+            phone=f"+996555{i:06d}",
+            first_name=f"Name{i}",
+            last_name=f"Surname{i}",
+        )
+        applications.append(
+            Application.objects.create(
+                student=student, direction=direction, source=source, groups=groups
+            )
+        )
+    return applications
+
+
+class ApplicationQueryCountTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.direction = Direction.objects.create(name="Python", duration=3)
+        cls.source = Source.objects.create(name="Instagram")
+        cls.groups = Groups.objects.create(
+            name="Python-1", direction=cls.direction, start_date=datetime.date.today()
+        )
+        cls.applications = create_applications(
+            100, cls.direction, cls.source, cls.groups
+        )
+
+    def test_list_page_query_count_is_constant(self):
+        url = reverse("applications_list")
+        # count + page
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {"limit": 10})
+        self.assertEqual(len(response.data["results"]), 10)
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {"limit": 100})
+        self.assertEqual(len(response.data["results"]), 100)
+        self.assertEqual(response.data["results"][0]["direction"]["name"], "Python")
+
+    def test_cursor_page_query_count_is_constant(self):
+        url = reverse("applications_list")
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {"pagination": "cursor", "limit": 100})
+        self.assertEqual(len(response.data["results"]), 100)
+        self.assertNotIn("count", response.data)
+
+    def test_detail_is_single_query(self):
+        application = self.applications[0]
+        self.client.force_authenticate(application.student)
+        url = reverse("application_detail_update_deletee", args=[application.pk])
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.data["groups"]["name"], "Python-1")
+        self.assertEqual(response.data["source"]["name"], "Instagram")
+
+
+class KeysetPaginationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        direction = Direction.objects.create(name="Python", duration=3)
+        source = Source.objects.create(name="Instagram")
+        create_applications(20, direction, source)
+        cls.ids = list(
+            Application.objects.order_by("-updated_at", "-id").values_list("id", flat=True)
+        )
+
+    def setUp(self):
+        self.url = reverse("applications_list")
+
+    def ids_of(self, response):
+        return [row["id"] for row in response.data["results"]]
+
+    def test_next_links_walk_every_row_once(self):
+        response = self.client.get(self.url, {"pagination": "cursor", "limit": 7})
+        self.assertIsNone(response.data["previous"])
+        seen = self.ids_of(response)
+        while response.data["next"]:
+            response = self.client.get(response.data["next"])
+            self.assertEqual(response.status_code, 200)
+            seen += self.ids_of(response)
+        self.assertEqual(seen, self.ids)
+
+    def test_previous_link_returns_the_page_before(self):
+        first = self.client.get(self.url, {"pagination": "cursor", "limit": 7})
+        second = self.client.get(first.data["next"])
+        third = self.client.get(second.data["next"])
+        self.assertEqual(self.ids_of(third), self.ids[14:])
+        self.assertIsNone(third.data["next"])
+
+        back = self.client.get(third.data["previous"])
+        self.assertEqual(self.ids_of(back), self.ids_of(second))
+        self.assertIsNotNone(back.data["next"])
+        back = self.client.get(back.data["previous"])
+        self.assertEqual(self.ids_of(back), self.ids_of(first))
+        self.assertIsNone(back.data["previous"])
+
+    def test_cursor_round_trip(self):
+        paginator = ApplicationCursorPagination()
+        application = Application.objects.get(pk=self.ids[3])
+        paginator.base_url = "http://testserver/applications/"
+        url = paginator.encode_cursor(application, reverse=True)
+        request = Request(APIRequestFactory().get(url))
+        reverse_flag, (value, pk) = paginator.decode_cursor(request)
+        self.assertTrue(reverse_flag)
+        self.assertEqual((value, pk), (application.updated_at, application.pk))
+
+    def test_malformed_cursor_is_not_found(self):
+        def encode(querystring):
+            return base64.b64encode(querystring.encode()).decode()
+
+        for cursor in (
+            "not base64!",
+            encode("r=0"),
+            encode("r=0&p=yesterday&i=1"),
+            encode("r=0&p=2024-01-01T00:00:00&i=one"),
+            encode("r=x&p=2024-01-01T00:00:00&i=1"),
+            base64.b64encode(b"\xff\xfe").decode(),
+        ):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(
+                    self.url, {"pagination": "cursor", "cursor": cursor}
+                )
+                self.assertEqual(response.status_code, 404)
+
+    def test_count_only_on_request(self):
+        response = self.client.get(
+            self.url, {"pagination": "cursor", "limit": 7, "count": "true"}
+        )
+        self.assertEqual(response.data["count"], 20)
+        response = self.client.get(response.data["next"])
+        self.assertEqual(response.data["count"], 20)
+        response = self.client.get(self.url, {"pagination": "cursor", "count": "false"})
+        self.assertNotIn("count", response.data)
+
+
+class LeadImportTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.direction = Direction.objects.create(name="Python", duration=3)
+        cls.source = Source.objects.create(name="Instagram")
+        cls.student = Student.objects.create(phone="+996555000001", first_name="Old")
+
+    def csv_file(self, rows, header="phone,first_name,last_name,email,direction,source,status"):
+        content = "\n".join([header, *rows]).encode()
+        return SimpleUploadedFile("leads.csv", content, content_type="text/csv")
+
+    def test_import_upserts_students_and_records_history(self):
+        file = self.csv_file(
+            [
+                "+996555000001,Aibek,,,python,Instagram,2",
+                "+996555000002,Aida,Ivanova,aida@example.com,python,Instagram,",
+                "+996555000002,Aida,Ivanova,aida@example.com,python,Instagram,3",
+                "0555000003,Bad,Phone,,python,Instagram,",
+                "+996555000004,Unknown,Direction,,Go,Instagram,",
+            ]
+        )
+        results = list(LeadImportService.run(LeadImportService.read(file, file.name)))
+
+        self.assertEqual([result["row"] for result in results], [2, 3, 4, 5, 6])
+        self.assertIn("phone", results[3]["errors"])
+        self.assertIn("direction", results[4]["errors"])
+        self.assertEqual(results[0]["student"], self.student.pk)
+        self.assertEqual(results[1]["student"], results[2]["student"])
+
+        self.student.refresh_from_db()
+        self.assertEqual(self.student.first_name, "Aibek")
+        created = Student.objects.get(phone="+996555000002")
+        self.assertEqual(created.email, "aida@example.com")
+        self.assertEqual(Student.objects.count(), 2)
+
+        ids = [result["application"] for result in results[:3]]
+        self.assertEqual(Application.history.filter(id__in=ids, history_type="+").count(), 3)
+        self.assertEqual(ApplicationChange.objects.filter(application_id__in=ids).count(), 3)
+        self.assertEqual(
+            list(
+                ApplicationStatusTransition.objects.filter(application_id__in=ids)
+                .order_by("application_id")
+                .values_list("to_stage", flat=True)
+            ),
+            [2, 1, 3],
+        )
+        self.assertTrue(
+            SearchDocument.objects.filter(kind="application", object_id__in=ids, body__contains="aida").exists()
+        )
+        self.assertTrue(
+            SearchDocument.objects.filter(kind="student", object_id=created.pk).exists()
+        )
+
+    def test_query_count_does_not_grow_with_rows(self):
+        def run(count, offset):
+            rows = [f"+996700{i:06d},Lead{i},,,Python,Instagram," for i in range(offset, offset + count)]
+            file = self.csv_file(rows)
+            with CaptureQueriesContext(connection) as context:
+                list(LeadImportService.run(LeadImportService.read(file, file.name), chunk_size=500))
+            return len(context)
+
+        # One chunk, and one INSERT per table, either way
+        self.assertEqual(run(5, 0), run(50, 100))
+
+    def test_endpoint_streams_results(self):
+        self.client.force_authenticate(self.student)
+        file = self.csv_file(["+996555000009,New,,,Python,Instagram,"])
+        response = self.client.post(reverse("application_import"), {"file": file}, format="multipart")
+        self.assertEqual(response.status_code, 200)
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(lines[-1], {"summary": {"total": 1, "created": 1, "failed": 0}})
+        history = Application.history.get(id=lines[0]["application"])
+        self.assertEqual(history.history_user_id, self.student.pk)
+
+    def test_endpoint_rejects_missing_columns(self):
+        self.client.force_authenticate(self.student)
+        file = self.csv_file(["Name"], header="first_name")
+        response = self.client.post(reverse("application_import"), {"file": file}, format="multipart")
+        self.assertEqual(response.status_code, 400)
+
+    def test_xlsx(self):
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        workbook.active.append(["Phone", "Direction", "Source"])
+        workbook.active.append([996555000010, self.direction.pk, "instagram"])
+        workbook.active.append(["+996555000011", "Python", "Instagram"])
+        content = io.BytesIO()
+        workbook.save(content)
+        content.seek(0)
+        results = list(LeadImportService.run(LeadImportService.read(content, "leads.xlsx")))
+        self.assertIn("phone", results[0]["errors"])
+        self.assertIn("application", results[1])
+
+
+class ApplicationChangeTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.direction = Direction.objects.create(name="Python", duration=3)
+        cls.source = Source.objects.create(name="Instagram")
+        cls.application = create_applications(1, cls.direction, cls.source)[0]
+
+    def test_history_records_field_diffs(self):
+        created = ApplicationChange.objects.get(application=self.application)
+        self.assertEqual((created.action, created.changes), ("+", {}))
+
+        self.application.status = 2
+        self.application.laptop = True
+        self.application.save()
+        updated = ApplicationChange.objects.filter(application=self.application).first()
+        self.assertEqual(updated.action, "~")
+        self.assertEqual(
+            updated.changes,
+            {"status": {"old": 1, "new": 2}, "laptop": {"old": False, "new": True}},
+        )
+        self.assertEqual(updated.timestamp, updated.history.history_date)
+
+    def test_backfill_rebuilds_missing_rows(self):
+        self.application.status = 2
+        self.application.save()
+        expected = list(
+            ApplicationChange.objects.order_by("history_id").values_list(
+                "history_id", "action", "changes"
+            )
+        )
+        ApplicationChange.objects.all().delete()
+
+        out = io.StringIO()
+        call_command("backfill_application_changes", stdout=out)
+        self.assertIn("Created 2 change log rows", out.getvalue())
+        self.assertEqual(
+            list(
+                ApplicationChange.objects.order_by("history_id").values_list(
+                    "history_id", "action", "changes"
+                )
+            ),
+            expected,
+        )
+
+        call_command("backfill_application_changes", stdout=out)
+        self.assertIn("Created 0 change log rows", out.getvalue())
+
+
+class GlobalSearchTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.direction = Direction.objects.create(name="Python", duration=3)
+        cls.source = Source.objects.create(name="Instagram")
+        cls.teacher = Teacher.objects.create(
+            email="teacher@example.com", phone="+996700000001", first_name="Asel"
+        )
+        cls.groups = Groups.objects.create(
+            name="Evening-7",
+            direction=cls.direction,
+            teacher=cls.teacher,
+            start_date=datetime.date.today(),
+        )
+        cls.applications = create_applications(5, cls.direction, cls.source, cls.groups)
+        for application, last_name in zip(cls.applications, ("Kanatov", "Osmonov")):
+            student = application.student
+            student.first_name, student.last_name = "Kanat", last_name
+            student.save()
+
+    def setUp(self):
+        self.url = reverse("global_search")
+
+    def search(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_response_shape(self):
+        response = self.search(q="evening", model_type="group")
+        self.assertEqual(set(response.data), {"page", "next", "previous", "results"})
+        [result] = response.data["results"]
+        self.assertEqual(result["type"], "group")
+        self.assertIsInstance(result["rank"], float)
+        self.assertEqual(result["data"]["id"], self.groups.pk)
+
+    def test_prefix_match_over_related_fields(self):
+        response = self.search(q="eveni pyth", model_type="application")
+        self.assertEqual(
+            sorted(result["data"]["id"] for result in response.data["results"]),
+            sorted(application.pk for application in self.applications),
+        )
+        response = self.search(q="asel")
+        self.assertEqual(
+            {(result["type"], result["data"]["id"]) for result in response.data["results"]},
+            {("teacher", self.teacher.pk), ("group", self.groups.pk)},
+        )
+
+    def test_results_are_ranked(self):
+        response = self.search(q="kanat", model_type="student")
+        results = response.data["results"]
+        self.assertEqual(
+            [result["data"]["id"] for result in results],
+            [self.applications[0].student_id, self.applications[1].student_id],
+        )
+        self.assertGreater(results[0]["rank"], results[1]["rank"])
+
+    def test_match_inside_a_word(self):
+        response = self.search(q="5000003", model_type="student")
+        self.assertEqual(
+            [result["data"]["id"] for result in response.data["results"]],
+            [self.applications[3].student_id],
+        )
+        response = self.search(q="MONOV", model_type="student")
+        self.assertEqual(
+            [result["data"]["id"] for result in response.data["results"]],
+            [self.applications[1].student_id],
+        )
+        self.assertEqual(self.search(q="50%3", model_type="student").data["results"], [])
+
+    def test_query_without_words_finds_nothing(self):
+        for query in ("", "  ", "!?"):
+            with self.subTest(query=query):
+                self.assertEqual(self.search(q=query).data["results"], [])
+
+    def test_pages(self):
+        response = self.search(q="student", model_type="student", limit=2)
+        self.assertIsNone(response.data["previous"])
+        seen = []
+        while True:
+            seen += [result["data"]["id"] for result in response.data["results"]]
+            if response.data["next"] is None:
+                break
+            response = self.client.get(response.data["next"])
+        self.assertEqual(response.data["page"], 3)
+        self.assertIsNotNone(response.data["previous"])
+        self.assertEqual(
+            sorted(seen), sorted(application.student_id for application in self.applications)
+        )
+
+    def test_invalid_parameters(self):
+        response = self.client.get(self.url, {"q": "kanat", "model_type": "course"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(self.url, {"q": "kanat", "page": "first"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_signals_reindex_changed_objects(self):
+        self.teacher.first_name = "Nurlan"
+        self.teacher.save()
+        self.assertEqual(self.search(q="asel").data["results"], [])
+        self.assertEqual(len(self.search(q="nurlan").data["results"]), 2)
+
+        self.groups.name = "Morning-3"
+        self.groups.save()
+        response = self.search(q="morning", model_type="application")
+        self.assertEqual(len(response.data["results"]), 5)
+        self.assertEqual(self.search(q="evening").data["results"], [])
+
+        self.applications[0].student.delete()
+        response = self.search(q="kanatov")
+        self.assertEqual(response.data["results"], [])
+
+    def test_group_save_reindexes_applications_only_on_rename(self):
+        with mock.patch.object(SearchIndex, "index_queryset") as index_queryset:
+            self.groups.audience = 2
+            self.groups.save()
+            index_queryset.assert_not_called()
+
+            self.groups.name = "Evening-8"
+            self.groups.save()
+            index_queryset.assert_called_once()
+            self.assertEqual(index_queryset.call_args.args[0], "application")
+
+    def test_direction_save_reindexes_only_on_rename(self):
+        with mock.patch.object(SearchIndex, "index_queryset") as index_queryset:
+            self.direction.duration = 4
+            self.direction.save()
+            index_queryset.assert_not_called()
+
+        self.direction.name = "Django"
+        self.direction.save()
+        response = self.search(q="django", model_type="application")
+        self.assertEqual(len(response.data["results"]), 5)
+        self.assertEqual(self.search(q="python").data["results"], [])
+
+    @skipUnless(connection.vendor == "sqlite", "FTS5 shadow table is SQLite only")
+    def test_fts_table_follows_documents(self):
+        def matches(term):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT rowid FROM applications_searchdocument_fts "
+                    "WHERE applications_searchdocument_fts MATCH %s",
+                    [term],
+                )
+                return [row[0] for row in cursor]
+
+        document = SearchDocument.objects.create(kind="student", object_id=0, body="zarina")
+        self.assertEqual(matches("zarina"), [document.pk])
+        SearchDocument.objects.filter(pk=document.pk).update(body="aidana")
+        self.assertEqual(matches("zarina"), [])
+        self.assertEqual(matches("aidana"), [document.pk])
+        document.delete()
+        self.assertEqual(matches("aidana"), [])
+
+
+class ExportTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        direction = Direction.objects.create(name="Python", duration=3)
+        source = Source.objects.create(name="Instagram")
+        cls.applications = create_applications(30, direction, source)
+        Application.objects.filter(pk__in=[a.pk for a in cls.applications[:5]]).update(status=3)
+
+    def setUp(self):
+        self.client.force_authenticate(self.applications[0].student)
+
+    def read(self, response):
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv_applies_list_filters(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("application_export"), {"status": 3})
+            rows = list(csv.DictReader(io.StringIO(self.read(response))))
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        self.assertEqual(len(rows), 5)
+        self.assertEqual({row["status"] for row in rows}, {"3"})
+        self.assertEqual(rows[0]["direction"], "Python")
+
+    def test_ndjson(self):
+        response = self.client.get(reverse("application_export"), {"format": "ndjson"})
+        rows = [json.loads(line) for line in self.read(response).splitlines()]
+        self.assertEqual(len(rows), 30)
+        self.assertEqual(rows[0]["source"], "Instagram")
+
+    def test_students_export_applies_search(self):
+        response = self.client.get(
+            reverse("list-of-students-export"), {"search": "Surname1", "format": "ndjson"}
+        )
+        rows = [json.loads(line) for line in self.read(response).splitlines()]
+        self.assertEqual(len(rows), 11)  # Surname1, Surname10..19
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(None)
+        response = self.client.get(reverse("application_export"))
+        self.assertEqual(response.status_code, 401)
+
+
+class BatchUpdateTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.direction = Direction.objects.create(name="Python", duration=3)
+        cls.source = Source.objects.create(name="Instagram")
+        cls.groups = Groups.objects.create(
+            name="Evening-7", direction=cls.direction, start_date=datetime.date.today()
+        )
+        cls.reason = RejectionReason.objects.create(title="Expensive")
+        cls.applications = create_applications(60, cls.direction, cls.source)
+
+    def setUp(self):
+        self.client.force_authenticate(self.applications[0].student)
+        self.url = reverse("application_batch_update")
+
+    def test_batch_update(self):
+        first, second, third = (application.pk for application in self.applications[:3])
+        Application.objects.filter(pk=third).update(status=2)
+        response = self.client.post(
+            self.url,
+            {"ids": [first, second, third, 999999], "changes": {"status": 2, "groups": self.groups.pk}},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data["results"],
+            [
+                {"id": first, "result": "updated"},
+                {"id": second, "result": "updated"},
+                {"id": third, "result": "updated"},
+                {"id": 999999, "result": "not_found"},
+            ],
+        )
+        response = self.client.post(
+            self.url, {"ids": [first], "changes": {"status": 2}}, format="json"
+        )
+        self.assertEqual(response.data["results"], [{"id": first, "result": "unchanged"}])
+
+        change = ApplicationChange.objects.filter(application_id=first).first()
+        self.assertEqual(change.action, "~")
+        self.assertEqual(change.changes["status"], {"old": 1, "new": 2})
+        self.assertEqual(change.user_email, self.applications[0].student.email)
+        self.assertEqual(
+            ApplicationStatusTransition.objects.filter(application_id=first, to_stage=2).count(), 1
+        )
+        self.assertTrue(
+            SearchDocument.objects.filter(
+                kind="application", object_id=first, body__contains="evening-7"
+            ).exists()
+        )
+
+    def test_rollups_follow_batch_update(self):
+        ids = [application.pk for application in self.applications[:10]]
+        self.client.post(
+            self.url, {"ids": ids, "changes": {"rejection_reason": self.reason.pk}}, format="json"
+        )
+        year = datetime.date.today().year
+        self.assertEqual(
+            AnalyticsQueryService.breakdown(year, "rejection_reason"),
+            AnalyticsQueryService.breakdown(year, "rejection_reason", live=True),
+        )
+
+    def test_query_count_does_not_grow_with_ids(self):
+        def run(applications, status):
+            ids = [application.pk for application in applications]
+            with CaptureQueriesContext(connection) as context:
+                self.client.post(self.url, {"ids": ids, "changes": {"status": status}}, format="json")
+            return len(context)
+
+        self.assertEqual(run(self.applications[:5], 2), run(self.applications[5:50], 2))
+
+    def test_invalid_changes(self):
+        response = self.client.post(self.url, {"ids": [1], "changes": {}}, format="json")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            self.url, {"ids": [1], "changes": {"groups": 999999}}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class AddToStudentTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        direction = Direction.objects.create(name="Python", duration=3)
+        source = Source.objects.create(name="Instagram")
+        cls.applications = create_applications(5, direction, source)
+
+    def test_single_conversion_is_idempotent(self):
+        application = self.applications[0]
+        url = reverse("add_student", args=[application.pk])
+        self.assertEqual(self.client.post(url).status_code, 200)
+        self.assertEqual(self.client.post(url).status_code, 200)
+        application.refresh_from_db()
+        application.student.refresh_from_db()
+        self.assertTrue(application.transaction)
+        self.assertIsNone(application.status)
+        self.assertEqual(application.student.status, 1)
+        self.assertEqual(application.history.filter(history_type="~").count(), 1)
+        self.assertEqual(
+            self.client.post(reverse("add_student", args=[999999])).status_code, 404
+        )
+
+    def test_batch_conversion(self):
+        self.client.force_authenticate(self.applications[0].student)
+        first, second = self.applications[0].pk, self.applications[1].pk
+        ApplicationBatchService.convert([first])
+        response = self.client.post(
+            reverse("batch_add_student"), {"ids": [first, second, 999999]}, format="json"
+        )
+        self.assertEqual(
+            response.data["results"],
+            [
+                {"id": first, "result": "already_converted"},
+                {"id": second, "result": "converted"},
+                {"id": 999999, "result": "not_found"},
+            ],
+        )
+        self.assertEqual(
+            ApplicationStatusTransition.objects.get(application_id=second, from_stage=1).to_stage,
+            ApplicationStatusTransition.STUDENT,
+        )
+
+
+@skipUnless(connection.vendor == "postgresql", "Row locks need PostgreSQL")
+class ConcurrentConversionTests(TransactionTestCase):
+    def test_only_one_of_concurrent_conversions_wins(self):
+        direction = Direction.objects.create(name="Python", duration=3)
+        source = Source.objects.create(name="Instagram")
+        application = create_applications(1, direction, source)[0]
+        barrier = threading.Barrier(4)
+        results = []
+
+        def convert():
+            barrier.wait()
+            try:
+                results.append(ApplicationBatchService.convert([application.pk])[application.pk])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=convert) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(ApplicationBatchService.CONVERTED), 1)
+        self.assertEqual(application.history.filter(history_type="~").count(), 1)
+
+
+class ApplicationCreateTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.direction = Direction.objects.create(name="Python", duration=3)
+        cls.source = Source.objects.create(name="Instagram")
+        cls.manager = Student.objects.create(email="manager@example.com", is_staff=True)
+
+    def setUp(self):
+        self.client.force_authenticate(self.manager)
+        self.url = reverse("application_create")
+
+    def payload(self, **student):
+        return {
+            "student": {"phone": "+996555000001", "first_name": "Aida", **student},
+            "direction": self.direction.pk,
+            "source": self.source.pk,
+        }
+
+    def test_known_phone_reuses_the_student(self):
+        existing = Student.objects.create(phone="+996 555 00-00-01", first_name="Aida")
+        response = self.client.post(self.url, self.payload(first_name="Aidai"), format="json")
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(self.url, self.payload(email="aida@example.com"), format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            list(Application.objects.values_list("student_id", flat=True)), [existing.pk] * 2
+        )
+
+    def test_new_phone_creates_a_student(self):
+        response = self.client.post(self.url, self.payload(), format="json")
+        self.assertEqual(response.status_code, 201)
+        student = Student.objects.get(phone="+996555000001")
+        self.assertEqual(student.phone_key, "996555000001")
+        self.assertEqual(Application.objects.get().student_id, student.pk)
+
+    def test_staff_phone_is_rejected(self):
+        User.objects.create(email="staff@example.com", phone="+996555000001", is_staff=True)
+        response = self.client.post(self.url, self.payload(), format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_idempotency_key_replays_the_first_application(self):
+        headers = {"HTTP_IDEMPOTENCY_KEY": "landing-42"}
+        first = self.client.post(self.url, self.payload(), format="json", **headers)
+        second = self.client.post(self.url, self.payload(), format="json", **headers)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(first.data["message"]["id"], second.data["message"]["id"])
+        self.assertEqual(Application.objects.count(), 1)
+
+    def test_idempotency_keys_are_per_user(self):
+        headers = {"HTTP_IDEMPOTENCY_KEY": "landing-42"}
+        first = self.client.post(self.url, self.payload(), format="json", **headers)
+        other = Student.objects.create(email="other@example.com", is_staff=True)
+        self.client.force_authenticate(other)
+        second = self.client.post(self.url, self.payload(), format="json", **headers)
+        self.assertEqual(second.status_code, 201)
+        self.assertNotIn("Idempotent-Replayed", second)
+        self.assertNotEqual(first.data["message"]["id"], second.data["message"]["id"])
+
+
+class GroupOccupancyTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.direction = Direction.objects.create(name="Python", duration=3)
+        cls.source = Source.objects.create(name="Instagram")
+        cls.groups = [
+            Groups.objects.create(name=name, direction=cls.direction, start_date=datetime.date.today())
+            for name in ("Python-1", "Python-2")
+        ]
+
+    def counts(self):
+        return [
+            (groups.number_of_students, groups.pending_students)
+            for groups in Groups.objects.order_by("pk")
+        ]
+
+    def test_counters_follow_applications(self):
+        first, second, third = create_applications(3, self.direction, self.source, self.groups[0])
+        self.assertEqual(self.counts(), [(0, 3), (0, 0)])
+
+        ApplicationBatchService.convert([first.pk])
+        self.assertEqual(self.counts(), [(1, 2), (0, 0)])
+
+        ApplicationBatchService.update([second.pk], {"groups": self.groups[1]})
+        self.assertEqual(self.counts(), [(1, 1), (0, 1)])
+
+        third.status = 4
+        third.save()
+        self.assertEqual(self.counts(), [(1, 0), (0, 1)])
+
+        Application.objects.get(pk=first.pk).delete()
+        self.assertEqual(self.counts(), [(0, 0), (0, 1)])
+
+    def test_reconcile(self):
+        create_applications(2, self.direction, self.source, self.groups[0])
+        Groups.objects.update(number_of_students=7, pending_students=0)
+        self.assertEqual(GroupOccupancyService.reconcile(), 2)
+        self.assertEqual(self.counts(), [(0, 2), (0, 0)])
+        self.assertEqual(GroupOccupancyService.reconcile(), 0)
+
+    def test_counts_are_exposed_read_only(self):
+        create_applications(1, self.direction, self.source, self.groups[0])
+        response = self.client.get(reverse("groups-detail", args=[self.groups[0].pk]))
+        self.assertEqual(
+            (response.data["number_of_students"], response.data["pending_students"]), (0, 1)
+        )
+        response = self.client.patch(
+            reverse("groups-detail", args=[self.groups[0].pk]),
+            {"number_of_students": 50},
+            format="json",
+        )
+        self.assertEqual(Groups.objects.get(pk=self.groups[0].pk).number_of_students, 0)
+
+
+class ScheduleTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.direction = Direction.objects.create(name="Python", duration=3)
+        cls.teachers = [
+            Teacher.objects.create(email=f"teacher{i}@example.com", phone=f"+996700{i:06d}")
+            for i in range(2)
+        ]
+        cls.morning = cls.create_times(9, 0, 11, 0)
+        cls.late_morning = cls.create_times(10, 30, 12, 0)
+        cls.noon = cls.create_times(11, 0, 13, 0)
+        cls.today = datetime.date.today()
+        cls.group = cls.create_group("Python-1", cls.teachers[0], 1, cls.morning)
+
+    @staticmethod
+    def create_times(start_hour, start_minute, end_hour, end_minute):
+        day = datetime.datetime(2023, 1, 2, tzinfo=datetime.timezone.utc)
+        return Times.objects.create(
+            start_date=day.replace(hour=start_hour, minute=start_minute),
+            end_date=day.replace(hour=end_hour, minute=end_minute),
+        )
+
+    @classmethod
+    def create_group(cls, name, teacher, audience, times, timetable=1, start_date=None):
+        return Groups.objects.create(
+            name=name,
+            direction=cls.direction,
+            teacher=teacher,
+            audience=audience,
+            times=times,
+            timetable=timetable,
+            start_date=start_date or cls.today,
+        )
+
+    def setUp(self):
+        # Writes in test transactions never commit, so the index is not told
+        ScheduleService.bump()
+
+    def check(self, **data):
+        data = {"direction": self.direction.pk, "start_date": self.today, **data}
+        response = self.client.post(reverse("group_schedule_check"), data, format="json")
+        self.assertEqual(response.status_code, 200, response.data)
+        return [(item["resource"], item["group"]["id"]) for item in response.data["conflicts"]]
+
+    def test_check_overlapping_teacher_and_audience(self):
+        self.assertEqual(
+            self.check(teacher=self.teachers[0].pk, audience=1, times=self.late_morning.pk),
+            [("teacher", self.group.pk)] * 3 + [("audience", self.group.pk)] * 3,
+        )
+        self.assertEqual(
+            self.check(teacher=self.teachers[1].pk, audience=2, times=self.late_morning.pk), []
+        )
+        # Back to back lessons and the other days of the week do not clash
+        self.assertEqual(self.check(teacher=self.teachers[0].pk, times=self.noon.pk), [])
+        self.assertEqual(
+            self.check(teacher=self.teachers[0].pk, times=self.morning.pk, timetable=2), []
+        )
+
+    def test_check_ignores_groups_running_at_other_dates(self):
+        later = self.today + datetime.timedelta(days=365)
+        self.assertEqual(
+            self.check(teacher=self.teachers[0].pk, times=self.morning.pk, start_date=later), []
+        )
+        Groups.objects.filter(pk=self.group.pk).update(end_date=self.today - datetime.timedelta(days=1))
+        ScheduleService.bump()
+        self.assertEqual(self.check(teacher=self.teachers[0].pk, times=self.morning.pk), [])
+
+    def test_direction_without_a_duration_runs_open_ended(self):
+        direction = Direction.objects.create(name="Design")
+        later = self.today + datetime.timedelta(days=30)
+        self.assertEqual(
+            self.check(
+                direction=direction.pk,
+                start_date=later,
+                teacher=self.teachers[0].pk,
+                audience=2,
+                times=self.morning.pk,
+            ),
+            [("teacher", self.group.pk)] * 3,
+        )
+
+    def test_edited_group_does_not_conflict_with_itself(self):
+        self.assertEqual(self.check(group=self.group.pk), [])
+        other = self.create_group("Python-2", self.teachers[1], 2, self.noon)
+        ScheduleService.bump()
+        self.assertEqual(
+            self.check(group=other.pk, times=self.late_morning.pk, audience=1),
+            [("audience", self.group.pk)] * 3,
+        )
+
+    def test_check_reads_the_index_without_queries(self):
+        times = Times.objects.get(pk=self.late_morning.pk)
+        ScheduleService.get_index()
+        with self.assertNumQueries(0):
+            conflicts = ScheduleService.check(self.teachers[0].pk, 3, 1, times, self.today)
+        self.assertEqual(len(conflicts), 3)
+
+    def test_index_is_rebuilt_after_commit(self):
+        ScheduleService.get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_group("Python-2", self.teachers[1], 1, self.noon)
+        self.assertEqual(
+            self.check(teacher=self.teachers[1].pk, audience=3, times=self.late_morning.pk),
+            [("teacher", Groups.objects.get(name="Python-2").pk)] * 3,
+        )
+
+    def test_index_expires_without_a_bump(self):
+        max_ages = {True: ScheduleService.max_age, False: ScheduleService.local_max_age}
+        for shared, max_age in max_ages.items():
+            with self.subTest(shared=shared), self.settings(SHARED_CACHE=shared):
+                Groups.objects.filter(pk=self.group.pk).update(teacher=self.teachers[1])
+                ScheduleService.bump()
+                ScheduleService.get_index()
+                self.assertAlmostEqual(
+                    ScheduleService._index_expires - time.monotonic(), max_age, delta=1
+                )
+                # Another process moved the group back, its bump never arrived
+                Groups.objects.filter(pk=self.group.pk).update(teacher=self.teachers[0])
+                data = {"teacher": self.teachers[0].pk, "audience": 3, "times": self.morning.pk}
+                self.assertEqual(self.check(**data), [])
+                ScheduleService._index_expires = time.monotonic()
+                self.assertEqual(self.check(**data), [("teacher", self.group.pk)] * 3)
+
+    def test_week_conflicts(self):
+        other = self.create_group("Python-2", self.teachers[0], 2, self.late_morning)
+        self.create_group("Python-3", self.teachers[1], 2, self.noon, timetable=2)
+        ScheduleService.bump()
+        week = self.today + datetime.timedelta(days=7)
+        response = self.client.get(reverse("group_schedule_conflicts"), {"week": week})
+        monday = week - datetime.timedelta(days=week.weekday())
+        self.assertEqual(
+            [
+                (item["resource"], item["date"], item["group"]["id"], item["conflicting_group"]["id"])
+                for item in response.data["conflicts"]
+            ],
+            [
+                ("teacher", monday + datetime.timedelta(days=day), self.group.pk, other.pk)
+                for day in (0, 2, 4)
+            ],
+        )
@@ -8,12 +8,18 @@ from .views import (
     SourceViewSet,
     ApplicationListView,
     ApplicationCreateView,
+    ApplicationImportView,
+    ApplicationBatchUpdateView,
+    ApplicationExportView,
     ApplicationRetrieveUpdateDeleteView,
     RejectionReasonViewSet,
     UserArchieveUpdateRetrieveView,
     UserUnarchieveUpdateRetrieveView,
     GlobalSearchView,
     AddToStudentView,
+    BatchAddToStudentView,
+    GroupScheduleCheckView,
+    GroupScheduleConflictsView,
 )
 
 applications_router = routers.DefaultRouter()
@@ -29,7 +35,13 @@ urlpatterns = [
     path('user/unarchive/<int:pk>', UserUnarchieveUpdateRetrieveView.as_view(), name='user_arhive'),
     path('global-search/', GlobalSearchView.as_view(), name='global_search'),
     path('student/add/<int:pk>', AddToStudentView.as_view(), name='add_student'),
+    path('student/add/', BatchAddToStudentView.as_view(), name='batch_add_student'),
+    path('schedule/check/', GroupScheduleCheckView.as_view(), name='group_schedule_check'),
+    path('schedule/conflicts/', GroupScheduleConflictsView.as_view(), name='group_schedule_conflicts'),
     path('', ApplicationListView.as_view(), name='applications_list'),
     path('create/', ApplicationCreateView.as_view(), name='application_create'),
+    path('export/', ApplicationExportView.as_view(), name='application_export'),
+    path('batch-update/', ApplicationBatchUpdateView.as_view(), name='application_batch_update'),
+    path('import/', ApplicationImportView.as_view(), name='application_import'),
     path('<int:pk>/', ApplicationRetrieveUpdateDeleteView.as_view(), name='application_detail_update_deletee'),
 ]
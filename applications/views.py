@@ -1,10 +1,16 @@
-from django.db.models import Q
+import json
+
+from django.db import IntegrityError, transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import filters, permissions, status
 from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.viewsets import ModelViewSet, generics, views
 from users.models import Student, Teacher, User
 from users.serializers import (
@@ -13,7 +19,7 @@ from users.serializers import (
 )
 from users.services import UserService
 
-from applications.pagination import CustomPagination
+from applications.pagination import ApplicationCursorPagination, CustomPagination
 
 from .models import (
     Application,
@@ -25,18 +31,27 @@ from .models import (
     Times,
 )
 from .serializers import (
+    ApplicationBatchUpdateSerializer,
+    ApplicationIdsSerializer,
     ApplicationCreateSerializer,
     ApplicationDetailSerializer,
     ApplicationListSerializer,
     ApplicationSerializer,
     ApplicationUpdateSerializer,
     DirectionSerializer,
+    GroupScheduleCheckSerializer,
+    GroupScheduleConflictsSerializer,
     GroupsSerializer,
     GroupStatusSerializer,
     RejectionReasonSerializer,
     SourceSerializer,
     TimesSerializer,
 )
+from .batch import ApplicationBatchService
+from .exports import StreamingExportMixin
+from .imports import LeadImportService
+from .schedule import ScheduleService
+from .search import SearchIndex
 from .services import ApplicationService
 
 
@@ -52,6 +67,41 @@ class GroupsViewSet(ModelViewSet):
     serializer_class = GroupsSerializer
 
 
+class GroupScheduleCheckView(generics.GenericAPIView):
+    serializer_class = GroupScheduleCheckSerializer
+
+    @swagger_auto_schema(
+        operation_description="Check whether a new group, or an edited one passed as "
+        "`group`, would share its teacher or audience with another active group"
+    )
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                data={"error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST
+            )
+        conflicts = ScheduleService.check(**serializer.validated_data)
+        return Response(data={"conflict": bool(conflicts), "conflicts": conflicts})
+
+
+class GroupScheduleConflictsView(generics.GenericAPIView):
+    serializer_class = GroupScheduleConflictsSerializer
+
+    @swagger_auto_schema(
+        query_serializer=GroupScheduleConflictsSerializer,
+        operation_description="Every teacher or audience double booking in a week, "
+        "the current one by default",
+    )
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(
+                data={"error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST
+            )
+        week = serializer.validated_data.get("week") or timezone.localdate()
+        return Response(data={"conflicts": ScheduleService.week_conflicts(week)})
+
+
 class DirectionViewSet(ModelViewSet):
     queryset = Direction.objects.all()
     serializer_class = DirectionSerializer
@@ -73,24 +123,131 @@ class SourceViewSet(ModelViewSet):
 
 
 class ApplicationListView(generics.ListAPIView):
-    queryset = Application.objects.all()
+    queryset = ApplicationService.list_queryset()
     serializer_class = ApplicationListSerializer
     pagination_class = CustomPagination
+    cursor_pagination_class = ApplicationCursorPagination
     filter_backends = (
         DjangoFilterBackend,
         filters.OrderingFilter,
     )
     filterset_fields = ["status"]
+    ordering = ("-updated_at", "-id")
+
+    @property
+    def paginator(self):
+        # `?pagination=cursor` switches to keyset pages ordered by (updated_at, id)
+        if not hasattr(self, "_paginator"):
+            if self.request.query_params.get("pagination") == "cursor":
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                "pagination",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                enum=["page", "cursor"],
+                description="Pagination mode, `cursor` pages by (updated_at, id) without a count",
+            ),
+            openapi.Parameter(
+                "cursor",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description="Opaque cursor from `next`/`previous` (cursor mode only)",
+            ),
+            openapi.Parameter(
+                "count",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_BOOLEAN,
+                description="Include the total count (cursor mode only)",
+            ),
+        ]
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class ApplicationExportView(StreamingExportMixin, ApplicationListView):
+    renderer_classes = StreamingExportMixin.export_renderer_classes
+    permission_classes = StreamingExportMixin.export_permission_classes
+    export_name = "applications"
+    export_fields = {
+        "id": "id",
+        "status": "status",
+        "transaction": "transaction",
+        "student_id": "student_id",
+        "first_name": "student__first_name",
+        "last_name": "student__last_name",
+        "phone": "student__phone",
+        "email": "student__email",
+        "direction": "direction__name",
+        "source": "source__name",
+        "groups": "groups__name",
+        "laptop": "laptop",
+        "rejection_reason": "rejection_reason__title",
+        "reason_description": "reason_description",
+        "created_at": "created_at",
+        "updated_at": "updated_at",
+    }
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                "format",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                enum=["csv", "ndjson"],
+                description="Export format, csv by default",
+            ),
+        ]
+    )
+    def get(self, request, *args, **kwargs):
+        return self.export(request)
 
 
 class ApplicationCreateView(generics.CreateAPIView):
     serializer_class = ApplicationCreateSerializer
     permission_classes = [permissions.IsAuthenticated]
+    idempotency_header = "Idempotency-Key"
 
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                "Idempotency-Key",
+                openapi.IN_HEADER,
+                type=openapi.TYPE_STRING,
+                description="Retries by the same user with the same key return the "
+                "application created by the first request instead of a new one",
+            ),
+        ]
+    )
     def post(self, request, *args, **kwargs):
+        key = request.headers.get(self.idempotency_header) or None
+        if key is not None:
+            if len(key) > 255:
+                raise ValidationError(detail={"error": "Idempotency-Key is too long"})
+            # Keys are per user, so nobody replays, or collides with, another's
+            key = f"{request.user.pk}:{key}"
+            application = Application.objects.filter(idempotency_key=key).first()
+            if application is not None:
+                return self.replay(application)
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            try:
+                with transaction.atomic():
+                    serializer.save(idempotency_key=key)
+            except IntegrityError:
+                # A concurrent retry with the same key got there first
+                if key is None:
+                    raise
+                application = Application.objects.filter(idempotency_key=key).first()
+                if application is None:
+                    raise
+                return self.replay(application)
             return Response(
                 data={"message": serializer.data}, status=status.HTTP_201_CREATED
             )
@@ -99,6 +256,70 @@ class ApplicationCreateView(generics.CreateAPIView):
                 data={"error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST
             )
 
+    def replay(self, application):
+        return Response(
+            data={"message": self.get_serializer(application).data},
+            status=status.HTTP_201_CREATED,
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+
+class ApplicationImportView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                "file",
+                openapi.IN_FORM,
+                type=openapi.TYPE_FILE,
+                required=True,
+                description="CSV or XLSX with the columns phone, first_name, last_name, "
+                "email, direction, source, groups, status, laptop",
+            ),
+        ],
+        responses={200: "NDJSON: one result per row, then a summary line"},
+    )
+    def post(self, request, *args, **kwargs):
+        file = request.FILES.get("file")
+        if file is None:
+            raise ValidationError(detail={"error": "file is required"})
+        rows = LeadImportService.read(file, file.name)
+        results = LeadImportService.run(rows, user=request.user)
+        return StreamingHttpResponse(
+            self.stream(results), content_type="application/x-ndjson"
+        )
+
+    @staticmethod
+    def stream(results):
+        summary = {"total": 0, "created": 0, "failed": 0}
+        for result in results:
+            summary["total"] += 1
+            summary["failed" if "errors" in result else "created"] += 1
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        yield json.dumps({"summary": summary}) + "\n"
+
+
+class ApplicationBatchUpdateView(generics.GenericAPIView):
+    serializer_class = ApplicationBatchUpdateSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                data={"error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST
+            )
+        results = ApplicationBatchService.update(
+            serializer.validated_data["ids"],
+            serializer.validated_data["changes"],
+            user=request.user,
+        )
+        return Response(
+            data={"results": [{"id": pk, "result": result} for pk, result in results.items()]}
+        )
+
 
 class ApplicationRetrieveUpdateDeleteView(generics.GenericAPIView):
     queryset = Application.objects.all()
@@ -107,7 +328,7 @@ class ApplicationRetrieveUpdateDeleteView(generics.GenericAPIView):
     lookup_field = "pk"
 
     def get(self, request, *args, **kwargs):
-        application = ApplicationService.get(id=kwargs["pk"])
+        application = ApplicationService.get_detail(id=kwargs["pk"])
         serializer = ApplicationDetailSerializer(application)
         return Response(serializer.data)
 
@@ -158,13 +379,28 @@ class UserUnarchieveUpdateRetrieveView(views.APIView):
 
 
 class GlobalSearchView(views.APIView):
+    page_size = 20
+    max_page_size = 100
+    # kind -> (queryset used to load the page's hits, serializer)
+    result_types = {
+        "group": (Groups.objects.all(), GroupsSerializer),
+        "application": (
+            Application.objects.prefetch_related("change_log"),
+            ApplicationSerializer,
+        ),
+        "teacher": (Teacher.objects.all(), TeacherSerializer),
+        "student": (Student.objects.all(), StudentSerializer),
+    }
+
     @swagger_auto_schema(
         manual_parameters=[
             openapi.Parameter(
                 "q",
                 openapi.IN_QUERY,
                 type=openapi.TYPE_STRING,
-                description="Search query",
+                description="Search query, matched as word prefixes or anywhere in a "
+                "field, word prefix matches ranking first. A query without "
+                "any letters or digits (including an empty one) finds nothing",
             ),
             # New parameter for specifying the model type
             openapi.Parameter(
@@ -173,48 +409,67 @@ class GlobalSearchView(views.APIView):
                 type=openapi.TYPE_STRING,
                 description="Model type to search in (application, group, teacher, student)",
             ),
+            openapi.Parameter(
+                "page",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_INTEGER,
+                description="Page number",
+            ),
+            openapi.Parameter(
+                "limit",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_INTEGER,
+                description="Results per page",
+            ),
         ]
     )
     def get(self, request, *args, **kwargs):
         search_query = request.query_params.get("q", "")
         model_type = request.query_params.get("model_type", "").lower()
-
-        results = []
-
-        if model_type == "group" or model_type == "":
-            groups = Groups.objects.filter(
-                Q(name__icontains=search_query)
-                | Q(teacher__first_name__icontains=search_query)
-                | Q(direction__name__icontains=search_query)
-            )
-            results += GroupsSerializer(groups, many=True).data
-
-        if model_type == "application" or model_type == "":
-            applications = Application.objects.filter(
-                Q(student__first_name__icontains=search_query)
-                | Q(student__last_name__icontains=search_query)
-                | Q(groups__name__icontains=search_query)
-                | Q(direction__name__icontains=search_query)
-            )
-            results += ApplicationSerializer(applications, many=True).data
-
-        if model_type == "teacher" or model_type == "":
-            teachers = Teacher.objects.filter(
-                Q(first_name__icontains=search_query)
-                | Q(last_name__icontains=search_query)
-                | Q(patent_number__icontains=search_query)
-            )
-            results += TeacherSerializer(teachers, many=True).data
-
-        if model_type == "student" or model_type == "":
-            students = Student.objects.filter(
-                Q(first_name__icontains=search_query)
-                | Q(last_name__icontains=search_query)
-            )
-            results += StudentSerializer(students, many=True).data
-
-        combined_results = {"results": results}
-        return Response(combined_results)
+        if model_type and model_type not in self.result_types:
+            raise ValidationError(detail={"error": "Unknown model type!"})
+        try:
+            page = max(int(request.query_params.get("page", 1)), 1)
+            limit = int(request.query_params.get("limit", self.page_size))
+        except ValueError:
+            raise ValidationError(detail={"error": "Page and limit must be integers!"})
+        limit = min(max(limit, 1), self.max_page_size)
+
+        # One extra hit tells whether there is a next page without counting
+        hits = SearchIndex.search(
+            search_query,
+            kinds=[model_type] if model_type else None,
+            limit=limit + 1,
+            offset=(page - 1) * limit,
+        )
+        has_next = len(hits) > limit
+        hits = hits[:limit]
+
+        ids_by_kind = {}
+        for kind, object_id, _ in hits:
+            ids_by_kind.setdefault(kind, []).append(object_id)
+        data_by_kind = {}
+        for kind, ids in ids_by_kind.items():
+            queryset, serializer_class = self.result_types[kind]
+            objects = queryset.filter(pk__in=ids)
+            data_by_kind[kind] = {
+                item["id"]: item for item in serializer_class(objects, many=True).data
+            }
+
+        results = [
+            {"type": kind, "rank": rank, "data": data_by_kind[kind][object_id]}
+            for kind, object_id, rank in hits
+            if object_id in data_by_kind[kind]
+        ]
+        url = request.build_absolute_uri()
+        return Response(
+            {
+                "page": page,
+                "next": replace_query_param(url, "page", page + 1) if has_next else None,
+                "previous": replace_query_param(url, "page", page - 1) if page > 1 else None,
+                "results": results,
+            }
+        )
 
 
 class AddToStudentView(views.APIView):
@@ -231,18 +486,31 @@ class AddToStudentView(views.APIView):
         operation_description="Add application to student and change student status to STUDYING",
     )
     def post(self, request, *args, **kwargs):
-        application = ApplicationService.get(id=kwargs["pk"])
-        try:
-            student = application.student
-        except:
-            raise NotFound(detail={"error": ("Student not found!")})
-
-        if not application.transaction:
-            application.transaction = True
-            application.status = None
-            application.save()
-            student.status = 1
-            student.save()
+        user = request.user if request.user.is_authenticated else None
+        results = ApplicationBatchService.convert([kwargs["pk"]], user=user)
+        if results[kwargs["pk"]] == ApplicationBatchService.NOT_FOUND:
+            raise NotFound(detail={"error": ("Application not found!")})
         return Response(
             data={"message": ("Student successfully added!")}, status=status.HTTP_200_OK
         )
+
+
+class BatchAddToStudentView(generics.GenericAPIView):
+    serializer_class = ApplicationIdsSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description="Add many applications to students in one transaction"
+    )
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                data={"error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST
+            )
+        results = ApplicationBatchService.convert(
+            serializer.validated_data["ids"], user=request.user
+        )
+        return Response(
+            data={"results": [{"id": pk, "result": result} for pk, result in results.items()]}
+        )
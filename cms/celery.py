@@ -0,0 +1,10 @@
+import os
+
+from celery import Celery
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "cms.settings")
+
+app = Celery("cms")
+# Settings prefixed CELERY_, e.g. CELERY_BROKER_URL
+app.config_from_object("django.conf:settings", namespace="CELERY")
+app.autodiscover_tasks()
@@ -55,6 +55,7 @@ INSTALLED_APPS = [
     "users",
     "applications",
     "notifications",
+    "analytics",
 ]
 
 MIDDLEWARE = [
@@ -115,6 +116,31 @@ else:
         }
     }
 
+# Cache
+# Locmem by default, Redis when REDIS_URL is set (e.g. redis://redis:6379/1)
+REDIS_URL = config("REDIS_URL", default="")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Locmem is private to each worker process: a value one of them writes (or
+# deletes) is never seen by the others, so anything that must be consistent
+# across workers checks this flag.
+SHARED_CACHE = bool(REDIS_URL)
+
+# One-time codes live in the shared cache, without Redis in the database instead.
+OTP_BACKEND = "users.otp.CacheOTPBackend" if SHARED_CACHE else "users.otp.DatabaseOTPBackend"
+
 # DATABASE_URL = os.environ.get('DATABASE_URL')
 # db_from_env = dj_database_url.config(default=DATABASE_URL, conn_max_age=500, ssl_require=True)
 # DATABASES['default'].update(db_from_env)
@@ -169,7 +195,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "users.authentication.CachedJWTAuthentication",
     ],
     # 'DEFAULT_FILTER_BACKENDS': [
     #     'django_filters.rest_framework.DjangoFilterBackend'
@@ -214,6 +240,27 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = config("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = config("EMAIL_HOST_PASSWORD")
 
+# Celery
+# Without a broker, tasks run eagerly in the calling process, i.e. inside the
+# request (tests, local runs). Deployments set REDIS_URL and run the `worker`
+# and `beat` processes of the Procfile; `manage.py check --deploy` warns if not.
+CELERY_BROKER_URL = config("CELERY_BROKER_URL", default=REDIS_URL)
+CELERY_TASK_ALWAYS_EAGER = config(
+    "CELERY_TASK_ALWAYS_EAGER", default=not CELERY_BROKER_URL, cast=bool
+)
+CELERY_TASK_EAGER_PROPAGATES = True
+CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+CELERY_BEAT_SCHEDULE = {
+    # Picks up the retries of failed messages and flushes that could not be queued
+    "flush-outbox": {"task": "notifications.tasks.flush_outbox", "schedule": 60.0},
+    # Picks up push broadcasts whose fan-out was never queued or failed
+    "fan-out-pushes": {
+        "task": "notifications.tasks.fan_out_pending_pushes",
+        "schedule": 60.0,
+    },
+}
+
 # cloudinary
 CLOUDINARY_STORAGE = {
     "CLOUD_NAME": config("CLOUD_NAME"),
@@ -234,6 +281,9 @@ PUSH_NOTIFICATIONS_SETTINGS = {
     "APNS_TEAM_ID": "6L9DH3S5SA",
 }
 
+# notifications.push.StubPushTransport keeps pushes in memory, for offline runs
+PUSH_TRANSPORT = config("PUSH_TRANSPORT", default="notifications.push.APNSPushTransport")
+
 
 CSRF_TRUSTED_ORIGINS = ["https://neobook.online"]
 
@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import Notifcation
+from .models import Notifcation, OutboundEmail
 
 # Register your models here.
 
 admin.site.register(Notifcation)
+admin.site.register(OutboundEmail)
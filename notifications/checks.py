@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.compatibility, deploy=True)
+def check_celery_broker(app_configs, **kwargs):
+    # Eager tasks run in the process that queues them, i.e. inside requests
+    if not settings.CELERY_TASK_ALWAYS_EAGER:
+        return []
+    return [
+        Warning(
+            "Celery tasks run eagerly, so mail and push notifications are sent "
+            "inside the requests that queue them.",
+            hint="Set REDIS_URL (or CELERY_BROKER_URL) and run the worker and beat "
+            "processes from the Procfile.",
+            id="notifications.W001",
+        )
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.1.5 on 2026-10-18 08:46
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push_notifications', '0009_alter_apnsdevice_device_id'),
+        ('applications', '0030_groups_pending_students'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notifications', '0004_outboundemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PushBroadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255)),
+                ('body', models.CharField(max_length=555)),
+                ('type', models.CharField(max_length=255)),
+                ('audience', models.PositiveSmallIntegerField(choices=[(1, 'Студенты'), (2, 'Сотрудники')])),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('recipients', models.IntegerField(default=0)),
+                ('sent', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('direction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='applications.direction')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PushDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('result', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('broadcast', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='notifications.pushbroadcast')),
+                ('device', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='push_notifications.apnsdevice')),
+            ],
+        ),
+    ]
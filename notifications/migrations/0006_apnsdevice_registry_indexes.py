@@ -0,0 +1,40 @@
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def remove_duplicate_devices(apps, schema_editor):
+    APNSDevice = apps.get_model("push_notifications", "APNSDevice")
+    duplicates = (
+        APNSDevice.objects.values("registration_id")
+        .annotate(keep=Max("id"), count=Count("id"))
+        .filter(count__gt=1)
+    )
+    for row in duplicates.iterator():
+        # The latest registration of a token is the one that is current
+        APNSDevice.objects.filter(registration_id=row["registration_id"]).exclude(
+            pk=row["keep"]
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push_notifications', '0009_alter_apnsdevice_device_id'),
+        ('notifications', '0005_pushbroadcast_pushdelivery'),
+    ]
+
+    # The device table belongs to push_notifications, whose model cannot carry
+    # these indexes, so they are created in SQL
+    operations = [
+        migrations.RunPython(remove_duplicate_devices, migrations.RunPython.noop),
+        migrations.RunSQL(
+            "CREATE UNIQUE INDEX apnsdevice_registration_id_uniq "
+            "ON push_notifications_apnsdevice (registration_id)",
+            "DROP INDEX apnsdevice_registration_id_uniq",
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX apnsdevice_active_user_idx "
+            "ON push_notifications_apnsdevice (active, user_id)",
+            "DROP INDEX apnsdevice_active_user_idx",
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notifications', '0006_apnsdevice_registry_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notifcation',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='notifcation',
+            name='is_read',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='notifcation',
+            name='recipient',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='notifcation',
+            index=models.Index(fields=['recipient', 'created_at', 'id'], name='notification_inbox_idx'),
+        ),
+    ]
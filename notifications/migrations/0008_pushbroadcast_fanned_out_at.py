@@ -0,0 +1,26 @@
+# Generated by Django 4.1.5 on 2026-10-18 09:18
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_existing_fanned_out(apps, schema_editor):
+    # Broadcasts made before the sweep existed were fanned out by their task
+    PushBroadcast = apps.get_model("notifications", "PushBroadcast")
+    PushBroadcast.objects.update(fanned_out_at=F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0007_notifcation_inbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pushbroadcast',
+            name='fanned_out_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_existing_fanned_out, migrations.RunPython.noop),
+    ]
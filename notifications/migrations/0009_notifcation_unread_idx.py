@@ -0,0 +1,17 @@
+# Generated by Django 4.1.5 on 2026-10-18 09:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0008_pushbroadcast_fanned_out_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notifcation',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['recipient'], name='notification_unread_idx'),
+        ),
+    ]
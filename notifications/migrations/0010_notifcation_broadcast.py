@@ -0,0 +1,23 @@
+# Generated by Django 4.1.5 on 2026-10-18 09:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0009_notifcation_unread_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notifcation',
+            name='broadcast',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notifications', to='notifications.pushbroadcast'),
+        ),
+        migrations.AddConstraint(
+            model_name='notifcation',
+            constraint=models.UniqueConstraint(fields=('broadcast', 'recipient'), name='notification_broadcast_recipient_uniq'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.1.5 on 2026-10-18 09:31
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def drop_duplicate_deliveries(apps, schema_editor):
+    # Retried chunks recorded a device more than once, keep its first result
+    PushDelivery = apps.get_model("notifications", "PushDelivery")
+    earlier = PushDelivery.objects.filter(
+        broadcast=OuterRef("broadcast"), device=OuterRef("device"), pk__lt=OuterRef("pk")
+    )
+    PushDelivery.objects.filter(Exists(earlier)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0010_notifcation_broadcast'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_deliveries, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='pushdelivery',
+            constraint=models.UniqueConstraint(fields=('broadcast', 'device'), name='push_delivery_broadcast_device_uniq'),
+        ),
+    ]
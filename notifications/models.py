@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 
@@ -7,3 +8,119 @@ class Notifcation(models.Model):
     body = models.CharField(max_length=555)
     phone = models.CharField(max_length=55, null=True)
     type = models.CharField(max_length=255)
+    # Set for notifications in a user's inbox
+    recipient = models.ForeignKey(
+        "users.User",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="notifications",
+    )
+    is_read = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # The broadcast that put it into the inbox, delivered once per recipient
+    broadcast = models.ForeignKey(
+        "notifications.PushBroadcast",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="notifications",
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["broadcast", "recipient"], name="notification_broadcast_recipient_uniq"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["recipient", "created_at", "id"], name="notification_inbox_idx"
+            ),
+            models.Index(
+                fields=["recipient"],
+                condition=models.Q(is_read=False),
+                name="notification_unread_idx",
+            ),
+        ]
+
+
+class OutboundEmail(models.Model):
+    """A message waiting in the outbox, sent by the `flush_outbox` task."""
+
+    PENDING = 1
+    SENDING = 2
+    SENT = 3
+    FAILED = 4
+    STATUS_CHOICES = (
+        (PENDING, "Ожидает"),
+        (SENDING, "Отправляется"),
+        (SENT, "Отправлено"),
+        (FAILED, "Ошибка"),
+    )
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, null=True, blank=True)
+    to = models.JSONField(default=list)
+    status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # When a pending message is due, or when the claim of a sending one lapses
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"], name="outbound_email_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)}"
+
+
+class PushBroadcast(models.Model):
+    """A push notification sent to every device of an audience."""
+
+    STUDENTS = 1
+    STAFF = 2
+    AUDIENCE_CHOICES = ((STUDENTS, "Студенты"), (STAFF, "Сотрудники"))
+    title = models.CharField(max_length=255)
+    body = models.CharField(max_length=555)
+    type = models.CharField(max_length=255)
+    audience = models.PositiveSmallIntegerField(choices=AUDIENCE_CHOICES)
+    direction = models.ForeignKey(
+        "applications.Direction", on_delete=models.SET_NULL, null=True, blank=True
+    )
+    created_by = models.ForeignKey(
+        "users.User", on_delete=models.SET_NULL, null=True, blank=True
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Filled in by the fan-out and the send tasks
+    fanned_out_at = models.DateTimeField(null=True, blank=True)
+    recipients = models.IntegerField(default=0)
+    sent = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+
+    def __str__(self):
+        return self.title
+
+
+class PushDelivery(models.Model):
+    broadcast = models.ForeignKey(
+        PushBroadcast, on_delete=models.CASCADE, related_name="deliveries"
+    )
+    device = models.ForeignKey(
+        "push_notifications.APNSDevice", on_delete=models.SET_NULL, null=True
+    )
+    # "Success" or the reason APNs gave
+    result = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # A retried or repeated chunk never pushes to a device twice
+            models.UniqueConstraint(
+                fields=["broadcast", "device"], name="push_delivery_broadcast_device_uniq"
+            ),
+        ]
@@ -0,0 +1,91 @@
+import abc
+import time
+
+
+class BasePushTransport(abc.ABC):
+    """Delivers one payload to a batch of device tokens.
+
+    One instance lives as long as its worker process (see
+    `PushService.get_transport`), so a transport can keep state, such as a
+    connection, between batches.
+    """
+
+    SUCCESS = "Success"
+
+    @abc.abstractmethod
+    def send(self, tokens, payload):
+        """Return {token: "Success" or the reason of the failure}."""
+
+
+class APNSPushTransport(BasePushTransport):
+    """APNs over one HTTP/2 connection, configured by PUSH_NOTIFICATIONS_SETTINGS.
+
+    The client is made on the first batch and kept for the next ones, so a
+    worker does one TLS handshake rather than one per chunk. A batch that
+    fails drops it, and the next batch connects again.
+    """
+
+    # Like django-push-notifications: undelivered pushes expire after a month
+    expiration = 30 * 24 * 60 * 60
+
+    def __init__(self, application_id=None):
+        self.application_id = application_id
+        self.client = None
+
+    def get_client(self):
+        # apns2 is only needed where pushes are really sent
+        from apns2.client import APNsClient
+        from apns2.credentials import CertificateCredentials, TokenCredentials
+        from push_notifications.conf import get_manager
+
+        if self.client is None:
+            manager = get_manager()
+            if manager.has_auth_token_creds(self.application_id):
+                credentials = TokenCredentials(*manager.get_apns_auth_creds(self.application_id))
+            else:
+                credentials = CertificateCredentials(
+                    manager.get_apns_certificate(self.application_id)
+                )
+            self.client = APNsClient(
+                credentials,
+                use_sandbox=manager.get_apns_use_sandbox(self.application_id),
+                use_alternative_port=manager.get_apns_use_alternative_port(self.application_id),
+            )
+        return self.client
+
+    def send(self, tokens, payload):
+        from apns2.client import Notification
+        from apns2.payload import Payload
+        from push_notifications.conf import get_manager
+
+        alert = {"title": payload["title"], "body": payload["body"]}
+        extra = {key: value for key, value in payload.items() if key not in alert}
+        notifications = [
+            Notification(token=token, payload=Payload(alert=alert, custom=extra))
+            for token in tokens
+        ]
+        client = self.get_client()
+        try:
+            return client.send_notification_batch(
+                notifications,
+                get_manager().get_apns_topic(application_id=self.application_id),
+                expiration=int(time.time()) + self.expiration,
+            )
+        except Exception:
+            self.client = None
+            raise
+
+
+class StubPushTransport(BasePushTransport):
+    """Keeps what it is given in memory, for tests and offline runs.
+
+    Tokens in `responses` get the result mapped to them, the others succeed.
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.responses = {}
+
+    def send(self, tokens, payload):
+        self.sent.append((list(tokens), payload))
+        return {token: self.responses.get(token, self.SUCCESS) for token in tokens}
@@ -1,8 +1,43 @@
 from rest_framework import serializers
-from .models import Notifcation
+from .models import Notifcation, PushBroadcast
 
 class NotificationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Notifcation
-        fields = ['id', 'title', 'body']
\ No newline at end of file
+        fields = ['id', 'title', 'body', 'type', 'is_read', 'created_at']
+
+
+class PushBroadcastSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = PushBroadcast
+        fields = [
+            'id',
+            'title',
+            'body',
+            'type',
+            'audience',
+            'direction',
+            'fanned_out_at',
+            'recipients',
+            'sent',
+            'failed',
+            'created_at',
+        ]
+        read_only_fields = ['fanned_out_at', 'recipients', 'sent', 'failed', 'created_at']
+
+
+class DeviceSerializer(serializers.Serializer):
+    registration_id = serializers.CharField(max_length=200)
+    device_id = serializers.UUIDField(required=False, allow_null=True)
+    name = serializers.CharField(max_length=255, required=False, allow_null=True)
+
+
+class NotificationReadSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False,
+        max_length=1000,
+        help_text='Leave out to mark every notification read',
+    )
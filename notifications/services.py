@@ -0,0 +1,439 @@
+import datetime
+import time
+from itertools import islice
+
+from applications.models import Application, Groups
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from push_notifications.models import APNSDevice
+from users.models import Student, Teacher, User
+
+from .models import Notifcation, OutboundEmail, PushBroadcast, PushDelivery
+from .push import BasePushTransport
+
+
+class EmailOutboxService:
+    """Outbound mail, queued in the database and sent by a celery task.
+
+    Requests only insert a row; once their transaction commits, `flush_outbox`
+    sends every due message over one SMTP connection. A message that fails is
+    retried with exponential backoff by later flushes (celery beat runs one
+    every minute) until `max_attempts`, then left as failed.
+    """
+
+    model = OutboundEmail
+    batch_size = 100
+    max_attempts = 6
+    backoff = 60
+    max_backoff = 60 * 60
+    # A claimed message nobody marked sent is due again after this
+    lease = 10 * 60
+
+    @classmethod
+    def enqueue(cls, subject, body, to, from_email=None):
+        from .tasks import delay_on_commit, flush_outbox
+
+        email = cls.model.objects.create(
+            subject=subject, body=body, to=list(to), from_email=from_email
+        )
+        delay_on_commit(flush_outbox)
+        return email
+
+    @classmethod
+    def claim(cls, batch_size):
+        """Mark up to `batch_size` due messages as sending and return them."""
+        now = timezone.now()
+        with transaction.atomic():
+            due = cls.model.objects.filter(
+                status__in=[cls.model.PENDING, cls.model.SENDING], next_attempt_at__lte=now
+            )
+            # Concurrent flushes skip each other's rows instead of waiting
+            ids = list(
+                due.order_by("next_attempt_at", "pk")
+                .select_for_update(skip_locked=True)
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            cls.model.objects.filter(pk__in=ids).update(
+                status=cls.model.SENDING,
+                next_attempt_at=now + datetime.timedelta(seconds=cls.lease),
+            )
+        return list(cls.model.objects.filter(pk__in=ids).order_by("pk"))
+
+    @classmethod
+    def flush(cls, batch_size=None):
+        """Send the due messages batch by batch; return how many were sent."""
+        sent = 0
+        connection = get_connection()
+        try:
+            while True:
+                emails = cls.claim(batch_size or cls.batch_size)
+                if not emails:
+                    return sent
+                sent += cls.send(connection, emails)
+        finally:
+            connection.close()
+
+    @classmethod
+    def send(cls, connection, emails):
+        sent, failed = [], []
+        for email in emails:
+            message = EmailMessage(
+                email.subject, email.body, email.from_email, email.to, connection=connection
+            )
+            try:
+                # Opened once and kept open; a no-op while the connection is up
+                connection.open()
+                if not connection.send_messages([message]):
+                    raise ValueError("The message was not accepted")
+            except Exception as exc:
+                failed.append((email, exc))
+                # Reconnect for the next message
+                connection.close()
+            else:
+                sent.append(email.pk)
+        now = timezone.now()
+        cls.model.objects.filter(pk__in=sent).update(
+            status=cls.model.SENT, sent_at=now, last_error=None
+        )
+        for email, exc in failed:
+            cls.reschedule(email, exc, now)
+        return len(sent)
+
+    @classmethod
+    def reschedule(cls, email, exc, now):
+        email.attempts += 1
+        email.last_error = repr(exc)
+        if email.attempts >= cls.max_attempts:
+            email.status = cls.model.FAILED
+        else:
+            email.status = cls.model.PENDING
+            delay = min(cls.backoff * 2 ** (email.attempts - 1), cls.max_backoff)
+            email.next_attempt_at = now + datetime.timedelta(seconds=delay)
+        email.save(update_fields=["attempts", "last_error", "status", "next_attempt_at"])
+
+
+class NotificationService:
+    """Users' notification inboxes and their unread counters.
+
+    With a shared cache, a user's unread count lives there and is moved by
+    every create, delete and mark-as-read once it commits, so polling the
+    badge reads no row. A missing counter is counted again on its next read.
+    Every change also bumps a per-user version, and a recount is only stored
+    if no change came in while it ran. Counters expire after a few minutes,
+    so any drift that slips through still heals.
+
+    A per-process cache would only see the changes of its own worker, so
+    without a shared one the count is read from the database every time.
+    """
+
+    model = Notifcation
+    chunk_size = 1000
+    counter_timeout = 5 * 60
+
+    @staticmethod
+    def counter_key(user_id):
+        return f"notifications:unread:{user_id}"
+
+    @staticmethod
+    def version_key(user_id):
+        return f"notifications:unread:{user_id}:version"
+
+    @classmethod
+    def count_unread(cls, user_id):
+        # Served by the partial index on unread notifications
+        return cls.model.objects.filter(recipient=user_id, is_read=False).count()
+
+    @classmethod
+    def unread_count(cls, user_id):
+        if not settings.SHARED_CACHE:
+            return cls.count_unread(user_id)
+        key = cls.counter_key(user_id)
+        count = cache.get(key)
+        if count is None:
+            version = cache.get(cls.version_key(user_id))
+            count = cls.count_unread(user_id)
+            # A change committed while counting may be missing from `count`
+            if cache.get(cls.version_key(user_id)) == version:
+                cache.set(key, count, cls.counter_timeout)
+        return count
+
+    @classmethod
+    def bump_versions(cls, user_ids):
+        version = time.time_ns()
+        cache.set_many(
+            {cls.version_key(user_id): version for user_id in user_ids}, cls.counter_timeout
+        )
+
+    @classmethod
+    def change_unread(cls, user_id, delta):
+        if not settings.SHARED_CACHE:
+            return
+        cls.bump_versions([user_id])
+        try:
+            cache.incr(cls.counter_key(user_id), delta)
+        except ValueError:
+            # Not cached, so nothing to move
+            pass
+
+    @classmethod
+    def forget_unread(cls, user_ids):
+        if not settings.SHARED_CACHE:
+            return
+        cls.bump_versions(user_ids)
+        cache.delete_many([cls.counter_key(user_id) for user_id in user_ids])
+
+    @classmethod
+    def mark_read(cls, user, ids=None):
+        """Mark the user's notifications `ids`, or all of them, read; return how many changed."""
+        queryset = cls.model.objects.filter(recipient=user, is_read=False)
+        if ids is not None:
+            queryset = queryset.filter(pk__in=ids)
+        count = queryset.update(is_read=True)
+        if count:
+            transaction.on_commit(lambda: cls.change_unread(user.pk, -count))
+        return count
+
+    @classmethod
+    def deliver(cls, user_ids, title, body, type, broadcast=None):
+        """Put a notification into every inbox of `user_ids`, in bulk.
+
+        A `broadcast` reaches each inbox once, however often it is delivered.
+        """
+        user_ids = iter(user_ids)
+        total = 0
+        while True:
+            chunk = list(islice(user_ids, cls.chunk_size))
+            if not chunk:
+                return total
+            cls.model.objects.bulk_create(
+                (
+                    cls.model(
+                        recipient_id=user_id,
+                        title=title,
+                        body=body,
+                        type=type,
+                        broadcast=broadcast,
+                    )
+                    for user_id in chunk
+                ),
+                ignore_conflicts=broadcast is not None,
+            )
+            total += len(chunk)
+            # Counted again on the next read rather than one increment per user
+            transaction.on_commit(lambda chunk=chunk: cls.forget_unread(chunk))
+
+
+class DeviceService:
+    """APNs devices, kept to one row per token.
+
+    `registration_id` is unique in the database (see migration 0006 of this
+    app), so registering is a single upsert and a token that changes hands
+    moves to its new user.
+    """
+
+    model = APNSDevice
+    # APNs results meaning the token will never be delivered to again
+    dead_results = ("Unregistered", "BadDeviceToken")
+
+    @classmethod
+    def register(cls, registration_id, user=None, **fields):
+        """Upsert the device of `registration_id` for `user`.
+
+        Without a user a known token is left as it is: nobody may unlink it
+        from its owner or switch it back on.
+        """
+        device = cls.model(registration_id=registration_id, user=user, active=True, **fields)
+        if user is None:
+            cls.model.objects.bulk_create([device], ignore_conflicts=True)
+        else:
+            cls.model.objects.bulk_create(
+                [device],
+                update_conflicts=True,
+                unique_fields=["registration_id"],
+                update_fields=["user", "active", *fields],
+            )
+        return cls.model.objects.get(registration_id=registration_id)
+
+    @classmethod
+    def unregister(cls, registration_id, user):
+        return cls.model.objects.filter(registration_id=registration_id, user=user).update(
+            active=False
+        )
+
+    @classmethod
+    def deactivate(cls, results):
+        """Switch off, in one UPDATE, the tokens whose {token: result} is dead."""
+        tokens = [token for token, result in results.items() if result in cls.dead_results]
+        if not tokens:
+            return 0
+        return cls.model.objects.filter(registration_id__in=tokens, active=True).update(
+            active=False
+        )
+
+
+class PushService:
+    """Push broadcasts, fanned out to devices by celery tasks.
+
+    A request only stores the broadcast. `fan_out_push` then puts it into the
+    inbox of every recipient, reads the active devices of the audience with
+    one query, streamed through a cursor, and queues them in chunks to
+    `send_push_chunk`. Each chunk goes out as one batch through the transport
+    of its worker, and its results are stored with one bulk insert.
+    """
+
+    model = PushBroadcast
+    chunk_size = 500
+    # Age after which the sweep takes over a broadcast its task has not fanned out
+    sweep_delay = 60
+    # One transport per process and setting, so its connection outlives a chunk
+    _transports = {}
+
+    @classmethod
+    def get_transport(cls):
+        path = settings.PUSH_TRANSPORT
+        if path not in cls._transports:
+            cls._transports[path] = import_string(path)()
+        return cls._transports[path]
+
+    @classmethod
+    def broadcast(cls, user=None, **fields):
+        from .tasks import delay_on_commit, fan_out_push
+
+        broadcast = cls.model.objects.create(created_by=user, **fields)
+        delay_on_commit(fan_out_push, broadcast.pk)
+        return broadcast
+
+    @classmethod
+    def recipients(cls, broadcast):
+        """Ids of the users a broadcast is meant for."""
+        if broadcast.audience == cls.model.STUDENTS:
+            users = Student.objects.all()
+            if broadcast.direction_id is not None:
+                users = users.filter(
+                    Exists(
+                        Application.objects.filter(
+                            student=OuterRef("pk"), direction=broadcast.direction_id
+                        )
+                    )
+                )
+        elif broadcast.direction_id is not None:
+            # The staff of a direction are the teachers of its groups
+            users = Teacher.objects.filter(
+                Exists(Groups.objects.filter(teacher=OuterRef("pk"), direction=broadcast.direction_id))
+            )
+        else:
+            users = User.objects.filter(
+                Q(is_staff=True) | Q(Exists(Teacher.objects.filter(pk=OuterRef("pk"))))
+            )
+        return users.values("pk")
+
+    @classmethod
+    def devices(cls, broadcast):
+        # Served by the (active, user_id) index
+        return (
+            APNSDevice.objects.filter(active=True, user__in=cls.recipients(broadcast))
+            .order_by("pk")
+            .values_list("pk", "registration_id")
+        )
+
+    @classmethod
+    def fan_out(cls, broadcast_id):
+        """Deliver a broadcast to the inboxes and queue its chunks, once.
+
+        A redelivered task, or the sweep, finds `fanned_out_at` set and does
+        nothing; a run that fails is rolled back and left to the sweep. The
+        chunks are queued only once the run has committed.
+        """
+        from .tasks import delay_chunks_on_commit
+
+        with transaction.atomic():
+            broadcast = (
+                cls.model.objects.select_for_update()
+                .filter(pk=broadcast_id, fanned_out_at=None)
+                .first()
+            )
+            if broadcast is None:
+                return 0
+            NotificationService.deliver(
+                cls.recipients(broadcast).values_list("pk", flat=True).iterator(),
+                broadcast.title,
+                broadcast.body,
+                broadcast.type,
+                broadcast=broadcast,
+            )
+            devices = cls.devices(broadcast).iterator(chunk_size=cls.chunk_size)
+            chunks = []
+            while True:
+                chunk = list(islice(devices, cls.chunk_size))
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            total = sum(map(len, chunks))
+            cls.model.objects.filter(pk=broadcast_id).update(
+                recipients=total, fanned_out_at=timezone.now()
+            )
+            delay_chunks_on_commit(broadcast_id, chunks)
+        return total
+
+    @classmethod
+    def release(cls, broadcast_id):
+        """Hand a fanned out broadcast back to the sweep."""
+        cls.model.objects.filter(pk=broadcast_id).update(fanned_out_at=None)
+
+    @classmethod
+    def fan_out_pending(cls):
+        """Fan out the broadcasts whose task was never queued or never finished."""
+        threshold = timezone.now() - datetime.timedelta(seconds=cls.sweep_delay)
+        pending = cls.model.objects.filter(fanned_out_at=None, created_at__lte=threshold)
+        ids = list(pending.order_by("pk").values_list("pk", flat=True))
+        for broadcast_id in ids:
+            cls.fan_out(broadcast_id)
+        return len(ids)
+
+    @staticmethod
+    def payload(broadcast):
+        return {
+            "title": broadcast.title,
+            "body": broadcast.body,
+            "type": broadcast.type,
+            "broadcast": broadcast.pk,
+        }
+
+    @classmethod
+    def send_chunk(cls, broadcast_id, devices):
+        """Send one chunk of `(device id, token)` pairs and record the results.
+
+        Devices that already have a delivery of the broadcast, from an earlier
+        try of the chunk or an earlier fan-out, are skipped.
+        """
+        broadcast = cls.model.objects.get(pk=broadcast_id)
+        delivered = set(
+            PushDelivery.objects.filter(
+                broadcast_id=broadcast_id, device_id__in=[pk for pk, _ in devices]
+            ).values_list("device_id", flat=True)
+        )
+        device_ids = {token: pk for pk, token in devices if pk not in delivered}
+        if not device_ids:
+            return {}
+        results = cls.get_transport().send(list(device_ids), cls.payload(broadcast))
+        sent = sum(result == BasePushTransport.SUCCESS for result in results.values())
+        with transaction.atomic():
+            PushDelivery.objects.bulk_create(
+                (
+                    PushDelivery(
+                        broadcast_id=broadcast_id, device_id=device_ids[token], result=result
+                    )
+                    for token, result in results.items()
+                ),
+                ignore_conflicts=True,
+            )
+            cls.model.objects.filter(pk=broadcast_id).update(
+                sent=F("sent") + sent, failed=F("failed") + len(results) - sent
+            )
+            DeviceService.deactivate(results)
+        return results
@@ -0,0 +1,18 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Notifcation
+from .services import NotificationService
+
+
+@receiver(post_save, sender=Notifcation)
+def count_new_notification(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw and instance.recipient_id and not instance.is_read:
+        transaction.on_commit(lambda: NotificationService.change_unread(instance.recipient_id, 1))
+
+
+@receiver(post_delete, sender=Notifcation)
+def uncount_deleted_notification(sender, instance, **kwargs):
+    if instance.recipient_id and not instance.is_read:
+        transaction.on_commit(lambda: NotificationService.change_unread(instance.recipient_id, -1))
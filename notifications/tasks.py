@@ -0,0 +1,72 @@
+import logging
+
+from celery import shared_task
+from django.db import transaction
+from kombu.exceptions import OperationalError
+
+from .services import EmailOutboxService, PushService
+
+logger = logging.getLogger(__name__)
+
+
+def delay_on_commit(task, *args):
+    """Queue `task` once the current transaction commits.
+
+    The work it does is already stored, so when the broker cannot be reached
+    the request still succeeds and the next beat sweep picks the work up.
+    """
+
+    def delay():
+        try:
+            task.delay(*args)
+        except OperationalError:
+            logger.warning("Could not queue %s, left to the next sweep", task.name, exc_info=True)
+
+    transaction.on_commit(delay)
+
+
+def delay_chunks_on_commit(broadcast_id, chunks):
+    """Queue the device chunks of a fan-out once the current transaction commits.
+
+    When the broker cannot be reached the broadcast goes back to the sweep,
+    which fans it out again; devices already pushed to are skipped then.
+    """
+
+    def delay():
+        try:
+            for chunk in chunks:
+                send_push_chunk.delay(broadcast_id, chunk)
+        except OperationalError:
+            logger.warning(
+                "Could not queue push %s, left to the next sweep", broadcast_id, exc_info=True
+            )
+            PushService.release(broadcast_id)
+
+    transaction.on_commit(delay)
+
+
+@shared_task(ignore_result=True)
+def flush_outbox():
+    return EmailOutboxService.flush()
+
+
+@shared_task(ignore_result=True)
+def fan_out_push(broadcast_id):
+    return PushService.fan_out(broadcast_id)
+
+
+@shared_task(ignore_result=True)
+def fan_out_pending_pushes():
+    return PushService.fan_out_pending()
+
+
+# Connection errors are retried with exponential backoff
+@shared_task(
+    ignore_result=True,
+    autoretry_for=(OSError,),
+    retry_backoff=True,
+    retry_backoff_max=10 * 60,
+    max_retries=5,
+)
+def send_push_chunk(broadcast_id, devices):
+    PushService.send_chunk(broadcast_id, devices)
@@ -1,3 +1,408 @@
-from django.test import TestCase
+import datetime
+import sys
+from unittest import mock
 
-# Create your tests here.
+from applications.models import Application, Direction, Source
+from django.core import mail
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from kombu.exceptions import OperationalError
+from push_notifications.models import APNSDevice
+from rest_framework.test import APITestCase
+from users.models import Student, Teacher, User
+
+from .models import Notifcation, OutboundEmail, PushBroadcast, PushDelivery
+from .push import APNSPushTransport
+from .services import DeviceService, EmailOutboxService, NotificationService, PushService
+from .tasks import fan_out_pending_pushes, fan_out_push, flush_outbox, send_push_chunk
+
+
+class EmailOutboxTests(TestCase):
+    def enqueue(self, count):
+        with self.captureOnCommitCallbacks() as callbacks:
+            for i in range(count):
+                EmailOutboxService.enqueue("Subject", f"Body {i}", [f"user{i}@example.com"])
+        return callbacks
+
+    def test_enqueue_sends_after_commit_over_one_connection(self):
+        callbacks = self.enqueue(3)
+        self.assertEqual(mail.outbox, [])
+        with mock.patch(
+            "notifications.services.get_connection", wraps=mail.get_connection
+        ) as get_connection:
+            callbacks[0]()
+        self.assertEqual(get_connection.call_count, 1)
+        self.assertEqual(
+            [message.to for message in mail.outbox],
+            [[f"user{i}@example.com"] for i in range(3)],
+        )
+        self.assertEqual(
+            set(OutboundEmail.objects.values_list("status", flat=True)), {OutboundEmail.SENT}
+        )
+
+    def test_failed_messages_back_off_then_fail(self):
+        self.enqueue(1)
+        email = OutboundEmail.objects.get()
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=OSError("Connection refused"),
+        ):
+            for attempt in range(1, EmailOutboxService.max_attempts + 1):
+                self.assertEqual(EmailOutboxService.flush(), 0)
+                email.refresh_from_db()
+                self.assertEqual(email.attempts, attempt)
+                # Not due again before its backoff runs out
+                self.assertEqual(EmailOutboxService.flush(), 0)
+                self.assertEqual(OutboundEmail.objects.get().attempts, attempt)
+                OutboundEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(email.status, OutboundEmail.FAILED)
+        self.assertIn("Connection refused", email.last_error)
+
+    def test_unreachable_broker_leaves_the_message_for_the_sweep(self):
+        callbacks = self.enqueue(1)
+        with mock.patch.object(
+            flush_outbox, "delay", side_effect=OperationalError("Connection refused")
+        ), self.assertLogs("notifications.tasks", "WARNING"):
+            callbacks[0]()
+        self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.PENDING)
+        self.assertEqual(flush_outbox(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_lapsed_claims_are_sent_again(self):
+        self.enqueue(1)
+        OutboundEmail.objects.update(
+            status=OutboundEmail.SENDING,
+            next_attempt_at=timezone.now() - datetime.timedelta(seconds=1),
+        )
+        self.assertEqual(EmailOutboxService.flush(), 1)
+
+
+@override_settings(PUSH_TRANSPORT="notifications.push.StubPushTransport")
+class PushBroadcastTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.python = Direction.objects.create(name="Python", duration=3)
+        cls.javascript = Direction.objects.create(name="JavaScript", duration=3)
+        source = Source.objects.create(name="Instagram")
+        cls.manager = User.objects.create(email="manager@example.com", phone="+996555000000", is_staff=True)
+        APNSDevice.objects.create(user=cls.manager, registration_id="manager")
+        cls.tokens = {cls.python: [], cls.javascript: []}
+        for i in range(5):
+            direction = cls.python if i < 3 else cls.javascript
+            student = Student.objects.create(email=f"s{i}@example.com", phone=f"+996555{i + 1:06d}")
+            Application.objects.create(student=student, direction=direction, source=source)
+            for device in ("phone", "tablet"):
+                token = f"{device}{i}"
+                APNSDevice.objects.create(user=student, registration_id=token, active=i != 2)
+                if i != 2:
+                    cls.tokens[direction].append(token)
+        teacher = Teacher.objects.create(email="t@example.com", phone="+996700000000")
+        APNSDevice.objects.create(user=teacher, registration_id="teacher")
+
+    def setUp(self):
+        self.transport = PushService.get_transport()
+        self.transport.sent.clear()
+        self.transport.responses.clear()
+        self.client.force_authenticate(self.manager)
+
+    def broadcast(self, **data):
+        data = {"title": "Hello", "body": "Privet", "type": "news", **data}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("push_broadcast"), data)
+        self.assertEqual(response.status_code, 201, response.data)
+        return PushBroadcast.objects.get(pk=response.data["id"])
+
+    def test_students_of_a_direction_in_chunks(self):
+        self.transport.responses["tablet0"] = "BadDeviceToken"
+        with mock.patch.object(PushService, "chunk_size", 4):
+            broadcast = self.broadcast(audience=PushBroadcast.STUDENTS, direction=self.python.pk)
+        self.assertEqual(
+            [tokens for tokens, _ in self.transport.sent], [self.tokens[self.python]]
+        )
+        self.assertEqual(
+            (broadcast.recipients, broadcast.sent, broadcast.failed), (4, 3, 1)
+        )
+        self.assertEqual(
+            PushDelivery.objects.get(device__registration_id="tablet0").result, "BadDeviceToken"
+        )
+        self.assertFalse(APNSDevice.objects.get(registration_id="tablet0").active)
+
+        # tablet0 was switched off by its first result
+        with mock.patch.object(PushService, "chunk_size", 4):
+            self.broadcast(audience=PushBroadcast.STUDENTS)
+        self.assertEqual(
+            [len(tokens) for tokens, _ in self.transport.sent[1:]], [4, 3]
+        )
+
+    def test_staff(self):
+        broadcast = self.broadcast(audience=PushBroadcast.STAFF)
+        self.assertEqual(sorted(self.transport.sent[0][0]), ["manager", "teacher"])
+        self.assertEqual(self.transport.sent[0][1]["broadcast"], broadcast.pk)
+        self.assertEqual(
+            list(Notifcation.objects.filter(recipient=self.manager).values_list("title", flat=True)),
+            ["Hello"],
+        )
+
+    def test_unreachable_broker_leaves_the_broadcast_for_the_sweep(self):
+        with mock.patch.object(
+            fan_out_push, "delay", side_effect=OperationalError("Connection refused")
+        ), self.assertLogs("notifications.tasks", "WARNING"):
+            broadcast = self.broadcast(audience=PushBroadcast.STAFF)
+        self.assertEqual(self.transport.sent, [])
+        # Too recent: its own task may still be on the way
+        self.assertEqual(fan_out_pending_pushes(), 0)
+
+        PushBroadcast.objects.update(created_at=timezone.now() - datetime.timedelta(minutes=2))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(fan_out_pending_pushes(), 1)
+        self.assertEqual(len(self.transport.sent), 1)
+        broadcast.refresh_from_db()
+        self.assertEqual((broadcast.recipients, broadcast.sent), (2, 2))
+        self.assertEqual(fan_out_pending_pushes(), 0)
+
+    def test_chunks_are_queued_after_commit(self):
+        broadcast = PushBroadcast.objects.create(
+            title="Hello", body="Privet", type="news", audience=PushBroadcast.STAFF
+        )
+        with self.captureOnCommitCallbacks() as callbacks:
+            PushService.fan_out(broadcast.pk)
+        self.assertEqual(self.transport.sent, [])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(self.transport.sent), 1)
+
+    def test_unreachable_broker_hands_the_chunks_back_to_the_sweep(self):
+        with mock.patch.object(
+            send_push_chunk, "delay", side_effect=OperationalError("Connection refused")
+        ), self.assertLogs("notifications.tasks", "WARNING"):
+            broadcast = self.broadcast(audience=PushBroadcast.STAFF)
+        broadcast.refresh_from_db()
+        self.assertIsNone(broadcast.fanned_out_at)
+
+        PushBroadcast.objects.update(created_at=timezone.now() - datetime.timedelta(minutes=2))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(fan_out_pending_pushes(), 1)
+        self.assertEqual(len(self.transport.sent), 1)
+
+    def test_retried_chunk_skips_devices_already_pushed_to(self):
+        broadcast = self.broadcast(audience=PushBroadcast.STAFF)
+        devices = list(PushService.devices(broadcast))
+        extra = APNSDevice.objects.create(user=self.manager, registration_id="ipad")
+        self.assertEqual(PushService.send_chunk(broadcast.pk, devices), {})
+        self.assertEqual(
+            PushService.send_chunk(broadcast.pk, devices + [(extra.pk, "ipad")]), {"ipad": "Success"}
+        )
+        self.assertEqual([tokens for tokens, _ in self.transport.sent[1:]], [["ipad"]])
+        broadcast.refresh_from_db()
+        self.assertEqual((broadcast.sent, broadcast.deliveries.count()), (3, 3))
+
+    def test_fan_out_runs_once(self):
+        broadcast = self.broadcast(audience=PushBroadcast.STAFF)
+        self.assertEqual(PushService.fan_out(broadcast.pk), 0)
+        self.assertEqual(len(self.transport.sent), 1)
+        self.assertEqual(Notifcation.objects.filter(recipient=self.manager).count(), 1)
+
+    def test_inbox_delivery_is_idempotent(self):
+        broadcast = self.broadcast(audience=PushBroadcast.STAFF)
+        # As if the fan-out had to run again from the start
+        PushBroadcast.objects.update(fanned_out_at=None)
+        with self.captureOnCommitCallbacks(execute=True):
+            PushService.fan_out(broadcast.pk)
+        self.assertEqual(len(self.transport.sent), 1)
+        NotificationService.deliver([self.manager.pk], "Hello", "Privet", "news", broadcast=broadcast)
+        self.assertEqual(
+            sorted(broadcast.notifications.values_list("recipient__email", flat=True)),
+            ["manager@example.com", "t@example.com"],
+        )
+
+    def test_devices_are_resolved_in_one_query(self):
+        broadcast = PushBroadcast.objects.create(
+            title="Hello", body="Privet", type="news", audience=PushBroadcast.STUDENTS
+        )
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(PushService.devices(broadcast))), 8)
+
+
+class APNSPushTransportTests(TestCase):
+    def setUp(self):
+        self.apns2 = mock.Mock()
+        self.apns_client = self.apns2.client.APNsClient.return_value
+        self.apns_client.send_notification_batch.return_value = {"a": "Success", "b": "Unregistered"}
+        self.manager = mock.Mock()
+        self.manager.has_auth_token_creds.return_value = True
+        self.manager.get_apns_auth_creds.return_value = ("AuthKey.p8", "KEY", "TEAM")
+        self.manager.get_apns_topic.return_value = "com.example"
+        modules = {
+            "apns2": self.apns2,
+            "apns2.client": self.apns2.client,
+            "apns2.credentials": self.apns2.credentials,
+            "apns2.payload": self.apns2.payload,
+        }
+        for patcher in (
+            mock.patch.dict(sys.modules, modules),
+            mock.patch("push_notifications.conf.get_manager", return_value=self.manager),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_batches_share_one_client(self):
+        transport = APNSPushTransport()
+        payload = {"title": "Hello", "body": "Privet", "type": "news", "broadcast": 1}
+        for _ in range(2):
+            results = transport.send(("a", "b"), payload)
+        self.assertEqual(results, {"a": "Success", "b": "Unregistered"})
+        self.apns2.client.APNsClient.assert_called_once()
+        self.apns2.credentials.TokenCredentials.assert_called_once_with("AuthKey.p8", "KEY", "TEAM")
+        self.apns2.payload.Payload.assert_called_with(
+            alert={"title": "Hello", "body": "Privet"}, custom={"type": "news", "broadcast": 1}
+        )
+        self.assertEqual(self.apns_client.send_notification_batch.call_count, 2)
+        self.assertEqual(self.apns_client.send_notification_batch.call_args[0][1], "com.example")
+
+    def test_failed_batch_drops_the_client(self):
+        transport = APNSPushTransport()
+        self.apns_client.send_notification_batch.side_effect = ConnectionResetError
+        with self.assertRaises(ConnectionResetError):
+            transport.send(("a",), {"title": "Hello", "body": "Privet"})
+        self.assertIsNone(transport.client)
+        self.apns_client.send_notification_batch.side_effect = None
+        transport.send(("a",), {"title": "Hello", "body": "Privet"})
+        self.assertEqual(self.apns2.client.APNsClient.call_count, 2)
+
+
+class DeviceRegistrationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create(email=f"user{i}@example.com", phone=f"+996555{i:06d}")
+            for i in range(2)
+        ]
+
+    def register(self, user, **data):
+        self.client.force_authenticate(user)
+        return self.client.post(reverse("device_registration"), {"registration_id": "token", **data})
+
+    def test_token_is_upserted(self):
+        first = self.register(self.users[0], name="iPhone").data["id"]
+        APNSDevice.objects.update(active=False)
+        with self.assertNumQueries(2):
+            response = self.register(self.users[1])
+        self.assertEqual(response.data, {"id": first, "registration_id": "token", "active": True})
+        device = APNSDevice.objects.get()
+        self.assertEqual((device.user_id, device.name), (self.users[1].pk, "iPhone"))
+
+    def test_without_a_user_a_known_token_is_left_alone(self):
+        self.register(self.users[0])
+        APNSDevice.objects.update(active=False)
+        device = DeviceService.register("token")
+        self.assertEqual((device.user_id, device.active), (self.users[0].pk, False))
+        self.assertIsNone(DeviceService.register("other").user_id)
+
+    def test_send_requires_authentication(self):
+        self.register(self.users[0])
+        self.client.force_authenticate(None)
+        response = self.client.post(reverse("send_notification"), {"device_token": "token"})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(APNSDevice.objects.get().user_id, self.users[0].pk)
+
+    def test_unregister(self):
+        self.register(self.users[0])
+        self.client.force_authenticate(self.users[1])
+        self.client.delete(reverse("device_registration"), {"registration_id": "token"})
+        self.assertTrue(APNSDevice.objects.get().active)
+        self.client.force_authenticate(self.users[0])
+        self.client.delete(reverse("device_registration"), {"registration_id": "token"})
+        self.assertFalse(APNSDevice.objects.get().active)
+
+
+class NotificationInboxTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create(email=f"user{i}@example.com", phone=f"+996555{i:06d}")
+            for i in range(2)
+        ]
+        cls.notifications = [
+            Notifcation.objects.create(recipient=cls.users[0], title=f"N{i}", body="", type="news")
+            for i in range(5)
+        ]
+        Notifcation.objects.create(recipient=cls.users[1], title="Other", body="", type="news")
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.users[0])
+
+    def unread(self):
+        return self.client.get(reverse("notification_unread_count")).data["unread"]
+
+    def test_inbox_pages_newest_first(self):
+        response = self.client.get(reverse("notification_inbox"), {"limit": 3})
+        titles = [item["title"] for item in response.data["results"]]
+        response = self.client.get(response.data["next"])
+        titles += [item["title"] for item in response.data["results"]]
+        self.assertEqual(titles, ["N4", "N3", "N2", "N1", "N0"])
+        self.assertIsNone(response.data["next"])
+
+    @override_settings(SHARED_CACHE=True)
+    def test_unread_counter_is_cached_and_moved(self):
+        self.assertEqual(self.unread(), 5)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.unread(), 5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Notifcation.objects.create(recipient=self.users[0], title="N5", body="", type="news")
+            response = self.client.post(
+                reverse("notification_read"),
+                {"ids": [self.notifications[0].pk, self.notifications[1].pk]},
+                format="json",
+            )
+        self.assertEqual(response.data, {"updated": 2})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.unread(), 4)
+
+        response = self.client.get(reverse("notification_inbox"), {"unread": "true"})
+        self.assertEqual(len(response.data["results"]), 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("notification_read"), {}, format="json")
+        self.assertEqual(self.unread(), 0)
+        self.assertEqual(Notifcation.objects.filter(is_read=False).count(), 1)
+
+    @override_settings(SHARED_CACHE=True)
+    def test_missing_counter_is_recounted_and_stored(self):
+        key = NotificationService.counter_key(self.users[0].pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(NotificationService.unread_count(self.users[0].pk), 5)
+        self.assertEqual(cache.get(key), 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            NotificationService.deliver([self.users[0].pk], "N5", "", "news")
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(NotificationService.unread_count(self.users[0].pk), 6)
+        self.assertEqual(cache.get(key), 6)
+
+    @override_settings(SHARED_CACHE=True)
+    def test_recount_racing_a_change_is_not_stored(self):
+        user_id = self.users[0].pk
+        count_unread = NotificationService.count_unread
+
+        def count_then_change(user_id):
+            count = count_unread(user_id)
+            # Another request commits a new notification after the count ran
+            Notifcation.objects.create(recipient_id=user_id, title="N5", body="", type="news")
+            NotificationService.change_unread(user_id, 1)
+            return count
+
+        with mock.patch.object(NotificationService, "count_unread", side_effect=count_then_change):
+            self.assertEqual(NotificationService.unread_count(user_id), 5)
+        self.assertIsNone(cache.get(NotificationService.counter_key(user_id)))
+        self.assertEqual(NotificationService.unread_count(user_id), 6)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_without_a_shared_cache_every_read_counts(self):
+        self.assertEqual(self.unread(), 5)
+        # Written by another worker, whose cache this one cannot see
+        Notifcation.objects.filter(pk=self.notifications[0].pk).update(is_read=True)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.unread(), 4)
+        self.assertIsNone(cache.get(NotificationService.counter_key(self.users[0].pk)))
@@ -1,6 +1,20 @@
 from django.urls import path
-from .views import PushNotificationView
+from .views import (
+    DeviceRegistrationView,
+    NotificationInboxView,
+    NotificationReadView,
+    PushBroadcastDetailView,
+    PushBroadcastView,
+    PushNotificationView,
+    UnreadNotificationCountView,
+)
 
 urlpatterns = [
-    path('send/', PushNotificationView.as_view(), name='send_notification')
+    path('send/', PushNotificationView.as_view(), name='send_notification'),
+    path('inbox/', NotificationInboxView.as_view(), name='notification_inbox'),
+    path('inbox/read/', NotificationReadView.as_view(), name='notification_read'),
+    path('inbox/unread-count/', UnreadNotificationCountView.as_view(), name='notification_unread_count'),
+    path('devices/', DeviceRegistrationView.as_view(), name='device_registration'),
+    path('broadcast/', PushBroadcastView.as_view(), name='push_broadcast'),
+    path('broadcast/<int:pk>/', PushBroadcastDetailView.as_view(), name='push_broadcast_detail'),
 ]
@@ -120,22 +120,31 @@
 #     print('Invalid device token:', e)
 # # device.send_message("Здарова, заебал!")
 
+from applications.pagination import NotificationCursorPagination
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
+from rest_framework import generics, permissions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from push_notifications.models import APNSDevice
-from .models import Notifcation
+from .models import Notifcation, PushBroadcast
+from .serializers import (
+    DeviceSerializer,
+    NotificationReadSerializer,
+    NotificationSerializer,
+    PushBroadcastSerializer,
+)
+from .services import DeviceService, NotificationService, PushService
 
 class PushNotificationView(APIView):
+    # Registering moves a known token to the caller, so the caller must be known
+    permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, format=None):
         # Get the device token from the request data
         device_token = request.data.get('device_token')
 
-        # Create an APNSDevice object with the device token
-        device = APNSDevice.objects.create(
-            registration_id=device_token
-            # cloud_message_type='APNS'
-        )
+        # Reuse the device of a known token instead of adding a row per call
+        device = DeviceService.register(device_token, user=request.user)
         notifications = Notifcation.objects.create(
             title='Hello',
             body='Privet',
@@ -153,3 +162,108 @@ class PushNotificationView(APIView):
         # Return a success response
         return Response({'message': 'Push notification sent'})
 
+
+class DeviceRegistrationView(generics.GenericAPIView):
+    serializer_class = DeviceSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description='Register the APNs token of a device of the current user. '
+        'A known token is updated and moved to this user instead of being added again.'
+    )
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                data={'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST
+            )
+        device = DeviceService.register(user=request.user, **serializer.validated_data)
+        return Response(
+            data={'id': device.pk, 'registration_id': device.registration_id, 'active': device.active}
+        )
+
+    @swagger_auto_schema(
+        request_body=DeviceSerializer,
+        operation_description='Stop sending to a device of the current user, e.g. on logout',
+    )
+    def delete(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                data={'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST
+            )
+        DeviceService.unregister(serializer.validated_data['registration_id'], request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class PushBroadcastView(generics.CreateAPIView):
+    serializer_class = PushBroadcastSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description='Push a notification to every student or staff member, '
+        'optionally of one direction. Sending happens in the background; '
+        'follow it on the broadcast detail endpoint.'
+    )
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        serializer.instance = PushService.broadcast(
+            user=self.request.user, **serializer.validated_data
+        )
+
+
+class PushBroadcastDetailView(generics.RetrieveAPIView):
+    queryset = PushBroadcast.objects.all()
+    serializer_class = PushBroadcastSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+
+class NotificationInboxView(generics.ListAPIView):
+    serializer_class = NotificationSerializer
+    pagination_class = NotificationCursorPagination
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = Notifcation.objects.filter(recipient=self.request.user)
+        if self.request.query_params.get('unread') in ('true', '1'):
+            queryset = queryset.filter(is_read=False)
+        return queryset
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'unread',
+                openapi.IN_QUERY,
+                type=openapi.TYPE_BOOLEAN,
+                description='Only unread notifications',
+            ),
+        ],
+        operation_description='Notifications of the current user, newest first',
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class NotificationReadView(generics.GenericAPIView):
+    serializer_class = NotificationReadSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(operation_description='Mark notifications of the current user read')
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                data={'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST
+            )
+        updated = NotificationService.mark_read(request.user, serializer.validated_data.get('ids'))
+        return Response(data={'updated': updated})
+
+
+class UnreadNotificationCountView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(operation_description='Unread notifications of the current user')
+    def get(self, request, *args, **kwargs):
+        return Response(data={'unread': NotificationService.unread_count(request.user.pk)})
@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .services import UserService
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWT authentication that keeps resolved users in the cache for a short while.
+
+    Saves and deletes of a user drop its entry (see `users.signals`), so the
+    timeout only bounds how long a change made without model signals, like a
+    raw `QuerySet.update()`, can go unnoticed.
+
+    Without a shared cache a drop reaches only the process that made it and
+    the others would keep a deactivated or demoted user, so then every request
+    reads the user from the database.
+    """
+
+    cache_prefix = "auth:user"
+    cache_timeout = 60
+
+    @classmethod
+    def cache_key(cls, user_id):
+        return f"{cls.cache_prefix}:{user_id}"
+
+    @classmethod
+    def invalidate(cls, *user_ids):
+        cache.delete_many([cls.cache_key(user_id) for user_id in user_ids])
+
+    def load_user(self, user_id):
+        # Annotated with the role, so profile views need no second query
+        queryset = UserService.with_role(self.user_model.objects.all())
+        user = queryset.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        return user
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        if not settings.SHARED_CACHE:
+            user = self.load_user(user_id)
+        else:
+            key = self.cache_key(user_id)
+            user = cache.get(key)
+            if user is None:
+                user = self.load_user(user_id)
+                cache.set(key, user, self.cache_timeout)
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
@@ -0,0 +1,52 @@
+# Generated by Django 4.1.5 on 2026-10-18 08:30
+
+from django.db import migrations, models
+
+
+def normalize_phone(phone):
+    # Copy of User.normalize_phone as of this migration
+    digits = "".join(char for char in phone or "" if char.isdigit())
+    if len(digits) == 10 and digits.startswith("0"):
+        digits = "996" + digits[1:]
+    return digits or None
+
+
+def fill_phone_keys(apps, schema_editor):
+    User = apps.get_model("users", "User")
+    seen = set()
+    batch = []
+    users = User.objects.exclude(phone=None).order_by("id").only("id", "phone")
+    for user in users.iterator(chunk_size=2000):
+        key = normalize_phone(user.phone)
+        # The first user keeps a key that several spellings of a phone share; the
+        # others stay without one, which User.save keeps until their phone changes
+        if key is None or key in seen:
+            continue
+        seen.add(key)
+        user.phone_key = key
+        batch.append(user)
+        if len(batch) >= 2000:
+            User.objects.bulk_update(batch, ["phone_key"])
+            batch = []
+    User.objects.bulk_update(batch, ["phone_key"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0018_alter_teacher_patent_number_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='phone_key',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.RunPython(fill_phone_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='user',
+            name='phone_key',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True, unique=True),
+        ),
+    ]
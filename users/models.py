@@ -7,6 +7,7 @@ from django.contrib.auth.models import (
 )
 from django.core.validators import MaxValueValidator
 from django.db import models
+from django.db.models import DEFERRED
 from django.utils import timezone
 from multiselectfield import MultiSelectField
 
@@ -29,6 +30,10 @@ class User(AbstractBaseUser, PermissionsMixin):
     last_name = models.CharField(max_length=255, null=True, blank=True)
     password = models.CharField(max_length=255, null=True, blank=True)
     phone = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    # Digits of `phone` in international form, the key students are matched on
+    phone_key = models.CharField(
+        max_length=32, unique=True, null=True, blank=True, editable=False
+    )
     email = models.CharField(max_length=255, unique=True, null=True, blank=True)
     work_days = MultiSelectField(
         max_choices=7,
@@ -51,6 +56,33 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return f"{self.email}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stored_phone = instance.__dict__.get("phone", DEFERRED)
+        return instance
+
+    def save(self, *args, **kwargs):
+        # The key follows changes of the phone only: a legacy user whose phone
+        # normalizes to a key someone else already holds was left without one,
+        # and deriving it again on an unrelated save would break uniqueness.
+        phone = self.__dict__.get("phone", DEFERRED)
+        if phone is not DEFERRED and phone != getattr(self, "_stored_phone", DEFERRED):
+            self.phone_key = self.normalize_phone(phone)
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None and "phone" in update_fields:
+                kwargs["update_fields"] = {*update_fields, "phone_key"}
+        super().save(*args, **kwargs)
+        self._stored_phone = phone
+
+    @staticmethod
+    def normalize_phone(phone):
+        """`+996 (555) 00-00-01` and `0555000001` both become `996555000001`."""
+        digits = "".join(char for char in phone or "" if char.isdigit())
+        if len(digits) == 10 and digits.startswith("0"):
+            digits = "996" + digits[1:]
+        return digits or None
+
 
 class Teacher(User):
     patent_number = models.CharField(max_length=255, unique=True, null=True, blank=True)
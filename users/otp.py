@@ -0,0 +1,107 @@
+import abc
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import ValidationError
+
+from .models import OTP
+
+
+class BaseOTPBackend(abc.ABC):
+    """Issues one-time codes and consumes them.
+
+    A user has at most one live code: issuing a new one revokes the previous.
+    `consume` succeeds once per code, even for concurrent requests.
+    """
+
+    ttl = 5 * 60
+    attempts = 10
+
+    @abc.abstractmethod
+    def issue(self, user):
+        """Return a new code for `user`."""
+
+    @abc.abstractmethod
+    def consume(self, code, user_id=None):
+        """Return the id of the user `code` was issued to and spend it, or None.
+
+        With `user_id`, a code issued to anyone else is left untouched.
+        """
+
+
+class CacheOTPBackend(BaseOTPBackend):
+    """Codes in the shared cache, expired by its native TTL."""
+
+    prefix = "otp"
+
+    def code_key(self, code):
+        return f"{self.prefix}:code:{code}"
+
+    def user_key(self, user_id):
+        return f"{self.prefix}:user:{user_id}"
+
+    def issue(self, user):
+        for _ in range(self.attempts):
+            code = OTP.generate_otp()
+            # `add` only writes a free key, so two live codes never collide
+            if cache.add(self.code_key(code), user.pk, self.ttl):
+                break
+        else:
+            raise ValidationError(detail={"error": "Could not issue a code, try again."})
+        previous = cache.get(self.user_key(user.pk))
+        cache.set(self.user_key(user.pk), code, self.ttl)
+        if previous is not None and previous != code:
+            self.revoke(previous, user.pk)
+        return code
+
+    def revoke(self, code, user_id):
+        if cache.get(self.code_key(code)) == user_id:
+            cache.delete(self.code_key(code))
+
+    def consume(self, code, user_id=None):
+        key = self.code_key(code)
+        owner = cache.get(key)
+        if owner is None or (user_id is not None and owner != user_id):
+            return None
+        # Of concurrent requests only the one whose delete removed the key wins
+        if not cache.delete(key):
+            return None
+        cache.delete(self.user_key(owner))
+        return owner
+
+
+class DatabaseOTPBackend(BaseOTPBackend):
+    """Codes in the `OTP` table, for deployments without a shared cache."""
+
+    def get_threshold(self):
+        return timezone.now() - timezone.timedelta(seconds=self.ttl)
+
+    def issue(self, user):
+        OTP.objects.filter(created_at__lt=self.get_threshold()).delete()
+        OTP.objects.filter(user=user).delete()
+        for _ in range(self.attempts):
+            code = OTP.generate_otp()
+            try:
+                with transaction.atomic():
+                    OTP.objects.create(user=user, otp=code)
+            except IntegrityError:
+                continue
+            return code
+        raise ValidationError(detail={"error": "Could not issue a code, try again."})
+
+    def consume(self, code, user_id=None):
+        queryset = OTP.objects.filter(otp=code, created_at__gte=self.get_threshold())
+        if user_id is not None:
+            queryset = queryset.filter(user_id=user_id)
+        otp = queryset.only("pk", "user_id").first()
+        # Of concurrent requests only the one whose DELETE removed the row wins
+        if otp is None or not OTP.objects.filter(pk=otp.pk).delete()[0]:
+            return None
+        return otp.user_id
+
+
+def get_otp_backend():
+    return import_string(settings.OTP_BACKEND)()
@@ -1,7 +1,10 @@
 from django.contrib.auth.password_validation import validate_password
 from rest_framework import fields, serializers
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
 
-from .models import OTP, Student, Teacher, User
+from .models import Student, Teacher, User
 from .services import UserService
 
 
@@ -22,7 +25,7 @@ class RegisterOfficeManagerSerializer(serializers.ModelSerializer):
         ]
 
     def validate_phone(self, value):
-        return UserService.validate_phone(value)
+        return UserService.validate_phone(value, self.instance)
 
 
 class LoginSerializer(serializers.ModelSerializer):
@@ -37,6 +40,19 @@ class LoginSerializer(serializers.ModelSerializer):
         fields = ["id", "email", "password"]
 
 
+class RefreshTokenSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        # Re-read the user so a changed role reaches the new access token
+        refresh = self.token_class(attrs["refresh"])
+        user = UserService.with_role().filter(pk=refresh[api_settings.USER_ID_CLAIM]).first()
+        if user is None:
+            raise InvalidToken("User not found")
+        access = UserService.add_claims(refresh.access_token, user)
+        data["access"] = str(access)
+        return data
+
+
 class ChangePasswordSerializer(serializers.Serializer):
     password = serializers.CharField(required=True, validators=[validate_password])
     confirm_password = serializers.CharField(required=True)
@@ -55,18 +71,18 @@ class ForgotPasswordSerializer(serializers.Serializer):
 
 
 class ConfirmationCodeSerializer(serializers.Serializer):
-    code = serializers.CharField(max_length=4)
+    code = serializers.RegexField(r"^\d{4}$")
+    email = serializers.EmailField(
+        required=False, help_text="Only accept a code sent to this address"
+    )
 
     def validate(self, data):
-        code = data.get("code")
-
-        try:
-            otp_obj = OTP.objects.get(otp=code)
-            if otp_obj.is_expired:
-                raise serializers.ValidationError({"error": "OTP has expired."})
-        except OTP.DoesNotExist:
-            raise serializers.ValidationError({"error": "Invalid OTP."})
-
+        email = data.pop("email", None)
+        if email is not None:
+            user = User.objects.filter(email=email).values_list("pk", flat=True).first()
+            if user is None:
+                raise serializers.ValidationError({"error": "Invalid OTP."})
+            data["user_id"] = user
         return data
 
 
@@ -84,7 +100,7 @@ class RegisterTeacherSerializer(serializers.ModelSerializer):
         ]
 
     def validate_phone(self, value):
-        return UserService.validate_phone(value)
+        return UserService.validate_phone(value, self.instance)
 
 
 class RegisterStudentSerializer(serializers.ModelSerializer):
@@ -93,7 +109,20 @@ class RegisterStudentSerializer(serializers.ModelSerializer):
         fields = ["id", "first_name", "last_name", "phone", "email"]
 
     def validate_phone(self, value):
-        return UserService.validate_phone(value)
+        return UserService.validate_phone(value, self.instance)
+
+
+class LeadStudentSerializer(RegisterStudentSerializer):
+    """Student of a new application: a known phone is matched, not rejected."""
+
+    class Meta(RegisterStudentSerializer.Meta):
+        extra_kwargs = {
+            "phone": {"required": True, "allow_null": False, "validators": []},
+            "email": {"validators": []},
+        }
+
+    def validate_phone(self, value):
+        return UserService.validate_phone(value, unique=False)
 
 
 class StudentSerializer(serializers.ModelSerializer):
@@ -122,7 +151,7 @@ class StudentInApplicationSerializer(serializers.ModelSerializer):
         }
 
     def validate_phone(self, value):
-        return UserService.validate_phone(value)
+        return UserService.validate_phone(value, self.instance)
 
 
 class OfficeManagerSerializer(serializers.ModelSerializer):
@@ -147,7 +176,7 @@ class OfficeManagerSerializer(serializers.ModelSerializer):
         return "office_manager"
 
     def validate_phone(self, value):
-        return UserService.validate_phone(value)
+        return UserService.validate_phone(value, self.instance)
 
 
 class TeacherSerializer(serializers.ModelSerializer):
@@ -174,7 +203,7 @@ class TeacherSerializer(serializers.ModelSerializer):
         return "teacher"
 
     def validate_phone(self, value):
-        return UserService.validate_phone(value)
+        return UserService.validate_phone(value, self.instance)
 
 
 class ProfileSerializer(serializers.ModelSerializer):
@@ -194,20 +223,13 @@ class ProfileSerializer(serializers.ModelSerializer):
         ]
 
     def get_role(self, user: User):
-        if user.is_superuser:
-            return "superadmin"
-        if user.is_staff:
-            return "office_manager"
-        if isinstance(user, Teacher):
-            return "teacher"
-        if isinstance(user, Student):
-            return "student"
+        return UserService.get_role(user)
 
     def get_full_name(self, user: User):
         return f"{user.first_name} {user.last_name}"
 
     def validate_phone(self, value):
-        return UserService.validate_phone(value)
+        return UserService.validate_phone(value, self.instance)
 
 
 class ProfileDetailSerializer(serializers.ModelSerializer):
@@ -225,9 +247,7 @@ class ProfileDetailSerializer(serializers.ModelSerializer):
         ]
 
     def get_role(self, user: User):
-        if user.is_superuser:
-            return "superadmin"
-        return "office_manager"
+        return UserService.get_role(user)
 
     def get_full_name(self, user: User):
         return f"{user.first_name} {user.last_name}"
@@ -249,8 +269,10 @@ class OfficeManagerListSerializer(serializers.ModelSerializer):
 
 
 class TeacherListSerializer(serializers.ModelSerializer):
+    """Expects teachers annotated by `TeacherService.with_direction`."""
+
     role = serializers.SerializerMethodField()
-    direction = serializers.SerializerMethodField()
+    direction = serializers.CharField(read_only=True, allow_null=True)
     full_name = serializers.SerializerMethodField()
 
     class Meta:
@@ -271,9 +293,13 @@ class TeacherListSerializer(serializers.ModelSerializer):
     def get_full_name(self, user: User):
         return f"{user.first_name} {user.last_name}"
 
-    def get_direction(self, teacher: Teacher):
-        direction = None
-        group = teacher.groups.first()  # assuming a teacher can be assigned to multiple groups, but here we are taking only the first one
-        if group:
-            direction = group.direction.name
-        return direction
+
+class StaffListSerializer(serializers.Serializer):
+    """Office managers and teachers read by `UserService.staff`, each in its own shape."""
+
+    role_serializers = {False: OfficeManagerListSerializer, True: TeacherListSerializer}
+    types = {False: "User", True: "Teacher"}
+
+    def to_representation(self, user: User):
+        data = self.role_serializers[user.is_teacher](user, context=self.context).data
+        return {**data, "type": self.types[user.is_teacher]}
@@ -1,6 +1,12 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.db.models.constants import OnConflict
 from rest_framework.exceptions import NotFound
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import Student, Teacher
 
 User = get_user_model()
 
@@ -16,11 +22,156 @@ class UserService:
             raise NotFound(detail={'error': ('User not found!')})
 
     @classmethod
-    def validate_phone(cls, value):
+    def with_role(cls, queryset=None):
+        """Annotate `is_teacher` and `is_student`, which a base `User` row cannot tell."""
+        queryset = cls.model.objects.all() if queryset is None else queryset
+        return queryset.annotate(
+            is_teacher=Exists(Teacher.objects.filter(pk=OuterRef('pk'))),
+            is_student=Exists(Student.objects.filter(pk=OuterRef('pk'))),
+        )
+
+    @classmethod
+    def get_role(cls, user):
+        if user.is_superuser:
+            return 'superadmin'
+        if user.is_staff:
+            return 'office_manager'
+        if not hasattr(user, 'is_teacher'):
+            user = cls.with_role().get(pk=user.pk)
+        if user.is_teacher:
+            return 'teacher'
+        if user.is_student:
+            return 'student'
+        return None
+
+    @classmethod
+    def add_claims(cls, token, user):
+        """Put what clients need at startup into `token`, sparing a profile request."""
+        role = cls.get_role(user)
+        token['role'] = role
+        token['full_name'] = f'{user.first_name} {user.last_name}'
+        # Teachers and students share their user's primary key
+        token['subtype_id'] = user.pk if role in ('teacher', 'student') else None
+        return token
+
+    @classmethod
+    def get_tokens(cls, user):
+        """A refresh token and its access token, both carrying the profile claims."""
+        refresh = cls.add_claims(RefreshToken.for_user(user), user)
+        return refresh, refresh.access_token
+
+    @classmethod
+    def staff(cls):
+        """Office managers and teachers as one queryset, teachers flagged `is_teacher`."""
+        users = cls.model.objects.annotate(
+            is_teacher=Exists(Teacher.objects.filter(pk=OuterRef('pk')))
+        )
+        return TeacherService.with_direction(users.filter(Q(is_staff=True) | Q(is_teacher=True)))
+
+    @classmethod
+    def phone_error(cls, value):
         if not value[1:].isnumeric():
-            raise serializers.ValidationError({'error':'Phone must be numeric symbols'})
+            return 'Phone must be numeric symbols'
         if value[:4] != '+996':
-            raise serializers.ValidationError({'error':'Phone number should start with +996 '})
+            return 'Phone number should start with +996 '
         elif len(value) != 13:
-            raise serializers.ValidationError({'error':'Phone number must be 13 characters long'})
-        return value
\ No newline at end of file
+            return 'Phone number must be 13 characters long'
+        return None
+
+    @classmethod
+    def validate_phone(cls, value, instance=None, unique=True):
+        """Check the format of `value` and, with `unique`, that no one else has it.
+
+        Other spellings of a phone count as the same phone: they share its
+        `phone_key`, which is unique. A user keeping their own phone passes.
+        """
+        error = cls.phone_error(value)
+        if error is not None:
+            raise serializers.ValidationError({'error': error})
+        if unique and (instance is None or instance.phone != value):
+            others = cls.model.objects.filter(phone_key=cls.model.normalize_phone(value))
+            if instance is not None:
+                others = others.exclude(pk=instance.pk)
+            if others.exists():
+                raise serializers.ValidationError({'error': 'User with this phone already exists'})
+        return value
+
+    @classmethod
+    def validate_phones(cls, values):
+        """Validate a batch of phones at once, returning {index: error} of the bad ones."""
+        errors = {}
+        for index, value in enumerate(values):
+            error = cls.phone_error(value or '')
+            if error is not None:
+                errors[index] = error
+        return errors
+
+
+class TeacherService:
+    model = Teacher
+
+    @classmethod
+    def with_direction(cls, queryset=None):
+        """Annotate `direction` with the direction name of the teacher's first group."""
+        from applications.models import Groups
+
+        queryset = cls.model.objects.all() if queryset is None else queryset
+        directions = Groups.objects.filter(teacher=OuterRef('pk'), direction__isnull=False)
+        return queryset.annotate(
+            direction=Subquery(directions.order_by('pk').values('direction__name')[:1])
+        )
+
+
+class StudentService:
+    model = Student
+
+    @classmethod
+    def add_student_rows(cls, user_ids):
+        """Add the Student half of multi-table rows whose User half already exists.
+
+        `bulk_create` refuses multi-table inherited models, so the child rows
+        are inserted with their model defaults in one `executemany`, skipping
+        users that already are students where the database supports it.
+        """
+        fields = cls.model._meta.local_concrete_fields
+        sql = 'INSERT INTO {} ({}) VALUES ({}) {}'.format(
+            connection.ops.quote_name(cls.model._meta.db_table),
+            ', '.join(connection.ops.quote_name(field.column) for field in fields),
+            ', '.join(['%s'] * len(fields)),
+            connection.ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, None, None),
+        )
+        params = []
+        for pk in user_ids:
+            student = cls.model(user_ptr_id=pk)
+            params.append(
+                [field.get_db_prep_save(getattr(student, field.attname), connection) for field in fields]
+            )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+
+    @classmethod
+    def upsert(cls, phone, **fields):
+        """Return the student with this phone, creating it when there is none.
+
+        Students are matched on `User.phone_key`, so spellings of one number
+        share a student. A new user row is inserted with `ON CONFLICT DO
+        NOTHING` where supported, which makes concurrent upserts of one phone
+        converge on a single student.
+        """
+        key = User.normalize_phone(phone)
+        student = cls.model.objects.filter(phone_key=key).first()
+        if student is not None:
+            return student
+        User.objects.bulk_create(
+            [User(phone=phone, phone_key=key, **fields)], ignore_conflicts=True
+        )
+        user = User.objects.filter(phone_key=key).first()
+        if user is None:
+            # The phone or email is taken by a differently spelled row
+            raise serializers.ValidationError({'error': 'Phone or email is already taken'})
+        if user.is_staff or Teacher.objects.filter(pk=user.pk).exists():
+            raise serializers.ValidationError(
+                {'error': 'Phone belongs to a user who is not a student'}
+            )
+        cls.add_student_rows([user.pk])
+        return cls.model.objects.get(pk=user.pk)
@@ -0,0 +1,26 @@
+from applications.signals import post_bulk_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import CachedJWTAuthentication
+from .models import Student, User
+
+
+def invalidate_cached_users(*user_ids):
+    # Again after commit, in case a request cached the old row in between
+    CachedJWTAuthentication.invalidate(*user_ids)
+    transaction.on_commit(lambda: CachedJWTAuthentication.invalidate(*user_ids))
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Teachers and students are sent with their own model as sender
+    if isinstance(instance, User):
+        invalidate_cached_users(instance.pk)
+
+
+@receiver(post_bulk_save, sender=Student)
+def invalidate_bulk_cached_users(sender, ids, **kwargs):
+    invalidate_cached_users(*ids)
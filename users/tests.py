@@ -1,3 +1,275 @@
-from django.test import TestCase
+import datetime
+from unittest import mock
 
-# Create your tests here.
+from applications.models import Direction, Groups
+from django.core import mail
+from django.core.cache import cache
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import CachedJWTAuthentication
+from .models import OTP, Student, Teacher, User
+from .otp import CacheOTPBackend, DatabaseOTPBackend
+from .serializers import LeadStudentSerializer, ProfileSerializer, RegisterStudentSerializer
+
+
+class StaffListTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create(email="manager@example.com", phone="+996555000001", is_staff=True)
+        directions = [
+            Direction.objects.create(name=name, duration=3) for name in ("Python", "JavaScript")
+        ]
+        for i in range(5):
+            teacher = Teacher.objects.create(
+                email=f"teacher{i}@example.com", phone=f"+996700{i:06d}"
+            )
+            if i:
+                for direction in directions:
+                    Groups.objects.create(
+                        name=f"{direction.name}-{i}",
+                        teacher=teacher,
+                        direction=direction,
+                        start_date=datetime.date.today(),
+                    )
+
+    def test_one_query_per_page(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("all_staff"), {"limit": 100})
+        directions = {
+            item["phone"]: item["direction"] for item in response.data["results"] if item["role"] == "teacher"
+        }
+        self.assertEqual(directions.pop("+996700000000"), None)
+        self.assertEqual(set(directions.values()), {"Python"})
+
+    def test_managers_then_teachers_paginated_in_the_database(self):
+        response = self.client.get(reverse("all_staff"), {"limit": 2, "offset": 0})
+        self.assertEqual(response.data["count"], 6)
+        self.assertEqual(
+            [(item["type"], item["role"]) for item in response.data["results"]],
+            [("User", "office_manager"), ("Teacher", "teacher")],
+        )
+        self.assertNotIn("direction", response.data["results"][0])
+
+    def test_search_does_not_leak_into_next_request(self):
+        Teacher.objects.filter(phone="+996700000001").update(first_name="Aibek")
+        response = self.client.get(reverse("all_staff"), {"search": "aibek"})
+        self.assertEqual([item["phone"] for item in response.data["results"]], ["+996700000001"])
+        response = self.client.get(reverse("all_staff"))
+        self.assertEqual(response.data["count"], 6)
+
+
+@override_settings(SHARED_CACHE=True)
+class CachedJWTAuthenticationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Teacher.objects.create(email="teacher@example.com", phone="+996700000001")
+
+    def setUp(self):
+        cache.clear()
+        token = AccessToken.for_user(self.user)
+        self.request = APIRequestFactory().get("/", HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def authenticate(self):
+        return CachedJWTAuthentication().authenticate(self.request)[0]
+
+    def test_user_is_read_once(self):
+        with self.assertNumQueries(1):
+            self.authenticate()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate().pk, self.user.pk)
+
+    def test_saving_the_user_drops_the_cached_copy(self):
+        self.authenticate()
+        self.user.is_archive = True
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertTrue(self.authenticate().is_archive)
+
+        # Raw updates send no signal and wait for the timeout or an explicit drop
+        User.objects.filter(pk=self.user.pk).update(first_name="Aibek")
+        self.assertIsNone(self.authenticate().first_name)
+        CachedJWTAuthentication.invalidate(self.user.pk)
+        self.assertEqual(self.authenticate().first_name, "Aibek")
+
+    def test_deleted_user_is_rejected(self):
+        self.authenticate()
+        self.user.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    @override_settings(SHARED_CACHE=False)
+    def test_user_is_read_every_time_without_a_shared_cache(self):
+        self.authenticate()
+        # A save in another process drops only that process's entry
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        with self.assertNumQueries(1):
+            self.assertTrue(self.authenticate().is_staff)
+
+    def test_profile_update_does_not_restore_revoked_flags(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.client.credentials(HTTP_AUTHORIZATION=self.request.META["HTTP_AUTHORIZATION"])
+        self.client.get(reverse("retrieve_update_profile"))
+        # Demoted while the cached copy still has the flag
+        User.objects.filter(pk=self.user.pk).update(is_staff=False)
+        response = self.client.patch(reverse("retrieve_update_profile"), {"first_name": "Aibek"})
+        self.assertEqual(response.status_code, 200)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.first_name, "Aibek")
+        self.assertFalse(user.is_staff)
+
+
+class TokenClaimsTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = Teacher.objects.create(
+            email="teacher@example.com", phone="+996700000001", first_name="Aibek", last_name="Asanov"
+        )
+        cls.teacher.set_password("secret123")
+        cls.teacher.save()
+
+    def setUp(self):
+        cache.clear()
+
+    def claims(self, token):
+        token = AccessToken(token)
+        return token["role"], token["full_name"], token["subtype_id"]
+
+    def test_login_and_confirm_code_issue_profile_claims(self):
+        response = self.client.post(
+            reverse("login"), {"email": "teacher@example.com", "password": "secret123"}
+        )
+        self.assertEqual(
+            self.claims(response.data["access"]), ("teacher", "Aibek Asanov", self.teacher.pk)
+        )
+
+        OTP.objects.create(user=self.teacher, otp="1234")
+        response = self.client.post(reverse("confirm-code"), {"code": "1234"})
+        self.assertEqual(self.claims(response.data["access"])[0], "teacher")
+
+    def test_refresh_reads_the_current_role(self):
+        refresh = self.client.post(
+            reverse("login"), {"email": "teacher@example.com", "password": "secret123"}
+        ).data["refresh"]
+        User.objects.filter(pk=self.teacher.pk).update(is_staff=True)
+        with self.assertNumQueries(1):
+            response = self.client.post(reverse("refresh_token"), {"refresh": refresh})
+        self.assertEqual(self.claims(response.data["access"]), ("office_manager", "Aibek Asanov", None))
+
+    def test_profile_role_of_a_teacher(self):
+        access = AccessToken.for_user(self.teacher)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("retrieve_update_profile"))
+        self.assertEqual(response.data["role"], "teacher")
+
+
+class OTPBackendTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create(email=f"user{i}@example.com", phone=f"+996555{i:06d}")
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_codes_are_consumed_once(self):
+        for backend in (CacheOTPBackend(), DatabaseOTPBackend()):
+            with self.subTest(backend=type(backend).__name__):
+                first = backend.issue(self.users[0])
+                second = backend.issue(self.users[0])
+                self.assertIsNone(backend.consume(first))
+                self.assertIsNone(backend.consume(second, self.users[1].pk))
+                self.assertEqual(backend.consume(second, self.users[0].pk), self.users[0].pk)
+                self.assertIsNone(backend.consume(second))
+
+    def test_issue_retries_taken_codes(self):
+        for backend in (CacheOTPBackend(), DatabaseOTPBackend()):
+            with self.subTest(backend=type(backend).__name__):
+                with mock.patch.object(OTP, "generate_otp", side_effect=["1111", "1111", "2222"]):
+                    self.assertEqual(backend.issue(self.users[0]), "1111")
+                    self.assertEqual(backend.issue(self.users[1]), "2222")
+
+    def test_database_backend_expires_and_purges_codes(self):
+        backend = DatabaseOTPBackend()
+        code = backend.issue(self.users[0])
+        OTP.objects.update(created_at=timezone.now() - datetime.timedelta(minutes=10))
+        self.assertIsNone(backend.consume(code))
+        backend.issue(self.users[1])
+        self.assertEqual(list(OTP.objects.values_list("user", flat=True)), [self.users[1].pk])
+
+    @override_settings(OTP_BACKEND="users.otp.CacheOTPBackend")
+    def test_forgot_password_and_confirm_code(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("forgot-password"), {"email": "user0@example.com"})
+        code = mail.outbox[0].body.rsplit(" ", 1)[1]
+        self.assertFalse(OTP.objects.exists())
+
+        data = {"code": code, "email": "user1@example.com"}
+        self.assertEqual(self.client.post(reverse("confirm-code"), data).status_code, 400)
+        data["email"] = "user0@example.com"
+        response = self.client.post(reverse("confirm-code"), data)
+        self.assertEqual(response.data["user_id"], str(self.users[0].pk))
+        self.assertEqual(self.client.post(reverse("confirm-code"), data).status_code, 400)
+
+
+class PhoneKeyTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = Student.objects.create(email="owner@example.com", phone="0555000001")
+        # A legacy duplicate spelling, left without a key by the migration
+        cls.legacy = Student.objects.create(email="legacy@example.com", phone="+996555000009")
+        Student.objects.filter(pk=cls.legacy.pk).update(phone="+996555000001", phone_key=None)
+
+    def test_saving_a_legacy_duplicate_keeps_it_keyless(self):
+        legacy = User.objects.get(pk=self.legacy.pk)
+        legacy.is_archive = True
+        legacy.save()
+        legacy.first_name = "Aibek"
+        legacy.save(update_fields=["first_name"])
+        legacy.refresh_from_db()
+        self.assertEqual((legacy.first_name, legacy.phone_key), ("Aibek", None))
+
+        legacy.phone = "+996555000002"
+        legacy.save(update_fields=["phone"])
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.phone_key, "996555000002")
+
+    def test_serializers_reject_another_spelling_of_a_taken_phone(self):
+        data = {"email": "new@example.com", "phone": "+996555000001"}
+        serializer = RegisterStudentSerializer(data=data)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn("phone", serializer.errors)
+        # Leads are matched on the phone instead
+        self.assertTrue(LeadStudentSerializer(data=data).is_valid())
+
+        other = User.objects.create(email="other@example.com", phone="+996555000003")
+        serializer = ProfileSerializer(other, data={"phone": "+996555000001"}, partial=True)
+        self.assertFalse(serializer.is_valid())
+        serializer = ProfileSerializer(other, data={"phone": "+996555000004"}, partial=True)
+        self.assertTrue(serializer.is_valid())
+
+    def test_keeping_ones_own_phone_is_valid(self):
+        legacy = User.objects.get(pk=self.legacy.pk)
+        serializer = ProfileSerializer(
+            legacy, data={"first_name": "Aibek", "phone": legacy.phone}, partial=True
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        self.assertEqual(User.objects.get(pk=legacy.pk).first_name, "Aibek")
+
+    def test_profile_edits(self):
+        url = reverse("retrieve_update_profile")
+        self.client.force_authenticate(User.objects.get(pk=self.legacy.pk))
+        response = self.client.patch(url, {"first_name": "Aibek", "phone": "+996555000001"})
+        self.assertEqual(response.status_code, 200)
+
+        self.client.force_authenticate(User.objects.create(email="other@example.com"))
+        response = self.client.patch(url, {"phone": "+996555000001"})
+        self.assertEqual(response.status_code, 400)
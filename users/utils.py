@@ -1,13 +1,12 @@
-from django.core.mail import EmailMessage
+from notifications.services import EmailOutboxService
 
 
 class Util:
 
     @staticmethod
     def send_email(data):
-        email = EmailMessage(
+        EmailOutboxService.enqueue(
             subject=data["email_subject"],
             body=data["email_body"],
             to=[data["to_email"]],
         )
-        email.send()
\ No newline at end of file
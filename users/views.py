@@ -1,26 +1,24 @@
 import random
 import string
 
+from applications.exports import StreamingExportMixin
 from applications.pagination import CustomPagination
 from cms import settings
-from django.core.mail import send_mail
-from django.db.models import Q
 from django_filters.rest_framework import DjangoFilterBackend
-from drf_multiple_model.pagination import MultipleModelLimitOffsetPagination
-from drf_multiple_model.views import (
-    FlatMultipleModelAPIView,
-    ObjectMultipleModelAPIView,
-)
+from drf_multiple_model.views import ObjectMultipleModelAPIView
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
+from notifications.services import EmailOutboxService
 from rest_framework import (
     exceptions,
     filters,
     generics,
+    pagination,
     status,
     viewsets,
 )
 from rest_framework.authentication import SessionAuthentication
+from rest_framework.decorators import action
 from rest_framework.exceptions import (
     AuthenticationFailed,
     NotAcceptable,
@@ -30,15 +28,14 @@ from rest_framework.exceptions import (
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenRefreshView
 
 from .models import (
-    OTP,
     Student,
     Teacher,
     User,
 )
+from .otp import get_otp_backend
 from .permissions import IsSuperUser
 from .serializers import (
     ChangePasswordSerializer,
@@ -51,15 +48,17 @@ from .serializers import (
     ProfileSerializer,
     RegisterOfficeManagerSerializer,
     RegisterStudentSerializer,
+    RefreshTokenSerializer,
     RegisterTeacherSerializer,
+    StaffListSerializer,
     StudentSerializer,
-    TeacherListSerializer,
     TeacherSerializer,
 )
+from .services import UserService
 from .utils import Util
 
 
-class CustomMultipleModelLimitOffsetPagination(MultipleModelLimitOffsetPagination):
+class StaffLimitOffsetPagination(pagination.LimitOffsetPagination):
     default_limit = 10
     max_limit = 100
 
@@ -148,20 +147,20 @@ class LoginView(APIView):
         email = request.data["email"]
         password = request.data["password"]
 
-        user = User.objects.filter(email=email).first()
+        user = UserService.with_role().filter(email=email).first()
 
         if user is None:
             raise AuthenticationFailed(detail={"error": "User not found!"})
         if not user.check_password(password):
             raise AuthenticationFailed(detail={"error": "Incorrect password!"})
 
-        refresh = RefreshToken.for_user(user)
+        refresh, access = UserService.get_tokens(user)
 
         return Response(
             {
                 "user_id": user.id,
                 "refresh": str(refresh),
-                "access": str(refresh.access_token),
+                "access": str(access),
             },
             status=status.HTTP_200_OK,
         )
@@ -176,6 +175,7 @@ class LoginView(APIView):
 
 class RefreshTokenView(TokenRefreshView):
     permission_classes = (AllowAny,)
+    serializer_class = RefreshTokenSerializer
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -235,14 +235,13 @@ class ForgotPasswordView(generics.GenericAPIView):
                     {"error": "User with this email does not exist."},
                     status=status.HTTP_404_NOT_FOUND,
                 )
-            otp_code = OTP.generate_otp()
-            OTP.objects.create(user=user, otp=otp_code)
+            otp_code = get_otp_backend().issue(user)
             # Send the OTP to the user's email
             subject = "Forgot Password OTP"
             message = f"Your OTP is: {otp_code}"
             from_email = settings.EMAIL_HOST_USER
             recipient_list = [email]
-            send_mail(subject, message, from_email, recipient_list)
+            EmailOutboxService.enqueue(subject, message, recipient_list, from_email)
 
             return Response(
                 {"message": "OTP sent to your email."}, status=status.HTTP_200_OK
@@ -269,28 +268,26 @@ class ConfirmCodeView(generics.GenericAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        code = serializer.validated_data.get("code")
-        try:
-            confirmation_code = OTP.objects.get(otp=code)
-        except OTP.DoesNotExist:
+        user_id = get_otp_backend().consume(
+            serializer.validated_data["code"], serializer.validated_data.get("user_id")
+        )
+        user = UserService.with_role().filter(pk=user_id).first() if user_id else None
+        if user is None:
             return Response({"error": "Invalid or already confirmed code."}, status=400)
 
-        user = confirmation_code.user
-        confirmation_code.delete()
-
-        refresh = RefreshToken.for_user(user)
+        refresh, access = UserService.get_tokens(user)
 
         return Response(
             {
                 "message": "Code confirmed successfully.",
                 "user_id": str(user.id),
                 "refresh": str(refresh),
-                "access": str(refresh.access_token),
+                "access": str(access),
             }
         )
 
 
-class TeacherViewSet(viewsets.ModelViewSet):
+class TeacherViewSet(StreamingExportMixin, viewsets.ModelViewSet):
     queryset = Teacher.objects.all()
     serializer_class = TeacherSerializer
     pagination_class = CustomPagination
@@ -302,9 +299,39 @@ class TeacherViewSet(viewsets.ModelViewSet):
     filterset_fields = ["is_archive"]
     search_fields = ["first_name", "last_name", "email", "patent_number"]
     ordering_fields = ["first_name", "last_name", "email", "patent_number"]
+    export_name = "teachers"
+    export_fields = {
+        "id": "id",
+        "first_name": "first_name",
+        "last_name": "last_name",
+        "phone": "phone",
+        "email": "email",
+        "patent_number": "patent_number",
+        "patent_term": "patent_term",
+        "is_archive": "is_archive",
+    }
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                "format",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                enum=["csv", "ndjson"],
+                description="Export format, csv by default",
+            ),
+        ]
+    )
+    @action(
+        detail=False,
+        renderer_classes=StreamingExportMixin.export_renderer_classes,
+        permission_classes=StreamingExportMixin.export_permission_classes,
+    )
+    def export(self, request):
+        return super().export(request)
 
 
-class StudentViewSet(viewsets.ModelViewSet):
+class StudentViewSet(StreamingExportMixin, viewsets.ModelViewSet):
     queryset = Student.objects.all()
     serializer_class = StudentSerializer
     pagination_class = CustomPagination
@@ -316,6 +343,37 @@ class StudentViewSet(viewsets.ModelViewSet):
     filterset_fields = ["is_archive"]
     search_fields = ["first_name", "last_name", "email"]
     ordering_fields = ["first_name", "last_name", "email", "status"]
+    export_name = "students"
+    export_fields = {
+        "id": "id",
+        "first_name": "first_name",
+        "last_name": "last_name",
+        "phone": "phone",
+        "email": "email",
+        "status": "status",
+        "payment": "payment",
+        "is_blacklist": "is_blacklist",
+        "is_archive": "is_archive",
+    }
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                "format",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                enum=["csv", "ndjson"],
+                description="Export format, csv by default",
+            ),
+        ]
+    )
+    @action(
+        detail=False,
+        renderer_classes=StreamingExportMixin.export_renderer_classes,
+        permission_classes=StreamingExportMixin.export_permission_classes,
+    )
+    def export(self, request):
+        return super().export(request)
 
 
 class OfficeManagerViewSet(viewsets.ModelViewSet):
@@ -337,11 +395,12 @@ class AdminProfileRetrieveUpdateView(generics.RetrieveUpdateAPIView):
     serializer_class = ProfileSerializer
 
     def get_object(self):
-        return self.request.user
+        # Fresh from the database: `request.user` may be a cached copy, and
+        # saving it would write stale flags like `is_staff` back
+        return UserService.with_role().get(pk=self.request.user.pk)
 
     def get(self, request, *args, **kwargs):
-        user = self.get_object()
-        serializer = ProfileDetailSerializer(user)
+        serializer = ProfileDetailSerializer(request.user)
         return Response(serializer.data)
 
     def update(self, request, *args, **kwargs):
@@ -356,50 +415,14 @@ class AdminProfileRetrieveUpdateView(generics.RetrieveUpdateAPIView):
             )
 
 
-class UserAndTeacherListView(FlatMultipleModelAPIView):
-    pagination_class = CustomMultipleModelLimitOffsetPagination
-    querylist = [
-        {
-            "queryset": User.objects.filter(is_staff=True),
-            "serializer_class": OfficeManagerListSerializer,
-        },
-        {
-            "queryset": Teacher.objects.all(),
-            "serializer_class": TeacherListSerializer,
-        },
-    ]
+class UserAndTeacherListView(generics.ListAPIView):
+    serializer_class = StaffListSerializer
+    pagination_class = StaffLimitOffsetPagination
+    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    search_fields = ["first_name", "last_name"]
+    ordering_fields = ["first_name", "last_name"]
+    # Office managers first, then teachers
+    ordering = ["is_teacher", "id"]
 
     def get_queryset(self):
-        search = self.request.query_params.get("search", None)
-        if search:
-            # Update each queryset in the querylist with a filtered queryset
-            for query in self.querylist:
-                model = query["queryset"].model
-                if model == User:
-                    query["queryset"] = query["queryset"].filter(
-                        Q(first_name__icontains=search) | Q(last_name__icontains=search)
-                    )
-                elif model == Teacher:
-                    query["queryset"] = query["queryset"].filter(
-                        Q(first_name__icontains=search) | Q(last_name__icontains=search)
-                    )
-        return super().get_queryset()
-
-    def get_serializer_class(self):
-        for query in self.querylist:
-            if self.get_queryset() == query["queryset"]:
-                return query["serializer_class"]
-        return None
-
-    @swagger_auto_schema(
-        manual_parameters=[
-            openapi.Parameter(
-                "search",
-                openapi.IN_QUERY,
-                type=openapi.TYPE_STRING,
-                description="Search query",
-            ),
-        ],
-    )
-    def get(self, request, *args, **kwargs):
-        return super().get(request, *args, **kwargs)
+        return UserService.staff()